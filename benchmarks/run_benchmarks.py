@@ -0,0 +1,158 @@
+# benchmarks/run_benchmarks.py
+"""端到端基准测试：使用离线 mock LLM 运行完整的 CreativeWorkflow，不需要 API Key。
+
+每个规模（默认 5、50、500 章）在独立子进程中运行，以便分别测量峰值内存。报告：
+novels/hour、chapters/sec、步骤（任务）延迟 p50/p99、LLM 调用延迟 p50/p99 和峰值 RSS。
+
+用法（在项目根目录下）：
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --sizes 5,50 --latency 0.2 --tokens-per-second 400 --concurrency 8
+    python benchmarks/run_benchmarks.py --async --concurrency 500
+    python benchmarks/run_benchmarks.py --pipeline --tokens-per-second 200
+    python benchmarks/run_benchmarks.py --slow-rate 0.1 --slow-delay 2 --hedge
+    python benchmarks/run_benchmarks.py --scenes 4 --tokens-per-second 100
+    python benchmarks/run_benchmarks.py --output data/benchmark.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def run_single(args) -> dict:
+    """在当前进程中运行一部 mock 小说并返回测量结果。"""
+    from src.llm_client import LLMClientFactory
+    from src.persistence import FileStorage
+    from src.workflow import CreativeWorkflow
+
+    logging.basicConfig(level=logging.WARNING)
+    config = {
+        "provider": "mock",
+        "modelId": "mock",
+        "chapters": args.chapters,
+        "chapterWords": args.chapter_words,
+        "latency": args.latency,
+        "latencyJitter": args.latency * 0.2,
+        "tokensPerSecond": args.tokens_per_second,
+        "failureRate": args.failure_rate,
+        "slowRate": args.slow_rate,
+        "slowDelay": args.slow_delay,
+        "retryBaseDelay": 0.01,
+        "retryMaxDelay": 0.1,
+        "maxRetries": 8,
+    }
+    if args.hedge:
+        # 两个 mock 后端（不同 seed，慢请求互不相关），对超过 p95 的调用发出对冲请求
+        from src.llm_routing import RoutingLLMClient
+        models = {"main": config, "backup": {**config, "modelId": "mock-backup", "seed": 1}}
+        llm = RoutingLLMClient.from_config(models, {"default": ["main", "backup"], "hedgeMinSamples": 10,
+                                                    "hedgeDelay": max(0.05, args.latency * 3)})
+    else:
+        llm = LLMClientFactory(config)
+    data_dir = tempfile.mkdtemp(prefix="novel-bench-")
+    try:
+        workflow = CreativeWorkflow(f"benchmark novel with {args.chapters} chapters", FileStorage(data_dir), llm,
+                                    max_concurrency=args.concurrency, pipelined=args.pipeline,
+                                    scenes_per_chapter=args.scenes)
+        started = time.perf_counter()
+        if args.use_async:
+            asyncio.run(workflow.astart_workflow())
+        else:
+            workflow.start_workflow()
+        elapsed = time.perf_counter() - started
+        progress = workflow.story_state_manager.overall_progress
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    steps = [t["duration"] for t in workflow.metrics.tasks]
+    calls = [c["latency"] for c in workflow.metrics.llm_calls]
+    chapters = progress.get("chapters_written", 0)
+    return {
+        "chapters": args.chapters,
+        "chapters_written": chapters,
+        "status": progress.get("status"),
+        "seconds": round(elapsed, 3),
+        "novels_per_hour": round(3600 / elapsed, 1) if elapsed else 0.0,
+        "chapters_per_sec": round(chapters / elapsed, 2) if elapsed else 0.0,
+        "step_p50": round(percentile(steps, 0.5), 4),
+        "step_p99": round(percentile(steps, 0.99), 4),
+        "llm_p50": round(percentile(calls, 0.5), 4),
+        "llm_p99": round(percentile(calls, 0.99), 4),
+        "hedged_calls": sum(1 for c in workflow.metrics.llm_calls if c.get("hedged")),
+        # 编排开销：总耗时中未被 LLM 调用覆盖的部分（按并发度折算）
+        "overhead_seconds": round(max(0.0, elapsed - sum(calls) / max(1, args.concurrency)), 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark for CreativeWorkflow")
+    parser.add_argument("--sizes", default="5,50,500", help="逗号分隔的章节数列表")
+    parser.add_argument("--concurrency", type=int, default=8, help="章节并发数")
+    parser.add_argument("--latency", type=float, default=0.05, help="每次调用的首 token 延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=None, help="模拟的生成速度，默认瞬时生成")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="模拟的可重试失败比例")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="模拟的慢请求（长尾）比例")
+    parser.add_argument("--slow-delay", type=float, default=2.0, help="慢请求额外的首 token 延迟（秒）")
+    parser.add_argument("--hedge", action="store_true", help="通过路由客户端调用两个 mock 后端，对慢请求发出对冲请求")
+    parser.add_argument("--scenes", type=int, default=0, help="分场景模式：每章的场景数（0 表示整章一次生成）")
+    parser.add_argument("--chapter-words", type=int, default=1000, help="每章词数")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="使用异步工作流（单个事件循环）")
+    parser.add_argument("--pipeline", action="store_true", help="流水线模式（角色逐个产出，章节提前开始）")
+    parser.add_argument("--output", default=None, help="将结果写入 JSON 文件")
+    parser.add_argument("--chapters", type=int, default=None, help=argparse.SUPPRESS)  # 子进程内部使用
+    args = parser.parse_args()
+
+    if args.chapters is not None:
+        print(json.dumps(run_single(args)))
+        return
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        command = [sys.executable, os.path.abspath(__file__), "--chapters", str(size),
+                   "--concurrency", str(args.concurrency), "--latency", str(args.latency),
+                   "--failure-rate", str(args.failure_rate), "--chapter-words", str(args.chapter_words),
+                   "--slow-rate", str(args.slow_rate), "--slow-delay", str(args.slow_delay), "--scenes", str(args.scenes)]
+        if args.use_async:
+            command.append("--async")
+        if args.pipeline:
+            command.append("--pipeline")
+        if args.hedge:
+            command.append("--hedge")
+        if args.tokens_per_second:
+            command += ["--tokens-per-second", str(args.tokens_per_second)]
+        completed = subprocess.run(command, capture_output=True, text=True, check=True)
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    columns = ["chapters", "seconds", "novels_per_hour", "chapters_per_sec", "step_p50", "step_p99",
+               "llm_p50", "llm_p99", "hedged_calls", "overhead_seconds", "peak_rss_mb"]
+    print("  ".join(f"{c:>16}" for c in columns))
+    for result in results:
+        print("  ".join(f"{result[c]:>16}" for c in columns))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": {k: v for k, v in vars(args).items() if k not in ("output", "chapters")},
+                       "results": results}, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
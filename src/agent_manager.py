@@ -20,6 +20,13 @@ class AgentManager:
         else:
             return {"status": "error", "message": f"Agent {agent_name} not found."}
 
+    async def adispatch_task(self, agent_name: str, task: dict) -> dict:
+        agent = self.get_agent(agent_name)
+        if agent:
+            return await agent.aexecute_task(task)
+        else:
+            return {"status": "error", "message": f"Agent {agent_name} not found."}
+
     def send_message(self, agent_name: str, message: dict) -> dict:
         agent = self.get_agent(agent_name)
         if agent:
@@ -3,4 +3,6 @@
 from .base_agent import BaseAgent
 from .outline_agent import OutlineAgent
 from .chapter_agent import ChapterAgent
-from .character_agent import CharacterAgent
\ No newline at end of file
+from .character_agent import CharacterAgent
+from .json_output import extract_json, generate_json, stream_json, JSONExtractionError
+from .prompts import PromptTemplate, PrefixCache
@@ -1,5 +1,6 @@
 # src/agents/base_agent.py
 
+import asyncio
 from abc import ABC, abstractmethod
 
 class BaseAgent(ABC):
@@ -12,6 +13,11 @@ class BaseAgent(ABC):
         """执行特定任务的抽象方法。"""
         pass
 
+    async def aexecute_task(self, task: dict) -> dict:
+        """execute_task 的异步版本。默认在线程中运行同步实现；子类可改用 llm.agenerate_text 原生实现，
+        这样在途的 LLM 调用不会占用线程。"""
+        return await asyncio.to_thread(self.execute_task, task)
+
     @abstractmethod
     def communicate(self, message: dict) -> dict:
         """与其他智能体通信的抽象方法。"""
@@ -1,47 +1,255 @@
 # src/agents/chapter_agent.py
 
+import asyncio
+import contextvars
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 from .base_agent import BaseAgent
+from .prompts import PromptTemplate, PrefixCache
+from .json_output import generate_json, agenerate_json, JSONExtractionError
+
+# 分场景模式下整章的目标字数，按场景数平分
+CHAPTER_WORDS = 1000
+
+CHAPTER_PREFIX_TEMPLATE = PromptTemplate("""
+    You are a professional novelist writing a novel chapter by chapter. Every chapter you write must:
+    - Follow the given title and summary.
+    - Integrate the provided characters naturally, reflecting their personalities and roles.
+    - Stay consistent with the story so far and continue naturally from the previous chapter.
+    - Advance the plot in an interesting way.
+    - Be well-written, with vivid descriptions and compelling dialogue.
+
+    Characters involved in the story:
+    {character_details}
+""")
+
+STORY_SECTION_TEMPLATE = PromptTemplate("""
+    Story so far (summaries of earlier chapters, ending with how the previous chapter ended):
+    {story_context}
+""")
+
+# 章节长度要求放在这里而不是共享前缀中：分场景模式的各场景共用前缀，长度由场景要求单独给出
+CHAPTER_TEMPLATE = PromptTemplate("""
+    {story_section}Write an engaging and coherent chapter of approximately 800-1200 words based on the following information.
+
+    Chapter Title: {chapter_title}
+    Chapter Summary: {chapter_summary}
+
+    Begin writing the chapter now.
+""")
+
+SCENE_PLAN_SCHEMA = {
+    "type": "object",
+    "required": ["scenes"],
+    "properties": {
+        "scenes": {
+            "type": "array",
+            "minItems": 1,
+            "items": {"type": "object", "required": ["summary"], "properties": {"summary": {"type": "string"}}},
+        },
+    },
+}
+
+SCENE_PLAN_TEMPLATE = PromptTemplate("""
+    {story_section}Plan the following chapter as {scene_count} consecutive scenes.
+
+    Chapter Title: {chapter_title}
+    Chapter Summary: {chapter_summary}
+
+    For each scene, give a one- or two-sentence summary of what happens and where it ends, so that the scenes
+    can be written separately and still follow on from each other. Return JSON only, like this:
+    {{"scenes": [{{"summary": "Scene 1 summary."}}, {{"summary": "Scene 2 summary."}}]}}
+""")
+
+# 各场景共用的部分（前缀、前情、章节信息、场景列表）在前，只有最后的场景要求不同
+SCENE_TEMPLATE = PromptTemplate("""
+    {story_section}You are writing one scene of the following chapter. The other scenes are written separately and joined in order.
+
+    Chapter Title: {chapter_title}
+    Chapter Summary: {chapter_summary}
+
+    Scenes:
+    {scene_list}
+
+    Write scene {scene_number} of {scene_count} in about {scene_words} words: {scene_summary}
+    {scene_position}
+    Write only the prose of this scene, without a heading.
+""")
+
+TRANSITION_TEMPLATE = PromptTemplate("""
+    Two consecutive scenes of a novel chapter were written separately. Rewrite the opening paragraph of the second scene
+    so that it follows on smoothly from the end of the first: keep its content, remove repetition or contradictions,
+    and add a short bridge if needed. Return only the rewritten paragraph.
+
+    End of the previous scene:
+    {previous_ending}
+
+    Opening paragraph of the next scene:
+    {opening}
+""")
 
 class ChapterAgent(BaseAgent):
     def __init__(self, llm, name="ChapterAgent"):
         super().__init__(name, llm)
+        # 智能体实例属于一部小说（每个工作流一个 AgentManager），角色不变时前缀只渲染一次
+        self._prefix = PrefixCache(self._render_prefix)
 
     def execute_task(self, task: dict) -> dict:
+        prompt, chapter_title = self._build_prompt(task)
+        stream_path = task.get("stream_path")
+        on_chunk = task.get("on_chunk")
+        if stream_path or on_chunk:
+            try:
+                chapter_content = self._stream_chapter(prompt, stream_path, on_chunk)
+            except Exception as e:
+                return self._stream_failed(chapter_title, stream_path, e)
+        elif task.get("scenes", 0) > 1:
+            chapter_content = self._write_scenes(task) or self.llm.generate_text(prompt)
+        else:
+            chapter_content = self.llm.generate_text(prompt)
+        return self._result(chapter_title, chapter_content)
+
+    async def aexecute_task(self, task: dict) -> dict:
+        prompt, chapter_title = self._build_prompt(task)
+        stream_path = task.get("stream_path")
+        on_chunk = task.get("on_chunk")
+        if stream_path or on_chunk:
+            try:
+                chapter_content = await self._astream_chapter(prompt, stream_path, on_chunk)
+            except Exception as e:
+                return self._stream_failed(chapter_title, stream_path, e)
+        elif task.get("scenes", 0) > 1:
+            chapter_content = await self._awrite_scenes(task) or await self.llm.agenerate_text(prompt)
+        else:
+            chapter_content = await self.llm.agenerate_text(prompt)
+        return self._result(chapter_title, chapter_content)
+
+    def _build_prompt(self, task: dict):
         logging.info(f"{self.name} is executing task: {task['description']}")
         chapter_info = task.get("chapter_info", {})
-        characters = task.get("characters", [])
-
         chapter_title = chapter_info.get("title", "")
-        chapter_summary = chapter_info.get("summary", "")
 
-        character_details = "\n".join([
-            f"- Name: {c.name}, Personality: {', '.join(c.personality)}, Background: {c.background}, Role: {c.role}, Unique Traits: {c.unique_traits}"
-            for c in characters
-        ])
+        # 稳定前缀（角色设定、写作要求、角色列表）在前且逐字节不变，每章变化的部分放在最后
+        prompt = self._prefix.get(task.get("characters", [])) + CHAPTER_TEMPLATE.render(
+            story_section=self._story_section(task),
+            chapter_title=chapter_title,
+            chapter_summary=chapter_info.get("summary", ""),
+        )
 
-        prompt = f"""
-        You are a professional novelist. Write an engaging and coherent chapter based on the following information.
+        logging.info(f"{self.name}: Generating content for chapter: {chapter_title}")
+        return prompt, chapter_title
 
-        Chapter Title: {chapter_title}
-        Chapter Summary: {chapter_summary}
+    @staticmethod
+    def _story_section(task: dict) -> str:
+        story_context = task.get("story_context", "")
+        return STORY_SECTION_TEMPLATE.render(story_context=story_context) + "\n" if story_context else ""
 
-        Characters involved in the story:
-        {character_details}
+    # ---- 分场景模式 ----
+    # 先用一次短调用把章节拆成若干场景，再并行生成各场景，最后并行改写每个场景的开头段落使衔接自然，
+    # 然后按顺序拼接。整章耗时接近最长的一个场景，而不是整章的生成时间。
+    # 任何一步失败时返回 None，由调用方退回到整章一次生成。
 
-        Ensure the chapter:
-        - Follows the given title and summary.
-        - Integrates the provided characters naturally, reflecting their personalities and roles.
-        - Advances the plot in an interesting way.
-        - Is well-written, with vivid descriptions and compelling dialogue.
-        - Is approximately 800-1200 words long.
+    def _write_scenes(self, task: dict) -> Optional[str]:
+        try:
+            plan = self._scene_plan(generate_json(self.llm, self._scene_plan_prompt(task), SCENE_PLAN_SCHEMA))
+        except JSONExtractionError as e:
+            logging.warning(f"{self.name}: Scene planning failed ({e}); writing the chapter in one call")
+            return None
+        if plan is None:
+            return None
+        scenes = self._parallel([self._scene_prompt(task, plan, i) for i in range(len(plan))])
+        if not all(scenes):
+            logging.warning(f"{self.name}: A scene failed; writing the chapter in one call")
+            return None
+        transitions = self._transition_prompts(scenes)
+        return self._stitch(scenes, self._parallel(transitions))
 
-        Begin writing the chapter now.
-        """
+    async def _awrite_scenes(self, task: dict) -> Optional[str]:
+        try:
+            plan = self._scene_plan(await agenerate_json(self.llm, self._scene_plan_prompt(task), SCENE_PLAN_SCHEMA))
+        except JSONExtractionError as e:
+            logging.warning(f"{self.name}: Scene planning failed ({e}); writing the chapter in one call")
+            return None
+        if plan is None:
+            return None
+        scenes = await asyncio.gather(*(self.llm.agenerate_text(self._scene_prompt(task, plan, i)) for i in range(len(plan))))
+        if not all(scenes):
+            logging.warning(f"{self.name}: A scene failed; writing the chapter in one call")
+            return None
+        transitions = self._transition_prompts(scenes)
+        return self._stitch(scenes, await asyncio.gather(*(self.llm.agenerate_text(p) for p in transitions)))
 
-        logging.info(f"{self.name}: Generating content for chapter: {chapter_title}")
-        chapter_content = self.llm.generate_text(prompt)
+    def _parallel(self, prompts: List[str]) -> List[str]:
+        """在线程中并行调用 generate_text；复制上下文，使调用仍记在当前智能体和任务名下。"""
+        if len(prompts) <= 1:
+            return [self.llm.generate_text(p) for p in prompts]
+        with ThreadPoolExecutor(max_workers=len(prompts), thread_name_prefix="chapter-scene") as pool:
+            futures = [pool.submit(contextvars.copy_context().run, self.llm.generate_text, p) for p in prompts]
+            return [future.result() for future in futures]
+
+    def _scene_plan_prompt(self, task: dict) -> str:
+        chapter_info = task.get("chapter_info", {})
+        return self._prefix.get(task.get("characters", [])) + SCENE_PLAN_TEMPLATE.render(
+            story_section=self._story_section(task),
+            scene_count=task["scenes"],
+            chapter_title=chapter_info.get("title", ""),
+            chapter_summary=chapter_info.get("summary", ""),
+        )
+
+    def _scene_plan(self, data: dict) -> Optional[List[str]]:
+        plan = [scene["summary"].strip() for scene in data["scenes"] if scene["summary"].strip()]
+        if len(plan) < 2:
+            logging.warning(f"{self.name}: Scene plan has {len(plan)} scene(s); writing the chapter in one call")
+            return None
+        return plan
+
+    def _scene_prompt(self, task: dict, plan: List[str], i: int) -> str:
+        chapter_info = task.get("chapter_info", {})
+        if i == 0:
+            position = "This scene opens the chapter."
+        elif i == len(plan) - 1:
+            position = "Pick up directly where the previous scene ends, and bring the chapter to a close."
+        else:
+            position = "Pick up directly where the previous scene ends, and stop where the next scene begins."
+        return self._prefix.get(task.get("characters", [])) + SCENE_TEMPLATE.render(
+            story_section=self._story_section(task),
+            chapter_title=chapter_info.get("title", ""),
+            chapter_summary=chapter_info.get("summary", ""),
+            scene_list="\n".join(f"{n}. {summary}" for n, summary in enumerate(plan, 1)),
+            scene_number=i + 1,
+            scene_count=len(plan),
+            scene_words=max(150, CHAPTER_WORDS // len(plan)),
+            scene_summary=plan[i],
+            scene_position=position,
+        )
 
+    @staticmethod
+    def _transition_prompts(scenes: List[str]) -> List[str]:
+        """每个场景（第一个除外）的开头段落，连同上一场景的结尾段落，请求改写为自然衔接的版本。"""
+        return [TRANSITION_TEMPLATE.render(previous_ending=_paragraphs(scenes[i - 1])[-1], opening=_paragraphs(scenes[i])[0])
+                for i in range(1, len(scenes))]
+
+    @staticmethod
+    def _stitch(scenes: List[str], openings: List[str]) -> str:
+        """按顺序拼接场景，用改写后的开头段落替换原来的开头；改写失败的保留原文。"""
+        parts = [scenes[0].strip()]
+        for scene, opening in zip(scenes[1:], openings):
+            paragraphs = _paragraphs(scene)
+            if opening and opening.strip():
+                paragraphs[0] = opening.strip()
+            parts.append("\n\n".join(paragraphs))
+        return "\n\n".join(parts)
+
+    @staticmethod
+    def _render_prefix(characters) -> str:
+        character_details = "\n".join([
+            f"- Name: {c.name}, Personality: {', '.join(c.personality)}, Background: {c.background}, Role: {c.role}, Unique Traits: {c.unique_traits}"
+            for c in characters
+        ])
+        return CHAPTER_PREFIX_TEMPLATE.render(character_details=character_details) + "\n"
+
+    def _result(self, chapter_title: str, chapter_content: str) -> dict:
         if chapter_content:
             logging.info(f"{self.name} generated chapter: {chapter_title}")
             return {"status": "completed", "result": chapter_content}
@@ -49,7 +257,51 @@ class ChapterAgent(BaseAgent):
             logging.error(f"{self.name} failed to generate content for chapter: {chapter_title}")
             return {"status": "failed", "message": "Failed to generate chapter content."}
 
+    def _stream_chapter(self, prompt: str, stream_path: str = None, on_chunk=None) -> str:
+        """流式生成章节：每个增量写入并刷新到章节草稿文件，同时回调给调用方。"""
+        parts = []
+        draft = open(stream_path, "w", encoding="utf-8") if stream_path else None
+        try:
+            for delta in self.llm.stream_text(prompt):
+                parts.append(delta)
+                if draft:
+                    draft.write(delta)
+                    draft.flush()
+                if on_chunk:
+                    on_chunk(delta)
+        finally:
+            if draft:
+                draft.close()
+        return "".join(parts)
+
+    async def _astream_chapter(self, prompt: str, stream_path: str = None, on_chunk=None) -> str:
+        parts = []
+        draft = open(stream_path, "w", encoding="utf-8") if stream_path else None
+        try:
+            async for delta in self.llm.astream_text(prompt):
+                parts.append(delta)
+                if draft:
+                    draft.write(delta)
+                    draft.flush()
+                if on_chunk:
+                    on_chunk(delta)
+        finally:
+            if draft:
+                draft.close()
+        return "".join(parts)
+
+    def _stream_failed(self, chapter_title: str, stream_path: str, error: Exception) -> dict:
+        logging.error(f"{self.name}: Streaming failed for chapter: {chapter_title}: {error}")
+        message = f"Streaming interrupted: {error}."
+        if stream_path:
+            message += f" Partial text kept in {stream_path}."
+        return {"status": "failed", "message": message}
+
     def communicate(self, message: dict) -> dict:
         logging.info(f"{self.name} received message: {message['content']}")
         return {"status": "acknowledged", "response": "收到章节创作请求。"}
 
+
+def _paragraphs(text: str) -> List[str]:
+    paragraphs = [p.strip() for p in text.strip().split("\n\n") if p.strip()]
+    return paragraphs or [text.strip()]
@@ -1,71 +1,124 @@
 import logging
 from src.agents.base_agent import BaseAgent
 from src.story.story_elements import Character
+from src.agents.prompts import PromptTemplate
+from src.agents.json_output import generate_json, agenerate_json, stream_json, astream_json, JSONExtractionError
 from typing import List, Dict, Any
-import json
+
+CHARACTER_FIELDS = ["name", "personality", "background", "role", "unique_traits"]
+
+CHARACTERS_SCHEMA = {
+    "type": "array",
+    "minItems": 1,
+    "items": {
+        "type": "object",
+        "required": CHARACTER_FIELDS,
+        "properties": {
+            "name": {"type": "string"},
+            "personality": {"type": "array", "items": {"type": "string"}},
+            "background": {"type": "string"},
+            "role": {"type": "string"},
+            "unique_traits": {"type": "string"},
+            "aliases": {"type": "array", "items": {"type": "string"}},
+        },
+    },
+}
+
+# 固定的说明和 JSON 示例在前，每部小说不同的提示和大纲放在最后
+CHARACTERS_TEMPLATE = PromptTemplate("""
+    Based on the story prompt and outline at the end, generate a list of detailed character profiles.
+    For each character, include:
+    - name
+    - personality traits (3-5 adjectives)
+    - brief background story (2-3 sentences)
+    - key role in the story
+    - any unique physical traits or quirks
+    - aliases: other names the text may use for the character (nicknames, titles, short forms), if any
+
+    Generate characters in a JSON array format, like this:
+    [
+        {{
+            "name": "Character Name 1",
+            "personality": ["trait1", "trait2"],
+            "background": "Background story.",
+            "role": "Key role.",
+            "unique_traits": "Unique traits.",
+            "aliases": ["Nickname"]
+        }},
+        {{
+            "name": "Character Name 2",
+            "personality": ["trait1", "trait2"],
+            "background": "Background story.",
+            "role": "Key role.",
+            "unique_traits": "Unique traits."
+        }}
+    ]
+
+    Story Prompt: {prompt}
+
+    Story Outline:
+    Title: {title}
+    Synopsis: {synopsis}
+    Chapters:
+    {chapters}
+""")
 
 class CharacterAgent(BaseAgent):
     def __init__(self, llm):
         super().__init__("CharacterAgent", llm)
 
-    def execute_task(self, task: Dict[str, Any]) -> List[Character]:
+    def execute_task(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        on_character = task.get("on_character")
+        try:
+            if on_character:
+                # 流水线模式：每解析出一个角色就回调 on_character(Character)，依赖它的章节可以提前开始
+                characters_data = stream_json(self.llm, self._build_prompt(task), CHARACTERS_SCHEMA,
+                                              lambda _, data: on_character(self._character(data)))
+            else:
+                characters_data = generate_json(self.llm, self._build_prompt(task), CHARACTERS_SCHEMA)
+        except JSONExtractionError as e:
+            return self._failed(e)
+        return self._completed(characters_data)
+
+    async def aexecute_task(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        on_character = task.get("on_character")
+        try:
+            if on_character:
+                characters_data = await astream_json(self.llm, self._build_prompt(task), CHARACTERS_SCHEMA,
+                                                     lambda _, data: on_character(self._character(data)))
+            else:
+                characters_data = await agenerate_json(self.llm, self._build_prompt(task), CHARACTERS_SCHEMA)
+        except JSONExtractionError as e:
+            return self._failed(e)
+        return self._completed(characters_data)
+
+    def _build_prompt(self, task: Dict[str, Any]) -> str:
         prompt = task.get("prompt", "")
         outline = task.get("outline", {})
 
-        chapters_list = [f'- Chapter {i+1}: {c.get("title", "N/A")} - {c.get("summary", "N/A")}' for i, c in enumerate(outline.get('chapters', []))]
-        chapters_str = '\n'.join(chapters_list)
-
-        # Construct a detailed prompt for character generation
-        character_generation_prompt = f"""
-        Based on the following story prompt and outline, generate a list of detailed character profiles.
-        For each character, include:
-        - name
-        - personality traits (3-5 adjectives)
-        - brief background story (2-3 sentences)
-        - key role in the story
-        - any unique physical traits or quirks
-
-        Story Prompt: {prompt}
-
-        Story Outline:
-        Title: {outline.get('title', 'N/A')}
-        Synopsis: {outline.get('synopsis', 'N/A')}
-        Chapters:
-        {chapters_str}
-
-        Generate characters in a JSON array format, like this:
-        [
-            {{
-                "name": "Character Name 1",
-                "personality": ["trait1", "trait2"],
-                "background": "Background story.",
-                "role": "Key role.",
-                "unique_traits": "Unique traits."
-            }},
-            {{
-                "name": "Character Name 2",
-                "personality": ["trait1", "trait2"],
-                "background": "Background story.",
-                "role": "Key role.",
-                "unique_traits": "Unique traits."
-            }}
-        ]
-        """
+        chapters_str = '\n'.join(f'- Chapter {i+1}: {c.get("title", "N/A")} - {c.get("summary", "N/A")}' for i, c in enumerate(outline.get('chapters', [])))
 
         logging.info(f"CharacterAgent: Generating characters for prompt: {prompt[:50]}...")
-        response = self.llm.generate_text(character_generation_prompt)
-        
-        try:
-            characters_data = json.loads(response)
-            characters = [Character(**data) for data in characters_data]
-            logging.info(f"CharacterAgent: Generated {len(characters)} characters.")
-            return {"status": "completed", "result": characters}
-        except json.JSONDecodeError:
-            logging.error(f"CharacterAgent: Failed to decode JSON response for characters: {response}")
-            return {"status": "failed", "message": f"Failed to decode JSON response for characters: {response}"}
-        except TypeError as e:
-            logging.error(f"CharacterAgent: Type error when creating Character objects: {e} - Response: {response}")
-            return {"status": "failed", "message": f"Type error when creating Character objects: {e} - Response: {response}"}
+        return CHARACTERS_TEMPLATE.render(
+            prompt=prompt,
+            title=outline.get('title', 'N/A'),
+            synopsis=outline.get('synopsis') or outline.get('logline', 'N/A'),
+            chapters=chapters_str,
+        )
+
+    def _completed(self, characters_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+        characters = [self._character(data) for data in characters_data]
+        logging.info(f"CharacterAgent: Generated {len(characters)} characters.")
+        return {"status": "completed", "result": characters}
+
+    @staticmethod
+    def _character(data: Dict[str, Any]) -> Character:
+        # 忽略模型额外输出的字段
+        return Character(**{field: data[field] for field in CHARACTER_FIELDS}, aliases=data.get("aliases", []))
+
+    def _failed(self, error: JSONExtractionError) -> Dict[str, Any]:
+        logging.error(f"CharacterAgent: Failed to get valid JSON characters: {error} - Response: {error.response}")
+        return {"status": "failed", "message": f"Failed to get valid JSON characters: {error}"}
 
     def communicate(self, message: dict) -> dict:
         logging.info(f"{self.name} received message: {message['content']}")
@@ -0,0 +1,319 @@
+# src/agents/json_output.py
+
+import json
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from src.llm_client import LLMError
+
+Path = List[Union[str, int]]
+
+class JSONExtractionError(ValueError):
+    """模型输出中找不到有效 JSON，或修复后仍不符合 schema。"""
+    def __init__(self, message: str, errors: List[str] = None, response: str = ""):
+        super().__init__(message)
+        self.errors = errors or []
+        self.response = response
+
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_decoder = json.JSONDecoder()
+
+def extract_json(text: str, expect: Optional[type] = None) -> Any:
+    """返回文本中第一个有效的 JSON 对象或数组，忽略前后的说明文字和 ``` 代码块标记。
+
+    expect 为 dict 或 list 时只接受该类型。严格解析失败时会去掉尾随逗号再试一次。
+    找不到时抛出 JSONExtractionError。也可用于流式输出：对已累积的文本调用，顶层括号闭合后即可取到结果。
+    """
+    if text:
+        for candidate in (text, _TRAILING_COMMA_RE.sub(r"\1", text)):
+            value = _first_value(candidate, expect)
+            if value is not None:
+                return value[0]
+    raise JSONExtractionError(f"No valid JSON {_kind(expect)} found in model output", response=text or "")
+
+def _first_value(text: str, expect: Optional[type]) -> Optional[Tuple[Any]]:
+    openers = "{" if expect is dict else "[" if expect is list else "{["
+    for start, char in enumerate(text):
+        if char not in openers:
+            continue
+        try:
+            value, _ = _decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            continue
+        if expect is None or isinstance(value, expect):
+            return (value,)
+    return None
+
+# ---- schema 校验（JSON Schema 的一个子集：type、required、properties、items、minItems、minLength） ----
+
+_TYPES = {"object": dict, "array": list, "string": str, "integer": int, "number": (int, float), "boolean": bool}
+
+def validate(value: Any, schema: Optional[Dict[str, Any]], path: Path = None) -> List[Tuple[Path, str]]:
+    """按 schema 校验，返回 (路径, 错误说明) 列表；缺少必填字段时路径指向该字段。"""
+    path = path or []
+    if not schema:
+        return []
+    expected = schema.get("type")
+    if expected and (not isinstance(value, _TYPES[expected]) or (isinstance(value, bool) and expected != "boolean")):
+        return [(path, f"expected {expected}, got {type(value).__name__}")]
+
+    errors = []
+    if isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value or value[key] in (None, ""):
+                errors.append((path + [key], "missing required field"))
+        for key, subschema in schema.get("properties", {}).items():
+            if key in value and value[key] not in (None, ""):
+                errors.extend(validate(value[key], subschema, path + [key]))
+    elif isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            errors.append((path, f"expected at least {schema['minItems']} items, got {len(value)}"))
+        for i, item in enumerate(value):
+            errors.extend(validate(item, schema.get("items"), path + [i]))
+    elif isinstance(value, str) and len(value.strip()) < schema.get("minLength", 0):
+        errors.append((path, f"expected at least {schema['minLength']} characters"))
+    return errors
+
+def format_path(path: Path) -> str:
+    text = "$"
+    for part in path:
+        text += f"[{part}]" if isinstance(part, int) else f".{part}"
+    return text
+
+# ---- 生成 + 定向修复 ----
+
+def generate_json(llm, prompt: str, schema: Optional[Dict[str, Any]] = None, max_repairs: int = 2) -> Any:
+    """调用 LLM 生成 JSON，并在输出有误时发送修复提示，而不是整段重新生成。
+
+    - 输出中有说明文字或代码块：直接提取其中的 JSON，不额外调用；
+    - 只有部分字段/条目不符合 schema：只把出错的片段（例如某一章、某个角色）连同错误说明发给模型修复，
+      再拼回原结果；
+    - 完全无法解析（例如输出被截断）：把原输出和解析错误发给模型，要求只返回修正后的 JSON。
+    超过 max_repairs 次修复仍失败时抛出 JSONExtractionError。
+    """
+    conversation = _json_conversation(prompt, schema, max_repairs)
+    return _finish_conversation(conversation, llm.generate_text(next(conversation)), llm.generate_text)
+
+async def agenerate_json(llm, prompt: str, schema: Optional[Dict[str, Any]] = None, max_repairs: int = 2) -> Any:
+    """generate_json 的异步版本，使用 llm.agenerate_text。"""
+    conversation = _json_conversation(prompt, schema, max_repairs)
+    return await _afinish_conversation(conversation, await llm.agenerate_text(next(conversation)), llm.agenerate_text)
+
+def stream_json(llm, prompt: str, schema: Dict[str, Any], on_item: Callable[[int, Any], None],
+                item_key: Optional[str] = None, max_repairs: int = 2) -> Any:
+    """与 generate_json 相同，但以流式调用模型：数组（item_key 字段对应的数组，None 为顶层数组）中的每个元素
+    一解析完成且通过校验，就立即回调 on_item(序号, 元素)，不必等整个输出结束。
+
+    流中断时用已收到的部分继续走修复流程。未通过校验的元素不会回调，修复后包含在最终返回值中。
+    """
+    conversation = _json_conversation(prompt, schema, max_repairs)
+    items = _ItemEmitter(schema, item_key, on_item)
+    try:
+        for delta in llm.stream_text(next(conversation)):
+            items.feed(delta)
+    except LLMError as e:
+        logging.warning(f"[JSON] Stream interrupted ({e}); continuing with the partial output")
+    return _finish_conversation(conversation, items.text(), llm.generate_text)
+
+async def astream_json(llm, prompt: str, schema: Dict[str, Any], on_item: Callable[[int, Any], None],
+                       item_key: Optional[str] = None, max_repairs: int = 2) -> Any:
+    """stream_json 的异步版本。"""
+    conversation = _json_conversation(prompt, schema, max_repairs)
+    items = _ItemEmitter(schema, item_key, on_item)
+    try:
+        async for delta in llm.astream_text(next(conversation)):
+            items.feed(delta)
+    except LLMError as e:
+        logging.warning(f"[JSON] Stream interrupted ({e}); continuing with the partial output")
+    return await _afinish_conversation(conversation, items.text(), llm.agenerate_text)
+
+def _finish_conversation(conversation, response: str, generate: Callable[[str], str]) -> Any:
+    """把第一次的输出交给 _json_conversation，并按需调用 generate 完成后续修复。"""
+    try:
+        while True:
+            response = generate(conversation.send(response))
+    except StopIteration as done:
+        return done.value
+
+async def _afinish_conversation(conversation, response: str, agenerate) -> Any:
+    try:
+        while True:
+            response = await agenerate(conversation.send(response))
+    except StopIteration as done:
+        return done.value
+
+# 开始 JSON 数组的 '['：下一个非空白字符尚未到达时先不匹配，下次 feed 时重新查找
+_ARRAY_START_RE = re.compile(r'\[(?=\s*[\[{"\]])')
+
+class JSONArrayItemStream:
+    """增量解析流式输出中某个数组的元素：每个元素（对象或数组）的右括号一到就返回该元素。
+
+    key 为 None 时解析第一个真正开始 JSON 数组的 '['（后面紧跟 '{'、'['、'"' 或 ']'，允许空白），
+    前言中的 "[of characters]" 之类会被跳过；否则解析第一个名为 key 的字段对应的数组。
+    """
+    def __init__(self, key: Optional[str] = None):
+        self.key = key
+        self.done = False
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._item_start: Optional[int] = None
+        self._key_re = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[') if key else None
+
+    def feed(self, delta: str) -> List[Any]:
+        self._text += delta
+        items = []
+        if self._depth == 0 and not self.done:
+            match = (self._key_re or _ARRAY_START_RE).search(self._text)
+            if not match:
+                return items
+            self._pos, self._depth = match.end(), 1
+        while self._pos < len(self._text) and not self.done:
+            char = self._text[self._pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 1:
+                    self._item_start = self._pos
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._item_start is not None:
+                    try:
+                        items.append(json.loads(self._text[self._item_start:self._pos + 1]))
+                    except json.JSONDecodeError:
+                        items.append(None)  # 保留序号，元素本身留给最终的修复流程
+                    self._item_start = None
+                elif self._depth == 0:
+                    self.done = True
+            self._pos += 1
+        return items
+
+    def text(self) -> str:
+        return self._text
+
+class _ItemEmitter:
+    """把 JSONArrayItemStream 解析出的元素按 schema 校验后回调给调用方。"""
+    def __init__(self, schema: Dict[str, Any], item_key: Optional[str], on_item: Callable[[int, Any], None]):
+        self.stream = JSONArrayItemStream(item_key)
+        self.item_schema = _subschema(schema, [item_key, 0] if item_key else [0])
+        self.on_item = on_item
+        self.count = 0
+
+    def feed(self, delta: str):
+        for item in self.stream.feed(delta):
+            if item is not None and not validate(item, self.item_schema):
+                self.on_item(self.count, item)
+            self.count += 1
+
+    def text(self) -> str:
+        return self.stream.text()
+
+def _json_conversation(prompt: str, schema: Optional[Dict[str, Any]], max_repairs: int):
+    """生成与修复的流程本身（不做 IO）：yield 要发给 LLM 的提示，接收模型的回复，最终 return 结果。
+    同步和异步版本只是驱动方式不同。"""
+    expect = _TYPES.get(schema.get("type")) if schema else None
+    response = yield prompt
+    if not response:
+        raise JSONExtractionError("LLM returned an empty response")
+
+    value, errors = None, []
+    for attempt in range(max_repairs + 1):
+        if value is None:
+            try:
+                value = extract_json(response, expect)
+            except JSONExtractionError as e:
+                errors = [([], str(e))]
+        if value is not None:
+            errors = validate(value, schema)
+            if not errors:
+                return value
+        if attempt == max_repairs:
+            break
+
+        logging.warning(f"[JSON] Output invalid ({len(errors)} errors: {_summarize(errors)}); sending repair prompt {attempt + 1}/{max_repairs}")
+        units = _repair_units(errors) if value is not None else None
+        if units is None:
+            # 整段无法解析（或根节点类型错误）：要求模型返回修正后的完整 JSON
+            broken = response if value is None else json.dumps(value, ensure_ascii=False)
+            value = _try_extract((yield _whole_repair_prompt(broken, errors, schema, expect)), expect)
+        else:
+            repaired = _try_extract((yield _parts_repair_prompt(value, units, errors, schema)), dict)
+            for name, unit in units.items():
+                if repaired and name in repaired:
+                    _set(value, unit, repaired[name])
+
+    raise JSONExtractionError(f"Invalid JSON output after {max_repairs} repair attempts: {_summarize(errors)}",
+                              errors=[f"{format_path(p)}: {m}" for p, m in errors], response=response)
+
+def _try_extract(text: str, expect: Optional[type]) -> Any:
+    try:
+        return extract_json(text, expect)
+    except JSONExtractionError:
+        return None
+
+def _whole_repair_prompt(response: str, errors: List[Tuple[Path, str]], schema: Optional[Dict[str, Any]], expect: Optional[type]) -> str:
+    schema_hint = f"\nIt must match this JSON schema:\n{json.dumps(schema, ensure_ascii=False)}\n" if schema else ""
+    return (
+        f"The following output was supposed to be a single JSON {_kind(expect)} but could not be parsed "
+        f"({_summarize(errors)}).{schema_hint}\n"
+        f"Return only the corrected, complete JSON, with no explanation and no code fences.\n\nOutput:\n{response}"
+    )
+
+def _repair_units(errors: List[Tuple[Path, str]]) -> Optional[Dict[str, Path]]:
+    """出错位置所在的最小修复单元：最近的数组元素（如某一章），或根对象上的字段。根节点本身出错时返回 None。"""
+    units: Dict[str, Path] = {}
+    for path, _ in errors:
+        indices = [i for i, part in enumerate(path) if isinstance(part, int)]
+        unit = path[:indices[-1] + 1] if indices else path[:1]
+        if not unit:
+            return None
+        units[format_path(unit)] = unit
+    return units
+
+def _parts_repair_prompt(value: Any, units: Dict[str, Path], errors: List[Tuple[Path, str]], schema: Dict[str, Any]) -> str:
+    fragments = {name: _get(value, unit) for name, unit in units.items()}
+    expected = {name: _subschema(schema, unit) for name, unit in units.items()}
+    return (
+        "Some parts of a JSON document you generated are invalid. Fix only these parts.\n\n"
+        f"Errors:\n" + "\n".join(f"- {format_path(p)}: {m}" for p, m in errors) + "\n\n"
+        f"Current values (null = missing), keyed by JSON path:\n{json.dumps(fragments, ensure_ascii=False)}\n\n"
+        f"Expected schema for each path:\n{json.dumps(expected, ensure_ascii=False)}\n\n"
+        "Return only a JSON object with exactly the same keys, each mapped to its corrected value, "
+        "with no explanation and no code fences."
+    )
+
+def _get(value: Any, path: Path) -> Any:
+    for part in path:
+        try:
+            value = value[part]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return value
+
+def _set(value: Any, path: Path, new_value: Any):
+    target = _get(value, path[:-1])
+    if isinstance(target, dict) or (isinstance(target, list) and isinstance(path[-1], int) and path[-1] < len(target)):
+        target[path[-1]] = new_value
+
+def _subschema(schema: Dict[str, Any], path: Path) -> Dict[str, Any]:
+    for part in path:
+        schema = (schema.get("items") if isinstance(part, int) else schema.get("properties", {}).get(part)) or {}
+    return schema
+
+def _summarize(errors: List[Tuple[Path, str]], limit: int = 3) -> str:
+    text = "; ".join(f"{format_path(p)}: {m}" for p, m in errors[:limit])
+    return text + (f"; and {len(errors) - limit} more" if len(errors) > limit else "")
+
+def _kind(expect: Optional[type]) -> str:
+    return "object" if expect is dict else "array" if expect is list else "value"
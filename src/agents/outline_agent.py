@@ -1,54 +1,99 @@
 # src/agents/outline_agent.py
 
 import logging
-import json
 from .base_agent import BaseAgent
+from .prompts import PromptTemplate
+from .json_output import generate_json, agenerate_json, stream_json, astream_json, JSONExtractionError
+
+OUTLINE_SCHEMA = {
+    "type": "object",
+    "required": ["title", "chapters"],
+    "properties": {
+        "title": {"type": "string"},
+        "logline": {"type": "string"},
+        "chapters": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "required": ["title", "summary"],
+                "properties": {
+                    "title": {"type": "string"},
+                    "summary": {"type": "string"},
+                    "characters": {"type": "array", "items": {"type": "string"}},
+                },
+            },
+        },
+    },
+}
+
+# 固定的说明和 JSON 示例在前，每部小说不同的提示放在最后
+OUTLINE_TEMPLATE = PromptTemplate("""
+    You are a professional novelist and outline creator. Based on the prompt at the end, generate a detailed novel outline.
+    The outline should include:
+    - A compelling title for the novel.
+    - A concise logline (1-2 sentences).
+    - A list of 3-5 chapters, where each chapter has:
+        - A chapter title.
+        - A brief summary of the chapter's content.
+        - The names of the main characters who appear in the chapter.
+
+    Ensure the outline is coherent, engaging, and sets up a compelling narrative arc.
+
+    Generate the outline in JSON format, like this:
+    {{
+        "title": "Novel Title",
+        "logline": "A concise logline.",
+        "chapters": [
+            {{"title": "Chapter 1 Title", "summary": "Chapter 1 Summary.", "characters": ["Name A", "Name B"]}},
+            {{"title": "Chapter 2 Title", "summary": "Chapter 2 Summary.", "characters": ["Name A"]}}
+        ]
+    }}
+
+    Prompt: {prompt}
+""")
 
 class OutlineAgent(BaseAgent):
     def __init__(self, llm, name="OutlineAgent"):
         super().__init__(name, llm)
 
     def execute_task(self, task: dict) -> dict:
-        logging.info(f"{self.name} is executing task: {task['description']}")
-        prompt = task.get("description", "")
+        on_chapter = task.get("on_chapter")
+        try:
+            if on_chapter:
+                # 流水线模式：每解析出一章就回调 on_chapter(序号, 章节)，工作流可以提前登记章节任务
+                outline = stream_json(self.llm, self._build_prompt(task), OUTLINE_SCHEMA, on_chapter, item_key="chapters")
+            else:
+                outline = generate_json(self.llm, self._build_prompt(task), OUTLINE_SCHEMA)
+        except JSONExtractionError as e:
+            return self._failed(e)
+        return self._completed(outline)
 
-        outline_generation_prompt = f"""
-        You are a professional novelist and outline creator. Based on the following prompt, generate a detailed novel outline.
-        The outline should include:
-        - A compelling title for the novel.
-        - A concise logline (1-2 sentences).
-        - A list of 3-5 chapters, where each chapter has:
-            - A chapter title.
-            - A brief summary of the chapter's content.
-
-        Ensure the outline is coherent, engaging, and sets up a compelling narrative arc.
-
-        Prompt: {prompt}
-
-        Generate the outline in JSON format, like this:
-        {{
-            "title": "Novel Title",
-            "logline": "A concise logline.",
-            "chapters": [
-                {{"title": "Chapter 1 Title", "summary": "Chapter 1 Summary."}},
-                {{"title": "Chapter 2 Title", "summary": "Chapter 2 Summary."}}
-            ]
-        }}
-        """
+    async def aexecute_task(self, task: dict) -> dict:
+        on_chapter = task.get("on_chapter")
+        try:
+            if on_chapter:
+                outline = await astream_json(self.llm, self._build_prompt(task), OUTLINE_SCHEMA, on_chapter,
+                                             item_key="chapters")
+            else:
+                outline = await agenerate_json(self.llm, self._build_prompt(task), OUTLINE_SCHEMA)
+        except JSONExtractionError as e:
+            return self._failed(e)
+        return self._completed(outline)
 
+    def _build_prompt(self, task: dict) -> str:
+        logging.info(f"{self.name} is executing task: {task['description']}")
+        prompt = task.get("description", "")
         logging.info(f"{self.name}: Generating outline for: {prompt[:50]}...")
-        response = self.llm.generate_text(outline_generation_prompt)
+        return OUTLINE_TEMPLATE.render(prompt=prompt)
 
-        try:
-            # Remove markdown code block if present
-            if response.startswith('```json') and response.endswith('```'):
-                response = response[len('```json'):-len('```')].strip()
-            outline = json.loads(response)
-            logging.info(f"{self.name} generated outline: {outline.get('title', 'N/A')}")
-            return {"status": "completed", "result": outline}
-        except json.JSONDecodeError:
-            logging.error(f"{self.name}: Failed to decode JSON response for outline: {response}")
-            return {"status": "failed", "message": "Failed to generate valid JSON outline."}
+    def _completed(self, outline: dict) -> dict:
+        logging.info(f"{self.name} generated outline: {outline.get('title', 'N/A')}")
+        return {"status": "completed", "result": outline}
+
+    def _failed(self, error: JSONExtractionError) -> dict:
+        logging.error(f"{self.name}: Failed to get a valid JSON outline: {error} - Response: {error.response}")
+        return {"status": "failed", "message": f"Failed to generate valid JSON outline: {error}"}
 
     def communicate(self, message: dict) -> dict:
         logging.info(f"{self.name} received message: {message['content']}")
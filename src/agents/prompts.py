@@ -0,0 +1,49 @@
+# src/agents/prompts.py
+
+import string
+import textwrap
+import threading
+from typing import Any, Callable, Optional, Sequence, Tuple
+
+class PromptTemplate:
+    """预编译的提示词模板。
+
+    构造时完成去缩进和占位符解析，render 只做一次 str.format_map。模板中的字面量花括号写作 {{ }}。
+    """
+    __slots__ = ("text", "fields")
+
+    def __init__(self, text: str):
+        self.text = textwrap.dedent(text).strip() + "\n"
+        self.fields = frozenset(name for _, name, _, _ in string.Formatter().parse(self.text) if name)
+
+    def render(self, **values: Any) -> str:
+        missing = self.fields - values.keys()
+        if missing:
+            raise KeyError(f"Missing prompt template fields: {', '.join(sorted(missing))}")
+        return self.text.format_map(values)
+
+class PrefixCache:
+    """缓存由一组对象渲染出的静态提示词前缀（例如一部小说的角色列表）。
+
+    输入的对象（按身份比较）与上次相同时直接返回上次渲染的文本，因此同一部小说的每一章都得到
+    逐字节相同的前缀，服务商侧的前缀缓存（KV cache）可以命中。对象被原地修改时需要调用 clear()。
+    线程安全：并发的章节任务最多各自渲染一次，结果相同。
+    """
+    def __init__(self, render: Callable[[Tuple[Any, ...]], str]):
+        self._render = render
+        self._entry: Optional[Tuple[Tuple[Any, ...], str]] = None
+        self._lock = threading.Lock()
+
+    def get(self, items: Sequence[Any]) -> str:
+        key = tuple(items)
+        entry = self._entry
+        if entry is not None and len(entry[0]) == len(key) and all(a is b for a, b in zip(entry[0], key)):
+            return entry[1]
+        text = self._render(key)
+        with self._lock:
+            self._entry = (key, text)
+        return text
+
+    def clear(self):
+        with self._lock:
+            self._entry = None
@@ -0,0 +1,3 @@
+# src/export/__init__.py
+
+from .exporters import BaseExporter, TextExporter, MarkdownExporter, JsonlExporter, EpubExporter, EXPORTERS, export_novel, parse_chapter_range, parse_chapter_selection
@@ -0,0 +1,197 @@
+# src/export/exporters.py
+
+import os
+import json
+import logging
+import time
+import zipfile
+from abc import ABC, abstractmethod
+from html import escape
+from typing import Dict, Any, List, Optional, Tuple
+
+class BaseExporter(ABC):
+    """导出器基类：逐章写入输出文件，任何时候内存中最多只有一章正文。"""
+    def __init__(self, output_path: str, metadata: Dict[str, Any]):
+        self.output_path = output_path
+        self.metadata = metadata
+
+    @abstractmethod
+    def open(self, chapter_indices: List[int]):
+        """打开输出文件并写入文件头。chapter_indices 为将要导出的章节序号（某些格式需要预先生成目录）。"""
+        pass
+
+    @abstractmethod
+    def write_chapter(self, index: int, title: str, content: str):
+        """写入一章。"""
+        pass
+
+    @abstractmethod
+    def close(self):
+        """写入文件尾并关闭输出文件。"""
+        pass
+
+class TextExporter(BaseExporter):
+    def open(self, chapter_indices: List[int]):
+        self._file = open(self.output_path, "w", encoding="utf-8")
+
+    def write_chapter(self, index: int, title: str, content: str):
+        self._file.write(f"\n\n--- Chapter {index} ---\n\n")
+        self._file.write(content)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class MarkdownExporter(BaseExporter):
+    def open(self, chapter_indices: List[int]):
+        self._file = open(self.output_path, "w", encoding="utf-8")
+        self._file.write(f"# {self.metadata.get('title') or 'Untitled'}\n")
+        if self.metadata.get("logline"):
+            self._file.write(f"\n> {self.metadata['logline']}\n")
+
+    def write_chapter(self, index: int, title: str, content: str):
+        heading = f"Chapter {index}: {title}" if title else f"Chapter {index}"
+        self._file.write(f"\n## {heading}\n\n{content.strip()}\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class JsonlExporter(BaseExporter):
+    """每行一个 JSON 对象：{"index", "title", "content"}。"""
+    def open(self, chapter_indices: List[int]):
+        self._file = open(self.output_path, "w", encoding="utf-8")
+
+    def write_chapter(self, index: int, title: str, content: str):
+        self._file.write(json.dumps({"index": index, "title": title, "content": content}, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class EpubExporter(BaseExporter):
+    """EPUB 3 导出：每章作为一个独立的 XHTML 条目直接流式写入 zip 包。"""
+    def open(self, chapter_indices: List[int]):
+        self._zip = zipfile.ZipFile(self.output_path, "w")
+        # mimetype 必须是第一个条目且不压缩
+        self._zip.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        self._zip.writestr("META-INF/container.xml",
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+            '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>'
+            '</container>', compress_type=zipfile.ZIP_DEFLATED)
+        self._titles: Dict[int, str] = {}
+        self._indices = list(chapter_indices)
+
+    def write_chapter(self, index: int, title: str, content: str):
+        heading = escape(title or f"Chapter {index}")
+        self._titles[index] = heading
+        info = zipfile.ZipInfo(f"OEBPS/{self._chapter_file(index)}")
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with self._zip.open(info, "w") as entry:
+            entry.write((
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<html xmlns="http://www.w3.org/1999/xhtml"><head>'
+                f'<title>{heading}</title></head><body><h2>{heading}</h2>\n'
+            ).encode("utf-8"))
+            for paragraph in content.split("\n"):
+                if paragraph.strip():
+                    entry.write(f"<p>{escape(paragraph.strip())}</p>\n".encode("utf-8"))
+            entry.write(b"</body></html>")
+
+    def close(self):
+        written = [index for index in self._indices if index in self._titles]
+        title = escape(self.metadata.get("title") or "Untitled")
+        manifest = "".join(
+            f'<item id="ch{index}" href="{self._chapter_file(index)}" media-type="application/xhtml+xml"/>' for index in written
+        )
+        spine = "".join(f'<itemref idref="ch{index}"/>' for index in written)
+        self._zip.writestr("OEBPS/content.opf",
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="bookid">'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            f'<dc:identifier id="bookid">urn:novel:{title}</dc:identifier><dc:title>{title}</dc:title>'
+            f'<dc:language>{self.metadata.get("language", "zh")}</dc:language>'
+            # EPUB 3 要求的最后修改时间（UTC）
+            f'<meta property="dcterms:modified">{time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}</meta></metadata>'
+            f'<manifest><item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>{manifest}</manifest>'
+            f'<spine>{spine}</spine></package>', compress_type=zipfile.ZIP_DEFLATED)
+        toc = "".join(f'<li><a href="{self._chapter_file(index)}">{self._titles[index]}</a></li>' for index in written)
+        self._zip.writestr("OEBPS/nav.xhtml",
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">'
+            f'<head><title>{title}</title></head><body><nav epub:type="toc"><ol>{toc}</ol></nav></body></html>',
+            compress_type=zipfile.ZIP_DEFLATED)
+        self._zip.close()
+
+    @staticmethod
+    def _chapter_file(index: int) -> str:
+        return f"chapter_{index:04d}.xhtml"
+
+EXPORTERS = {
+    "txt": TextExporter,
+    "md": MarkdownExporter,
+    "markdown": MarkdownExporter,
+    "jsonl": JsonlExporter,
+    "epub": EpubExporter,
+}
+
+def parse_chapter_range(spec: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    """解析章节范围，例如 "5"、"3-10"、"3-"（第3章到最后）、"-10"（开头到第10章）。"""
+    if not spec:
+        return None, None
+    try:
+        if "-" not in spec:
+            return int(spec), int(spec)
+        start, end = spec.split("-", 1)
+        return (int(start) if start.strip() else None), (int(end) if end.strip() else None)
+    except ValueError:
+        raise ValueError(f"Invalid chapter range {spec!r}: expected e.g. '5', '3-10', '3-' or '-10'.") from None
+
+def parse_chapter_selection(spec: str, total: int) -> List[int]:
+    """解析逗号分隔的章节范围列表，例如 "17"、"3-10,17"、"40-"，返回排序去重后的章节序号。
+    开放的范围按 1..total 补全。"""
+    indices = set()
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        start, end = parse_chapter_range(part.strip())
+        indices.update(range(start or 1, (end if end is not None else total) + 1))
+    return sorted(indices)
+
+def export_novel(story_state_manager, output_path: str, fmt: Optional[str] = None,
+                 start: Optional[int] = None, end: Optional[int] = None) -> int:
+    """将已加载状态的小说逐章导出，返回导出的章节数。fmt 为空时根据文件扩展名推断，没有扩展名时为 txt。
+
+    扩展名无法识别（例如 .pdf）或所选范围内没有章节时抛出 ValueError，不写入输出文件。
+    """
+    if fmt is None:
+        extension = os.path.splitext(output_path)[1].lstrip(".").lower()
+        if extension and extension not in EXPORTERS:
+            raise ValueError(f"Cannot infer the export format from '.{extension}'. "
+                             f"Supported: {', '.join(EXPORTERS)}; or pass the format explicitly (--format).")
+        fmt = extension or "txt"
+    if fmt not in EXPORTERS:
+        raise ValueError(f"Unsupported export format: {fmt}. Supported: {', '.join(EXPORTERS)}")
+
+    chapters_content = story_state_manager.chapters_content
+    indices = [index for index in chapters_content
+               if (start is None or index >= start) and (end is None or index <= end)]
+    if not indices:
+        raise ValueError(f"No written chapters in the selected range {start or 1}-{end or ''} "
+                         f"(written chapters: {', '.join(map(str, sorted(chapters_content))) or 'none'}).")
+
+    outline = story_state_manager.outline or {}
+    outline_chapters = outline.get("chapters", [])
+    metadata = {"title": outline.get("title"), "logline": outline.get("logline")}
+
+    exporter = EXPORTERS[fmt](output_path, metadata)
+    exporter.open(indices)
+    try:
+        for index in indices:
+            title = outline_chapters[index - 1].get("title", "") if 0 < index <= len(outline_chapters) else ""
+            exporter.write_chapter(index, title, chapters_content[index])
+    finally:
+        exporter.close()
+    logging.info(f"[Export] Exported {len(indices)} chapters as {fmt} to {output_path}")
+    return len(indices)
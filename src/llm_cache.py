@@ -0,0 +1,191 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, AsyncIterator, Iterator, Optional
+
+from src.llm_client import BaseLLMClient
+from src.metrics import mark_cache_hit
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalizes a prompt for cache keying: strips per-line indentation and trailing whitespace
+    and collapses blank lines, so re-indented f-string prompts map to the same key."""
+    lines = [line.strip() for line in prompt.strip().splitlines()]
+    normalized = []
+    for line in lines:
+        if line or (normalized and normalized[-1]):
+            normalized.append(line)
+    return "\n".join(normalized)
+
+class CachingLLMClient(BaseLLMClient):
+    """Wraps another LLM client and stores its responses in a SQLite file.
+
+    Entries are keyed on (provider, model, normalized prompt, sampling params). Entries older than
+    `max_age_seconds` are ignored and purged; when the cache grows past `max_entries` or
+    `max_bytes`, the least recently used entries are evicted. With `refresh=True` lookups are
+    skipped but new responses are still stored, replacing the old entries (used to regenerate).
+    """
+    provider = "cache"
+
+    def __init__(self, inner: BaseLLMClient, db_path: str,
+                 max_entries: int = 10000, max_bytes: int = 200 * 1024 * 1024,
+                 max_age_seconds: Optional[float] = 30 * 24 * 3600, refresh: bool = False):
+        super().__init__(inner.model, temperature=inner.temperature)
+        self.inner = inner
+        self.provider = inner.provider
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+        self._conn.commit()
+
+    def sampling_params(self) -> Dict[str, Any]:
+        return self.inner.sampling_params()
+
+    def cache_key(self, prompt: str) -> str:
+        payload = json.dumps(
+            [self.inner.provider, self.inner.model, normalize_prompt(prompt), self.inner.sampling_params()],
+            ensure_ascii=False, sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def generate_text(self, prompt: str) -> str:
+        key = self.cache_key(prompt)
+        cached = self._get(key)
+        if cached is not None:
+            return cached
+
+        response = self.inner.generate_text(prompt)
+        if response:  # failed calls return "" and must not be cached
+            self._put(key, response)
+        return response
+
+    def stream_text(self, prompt: str) -> Iterator[str]:
+        key = self.cache_key(prompt)
+        cached = self._get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        parts = []
+        for delta in self.inner.stream_text(prompt):
+            parts.append(delta)
+            yield delta
+        # Only reached when the stream finished without error
+        response = "".join(parts)
+        if response:
+            self._put(key, response)
+
+    # SQLite lookups are local and fast, so the async variants run them inline and only await the inner client
+
+    async def agenerate_text(self, prompt: str) -> str:
+        key = self.cache_key(prompt)
+        cached = self._get(key)
+        if cached is not None:
+            return cached
+
+        response = await self.inner.agenerate_text(prompt)
+        if response:
+            self._put(key, response)
+        return response
+
+    async def astream_text(self, prompt: str) -> AsyncIterator[str]:
+        key = self.cache_key(prompt)
+        cached = self._get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        parts = []
+        async for delta in self.inner.astream_text(prompt):
+            parts.append(delta)
+            yield delta
+        response = "".join(parts)
+        if response:
+            self._put(key, response)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _get(self, key: str) -> Optional[str]:
+        if self.refresh:
+            with self._lock:
+                self.misses += 1
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.max_age_seconds is not None and now - row[1] > self.max_age_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        mark_cache_hit()
+        logging.info(f"[LLMCache] Cache hit for {self.inner.provider}/{self.inner.model} ({key[:12]})")
+        return row[0]
+
+    def _put(self, key: str, response: str):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        if self.max_age_seconds is not None:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age_seconds,))
+        entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if entries <= self.max_entries and total <= self.max_bytes:
+            return
+        # Evict least recently used entries until both limits are satisfied
+        evict_keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC"):
+            if entries <= self.max_entries and total <= self.max_bytes:
+                break
+            evict_keys.append((key,))
+            entries -= 1
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evict_keys)
+        logging.info(f"[LLMCache] Evicted {len(evict_keys)} entries")
@@ -1,41 +1,321 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import Dict, Any, AsyncIterator, Callable, Iterator, Optional, Tuple
+import asyncio
+import atexit
+import hashlib
+import json
 import os
+import re
 import logging
+import threading
+import weakref
 
-# Assuming openai is installed and used for DeepSeek
-from openai import OpenAI
+from src.metrics import record_usage
+
+DEEPSEEK_BASE_URL = "https://api.deepseek.com/v1"
+
+class LLMError(Exception):
+    """Raised by LLM clients when a call fails.
+
+    `retryable` marks transient failures (rate limits, timeouts, 5xx); `retry_after` carries the
+    provider's Retry-After hint in seconds, if any.
+    """
+    def __init__(self, message: str, retryable: bool = False, status_code: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate without a tokenizer: ~1 token per CJK character, ~4 characters per token otherwise."""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
 
 class BaseLLMClient(ABC):
     """Abstract base class for all LLM clients."""
-    def __init__(self, model: str):
+    provider = "base"
+
+    def __init__(self, model: str, temperature: Optional[float] = None):
         self.model = model
+        self.temperature = temperature
 
     @abstractmethod
     def generate_text(self, prompt: str) -> str:
-        """Generates text based on the given prompt."""
+        """Generates text based on the given prompt. Returns "" on failure."""
         pass
 
+    def complete(self, prompt: str) -> str:
+        """Like generate_text, but raises LLMError instead of returning "" on failure."""
+        text = self.generate_text(prompt)
+        if not text:
+            raise LLMError(f"{self.provider}/{self.model} returned an empty response", retryable=True)
+        return text
+
+    def stream_text(self, prompt: str) -> Iterator[str]:
+        """Yields the generated text as incremental deltas.
+
+        Clients without native streaming yield the full response as a single delta.
+        Unlike generate_text, errors propagate to the caller so partial output can be handled.
+        """
+        text = self.generate_text(prompt)
+        if text:
+            yield text
+
+    # Async variants. The defaults adapt the sync methods by running them in a worker thread;
+    # clients with a native async transport override them so that an in-flight call holds no thread.
+
+    async def agenerate_text(self, prompt: str) -> str:
+        """Async generate_text. Returns "" on failure."""
+        return await asyncio.to_thread(self.generate_text, prompt)
+
+    async def acomplete(self, prompt: str) -> str:
+        """Async complete. Raises LLMError on failure."""
+        text = await self.agenerate_text(prompt)
+        if not text:
+            raise LLMError(f"{self.provider}/{self.model} returned an empty response", retryable=True)
+        return text
+
+    async def astream_text(self, prompt: str) -> AsyncIterator[str]:
+        """Async stream_text; by default yields the full response as a single delta."""
+        text = await self.agenerate_text(prompt)
+        if text:
+            yield text
+
+    def sampling_params(self) -> Dict[str, Any]:
+        """Sampling parameters sent with every request (only those explicitly set)."""
+        params = {}
+        if self.temperature is not None:
+            params["temperature"] = self.temperature
+        return params
+
 class DeepSeekLLMClient(BaseLLMClient):
     """LLM client for DeepSeek API, using OpenAI compatibility."""
-    def __init__(self, api_key: str, model: str):
-        super().__init__(model)
-        self.client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com/v1")
+    provider = "deepseek"
+
+    def __init__(self, api_key: str, model: str, temperature: Optional[float] = None, timeout: Optional[float] = None,
+                 base_url: str = DEEPSEEK_BASE_URL, client=None, pool_size: int = 20):
+        super().__init__(model, temperature=temperature)
+        self.base_url = base_url
+        self.timeout = timeout
+        self.api_key = api_key
+        self.pool_size = pool_size
+        # Pass a shared SDK client (see LLMClientRegistry) to reuse its connection pool
+        self.client = client or get_client_registry().openai_client(base_url, api_key)
 
     def generate_text(self, prompt: str) -> str:
+        try:
+            return self.complete(prompt)
+        except LLMError as e:
+            logging.error(f"Error generating text with DeepSeek LLM: {e}")
+            return ""
+
+    def complete(self, prompt: str) -> str:
         try:
             response = self.client.chat.completions.create(
                 model=self.model,
                 messages=[{"role": "user", "content": prompt}],
-                stream=False
+                stream=False,
+                timeout=self.timeout,
+                **self.sampling_params()
+            )
+        except Exception as e:
+            raise _to_llm_error(e) from e
+        if response.usage is not None:
+            _record_api_usage(response.usage)
+        return response.choices[0].message.content
+
+    def stream_text(self, prompt: str) -> Iterator[str]:
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                stream=True,
+                # The last chunk then carries the token usage for the whole response
+                stream_options={"include_usage": True},
+                timeout=self.timeout,
+                **self.sampling_params()
             )
-            return response.choices[0].message.content
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if getattr(chunk, "usage", None) is not None:
+                    _record_api_usage(chunk.usage)
         except Exception as e:
+            raise _to_llm_error(e) from e
+
+    async def agenerate_text(self, prompt: str) -> str:
+        try:
+            return await self.acomplete(prompt)
+        except LLMError as e:
             logging.error(f"Error generating text with DeepSeek LLM: {e}")
             return ""
 
+    async def acomplete(self, prompt: str) -> str:
+        client = get_client_registry().async_openai_client(self.base_url, self.api_key, pool_size=self.pool_size)
+        try:
+            response = await client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                stream=False,
+                timeout=self.timeout,
+                **self.sampling_params()
+            )
+        except Exception as e:
+            raise _to_llm_error(e) from e
+        if response.usage is not None:
+            _record_api_usage(response.usage)
+        return response.choices[0].message.content
+
+    async def astream_text(self, prompt: str) -> AsyncIterator[str]:
+        client = get_client_registry().async_openai_client(self.base_url, self.api_key, pool_size=self.pool_size)
+        try:
+            stream = await client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=self.timeout,
+                **self.sampling_params()
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if getattr(chunk, "usage", None) is not None:
+                    _record_api_usage(chunk.usage)
+        except Exception as e:
+            raise _to_llm_error(e) from e
+
+def _record_api_usage(usage):
+    """Forwards an OpenAI-compatible `usage` object to the metrics, including prompt-prefix cache hits
+    (DeepSeek reports `prompt_cache_hit_tokens`, OpenAI `prompt_tokens_details.cached_tokens`)."""
+    cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    if cached is None:
+        cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+    record_usage(usage.prompt_tokens, usage.completion_tokens, cached_prompt_tokens=cached)
+
+def _to_llm_error(error: Exception) -> LLMError:
+    """Maps an OpenAI-compatible SDK exception to LLMError, classifying transient failures as retryable."""
+    status_code = getattr(error, "status_code", None)
+    retry_after = None
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            retry_after = float(response.headers.get("retry-after"))
+        except (TypeError, ValueError, AttributeError):
+            retry_after = None
+    if status_code is not None:
+        retryable = status_code in (408, 409, 429) or status_code >= 500
+    else:
+        # No HTTP status: connection errors and timeouts are transient
+        retryable = type(error).__name__ in ("APIConnectionError", "APITimeoutError", "TimeoutError", "ConnectionError")
+    return LLMError(f"{type(error).__name__}: {error}", retryable=retryable, status_code=status_code, retry_after=retry_after)
+
+class LLMClientRegistry:
+    """Process-wide registry of pooled LLM clients.
+
+    SDK clients (and their HTTP connection pools) are shared per (base_url, API key), so every
+    model on the same host reuses the same keep-alive/TLS connections. Wrapped LLM clients are
+    shared per (provider, model, base_url, sampling params), so workflows created from the same
+    config also share retries, rate limits and the circuit breaker.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._llm_clients: Dict[Tuple, BaseLLMClient] = {}
+        self._sdk_clients: Dict[Tuple, Any] = {}
+        # Async SDK clients hold connections bound to one event loop, so they are pooled per loop
+        self._async_sdk_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, Any]]" = weakref.WeakKeyDictionary()
+
+    def get_or_create(self, key: Tuple, builder: Callable[[], BaseLLMClient]) -> BaseLLMClient:
+        with self._lock:
+            client = self._llm_clients.get(key)
+            if client is None:
+                client = builder()
+                self._llm_clients[key] = client
+            return client
+
+    def openai_client(self, base_url: str, api_key: str, pool_size: int = 20, warm_connections: int = 0):
+        """Returns the shared OpenAI-compatible SDK client for this endpoint, creating it on first use."""
+        key = (base_url, hashlib.sha256(api_key.encode("utf-8")).hexdigest(), pool_size)
+        with self._lock:
+            client = self._sdk_clients.get(key)
+            if client is not None:
+                return client
+            # Imported lazily so that commands which never call the LLM don't pay for the openai import
+            import httpx
+            from openai import OpenAI, DefaultHttpxClient
+            http_client = DefaultHttpxClient(
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            )
+            # Retries are handled by ResilientLLMClient, so the SDK's own retry loop is disabled
+            client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0, http_client=http_client)
+            self._sdk_clients[key] = client
+        if warm_connections > 0:
+            self._warm(client, min(warm_connections, pool_size))
+        return client
+
+    def async_openai_client(self, base_url: str, api_key: str, pool_size: int = 20):
+        """Returns the shared async SDK client for this endpoint on the running event loop."""
+        loop = asyncio.get_running_loop()
+        key = (base_url, hashlib.sha256(api_key.encode("utf-8")).hexdigest(), pool_size)
+        with self._lock:
+            clients = self._async_sdk_clients.setdefault(loop, {})
+            client = clients.get(key)
+            if client is None:
+                import httpx
+                from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+                http_client = DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                )
+                client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0, http_client=http_client)
+                clients[key] = client
+            return client
+
+    def close(self):
+        with self._lock:
+            for client in self._sdk_clients.values():
+                try:
+                    client.close()
+                except Exception as e:
+                    logging.debug(f"[LLM] Error closing client: {e}")
+            self._sdk_clients.clear()
+            # Async clients can only be closed from their own event loop; dropping them releases the pools
+            self._async_sdk_clients.clear()
+            self._llm_clients.clear()
+
+    @staticmethod
+    def _warm(client, connections: int):
+        """Opens `connections` keep-alive connections in the background with a cheap request,
+        so the first real calls skip the TCP/TLS handshake."""
+        def ping():
+            try:
+                client.models.list(timeout=10)
+            except Exception as e:
+                logging.debug(f"[LLM] Connection warm-up failed: {e}")
+        for _ in range(connections):
+            threading.Thread(target=ping, name="llm-warmup", daemon=True).start()
+
+_registry = LLMClientRegistry()
+atexit.register(_registry.close)
+
+def get_client_registry() -> LLMClientRegistry:
+    return _registry
+
+# Config keys that shape a pooled client (transport, retries, rate limits, breaker); part of the pool key
+_CLIENT_SETTINGS = ("timeout", "connectionPoolSize", "warmConnections", "maxRetries", "retryBaseDelay", "retryMaxDelay",
+                    "requestsPerMinute", "tokensPerMinute", "circuitBreakerThreshold", "circuitBreakerResetTimeout")
+
 def LLMClientFactory(config: Dict[str, Any]) -> BaseLLMClient:
-    """Factory function to create LLM client instances based on configuration."""
+    """Factory function to create LLM client instances based on configuration.
+
+    Clients are pooled: calling the factory again with the same provider, model, base URL, sampling
+    params and client settings (_CLIENT_SETTINGS) returns the same shared client; a call with different
+    settings gets its own client instead of a cached one with stale configuration.
+    """
     provider = config.get("provider")
     model_id = config.get("modelId")
 
@@ -43,7 +323,21 @@ def LLMClientFactory(config: Dict[str, Any]) -> BaseLLMClient:
         api_key = os.environ.get("DEEPSEEK_API_KEY")
         if not api_key:
             raise ValueError("DEEPSEEK_API_KEY environment variable is not set.")
-        return DeepSeekLLMClient(api_key=api_key, model=model_id)
+        base_url = config.get("baseURL", DEEPSEEK_BASE_URL)
+
+        def build() -> BaseLLMClient:
+            sdk_client = _registry.openai_client(base_url, api_key, pool_size=config.get("connectionPoolSize", 20),
+                                                 warm_connections=config.get("warmConnections", 1))
+            return DeepSeekLLMClient(api_key=api_key, model=model_id, temperature=config.get("temperature"),
+                                     timeout=config.get("timeout", 120), base_url=base_url, client=sdk_client,
+                                     pool_size=config.get("connectionPoolSize", 20))
+    elif provider == "mock":
+        # Offline deterministic backend (see src/llm_mock.py), no API key required
+        base_url = None
+
+        def build() -> BaseLLMClient:
+            from src.llm_mock import MockLLMClient
+            return MockLLMClient.from_config(config)
     # Add more providers here as needed
     # elif provider == "openai":
     #     api_key = os.environ.get("OPENAI_API_KEY")
@@ -52,3 +346,11 @@ def LLMClientFactory(config: Dict[str, Any]) -> BaseLLMClient:
     #     return OpenAILLMClient(api_key=api_key, model=model_id)
     else:
         raise ValueError(f"Unsupported LLM provider: {provider}")
+
+    # All agents share this one wrapper, so retries, rate limits and the circuit breaker are process-wide
+    from src.llm_resilience import ResilientLLMClient
+    key = (provider, model_id, base_url) + tuple(config.get(name) for name in ("temperature", *_CLIENT_SETTINGS))
+    if provider == "mock":
+        # Mock settings change the responses themselves, so each distinct config gets its own client
+        key += (json.dumps(config, sort_keys=True),)
+    return _registry.get_or_create(key, lambda: ResilientLLMClient.from_config(build(), config))
@@ -0,0 +1,103 @@
+import time
+from typing import Dict, Any, AsyncIterator, Iterator
+
+from src.llm_client import BaseLLMClient, estimate_tokens
+from src.metrics import MetricsRecorder, current_agent, start_call, end_call
+
+class InstrumentedLLMClient(BaseLLMClient):
+    """Wraps an LLM client and records every call into a MetricsRecorder.
+
+    Sits outermost, so latency is what the agent experiences (including cache lookups, rate-limit
+    waits and retries). Token counts come from the provider's `usage` field via record_usage();
+    cache hits are recorded with the counts estimated but excluded from token totals.
+    """
+    provider = "instrumented"
+
+    def __init__(self, inner: BaseLLMClient, recorder: MetricsRecorder):
+        super().__init__(inner.model, temperature=inner.temperature)
+        self.inner = inner
+        self.provider = inner.provider
+        self.recorder = recorder
+
+    def sampling_params(self) -> Dict[str, Any]:
+        return self.inner.sampling_params()
+
+    def generate_text(self, prompt: str) -> str:
+        call, token, start = self._begin(prompt, stream=False)
+        text = ""
+        try:
+            text = self.inner.generate_text(prompt)
+            return text
+        finally:
+            self._end(call, token, start, prompt, text, ok=bool(text))
+
+    def complete(self, prompt: str) -> str:
+        call, token, start = self._begin(prompt, stream=False)
+        text = ""
+        try:
+            text = self.inner.complete(prompt)
+            return text
+        finally:
+            self._end(call, token, start, prompt, text, ok=bool(text))
+
+    def stream_text(self, prompt: str) -> Iterator[str]:
+        call, token, start = self._begin(prompt, stream=True)
+        parts, ok = [], False
+        try:
+            for delta in self.inner.stream_text(prompt):
+                if not parts:
+                    call["ttft"] = round(time.perf_counter() - start, 4)
+                parts.append(delta)
+                yield delta
+            ok = True
+        finally:
+            self._end(call, token, start, prompt, "".join(parts), ok=ok)
+
+    async def agenerate_text(self, prompt: str) -> str:
+        call, token, start = self._begin(prompt, stream=False)
+        text = ""
+        try:
+            text = await self.inner.agenerate_text(prompt)
+            return text
+        finally:
+            self._end(call, token, start, prompt, text, ok=bool(text))
+
+    async def acomplete(self, prompt: str) -> str:
+        call, token, start = self._begin(prompt, stream=False)
+        text = ""
+        try:
+            text = await self.inner.acomplete(prompt)
+            return text
+        finally:
+            self._end(call, token, start, prompt, text, ok=bool(text))
+
+    async def astream_text(self, prompt: str) -> AsyncIterator[str]:
+        call, token, start = self._begin(prompt, stream=True)
+        parts, ok = [], False
+        try:
+            async for delta in self.inner.astream_text(prompt):
+                if not parts:
+                    call["ttft"] = round(time.perf_counter() - start, 4)
+                parts.append(delta)
+                yield delta
+            ok = True
+        finally:
+            self._end(call, token, start, prompt, "".join(parts), ok=ok)
+
+    def _begin(self, prompt: str, stream: bool):
+        call = {"agent": current_agent(), "provider": self.inner.provider, "model": self.inner.model,
+                "stream": stream, "cached": False, "ttft": None}
+        return call, start_call(call), time.perf_counter()
+
+    def _end(self, call: Dict[str, Any], token, start: float, prompt: str, text: str, ok: bool):
+        end_call(token)
+        call["latency"] = round(time.perf_counter() - start, 4)
+        if not call["stream"]:
+            # Without streaming the first token arrives with the whole response
+            call["ttft"] = call["latency"]
+        if call.get("usage") != "api":
+            call["prompt_tokens"], call["completion_tokens"] = estimate_tokens(prompt), estimate_tokens(text)
+            call["usage"] = "estimate"
+        call["ok"] = ok
+        call["timestamp"] = time.time()
+        self.recorder.record_llm_call(call)
@@ -0,0 +1,218 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional, Set
+
+from src.llm_client import BaseLLMClient, LLMError, estimate_tokens
+from src.metrics import record_usage
+
+_NAMES = ["Lin Feng", "Mara Voss", "Chen Yu", "Ilya Brandt", "Sora Kein", "Tomas Reyes", "Aiko Mori", "Dax Holloway"]
+_TRAITS = ["stubborn", "curious", "loyal", "reckless", "patient", "cunning", "warm", "guarded", "ambitious", "wry"]
+_WORDS = ("the city rain light door shadow voice memory signal street night hand window engine silence "
+          "truth promise glass river code dream fire steel path question answer stranger heart map").split()
+
+_PREFIX_BLOCK_CHARS = 256
+
+class MockLLMClient(BaseLLMClient):
+    """Offline LLM backend for development and benchmarks.
+
+    Recognizes the outline, character, chapter and scene prompts used by the agents and returns valid
+    outline JSON, character JSON, scene plans and chapter or scene text; any other prompt gets a short paragraph.
+    Output is deterministic for a given (seed, prompt). Latency, token rate and failure rate are
+    configurable (including a slow tail) so that orchestration overhead, retry and hedging paths can be
+    measured without an API key.
+    """
+    provider = "mock"
+
+    def __init__(self, model: str = "mock", temperature: Optional[float] = None, latency: float = 0.0,
+                 latency_jitter: float = 0.0, tokens_per_second: Optional[float] = None, failure_rate: float = 0.0,
+                 slow_rate: float = 0.0, slow_delay: float = 0.0, chapters: int = 5, chapter_words: int = 1000, characters: int = 4, seed: int = 0):
+        super().__init__(model, temperature=temperature)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+        # Heavy latency tail: a share of calls stalls for slow_delay extra seconds before the first token
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.chapters = chapters
+        self.chapter_words = chapter_words
+        self.characters = min(characters, len(_NAMES))
+        self.seed = seed
+        # Failures are drawn per call (not per prompt), so a retried prompt can succeed
+        self._failure_rng = random.Random(seed)
+        self._calls = itertools.count()
+        self._lock = threading.Lock()
+        # Simulated provider-side prefix cache: hashes of prompt prefixes seen so far, per block
+        self._prefix_blocks: Set[str] = set()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "MockLLMClient":
+        return cls(
+            model=config.get("modelId") or "mock",
+            temperature=config.get("temperature"),
+            latency=config.get("latency", 0.0),
+            latency_jitter=config.get("latencyJitter", 0.0),
+            tokens_per_second=config.get("tokensPerSecond"),
+            failure_rate=config.get("failureRate", 0.0),
+            slow_rate=config.get("slowRate", 0.0),
+            slow_delay=config.get("slowDelay", 0.0),
+            chapters=config.get("chapters", 5),
+            chapter_words=config.get("chapterWords", 1000),
+            characters=config.get("characters", 4),
+            seed=config.get("seed", 0),
+        )
+
+    def generate_text(self, prompt: str) -> str:
+        try:
+            return self.complete(prompt)
+        except LLMError:
+            return ""
+
+    def complete(self, prompt: str) -> str:
+        text = self._respond(prompt)
+        self._maybe_fail()
+        time.sleep(self._first_token_delay() + self._generation_time(text))
+        record_usage(estimate_tokens(prompt), estimate_tokens(text), cached_prompt_tokens=self._prefix_cache_hit(prompt))
+        return text
+
+    def stream_text(self, prompt: str) -> Iterator[str]:
+        text = self._respond(prompt)
+        self._maybe_fail()
+        time.sleep(self._first_token_delay())
+        words = text.split(" ")
+        for start in range(0, len(words), 20):
+            delta = " ".join(words[start:start + 20]) + (" " if start + 20 < len(words) else "")
+            time.sleep(self._generation_time(delta))
+            yield delta
+        record_usage(estimate_tokens(prompt), estimate_tokens(text), cached_prompt_tokens=self._prefix_cache_hit(prompt))
+
+    async def agenerate_text(self, prompt: str) -> str:
+        try:
+            return await self.acomplete(prompt)
+        except LLMError:
+            return ""
+
+    async def acomplete(self, prompt: str) -> str:
+        text = self._respond(prompt)
+        self._maybe_fail()
+        await asyncio.sleep(self._first_token_delay() + self._generation_time(text))
+        record_usage(estimate_tokens(prompt), estimate_tokens(text), cached_prompt_tokens=self._prefix_cache_hit(prompt))
+        return text
+
+    async def astream_text(self, prompt: str) -> AsyncIterator[str]:
+        text = self._respond(prompt)
+        self._maybe_fail()
+        await asyncio.sleep(self._first_token_delay())
+        words = text.split(" ")
+        for start in range(0, len(words), 20):
+            delta = " ".join(words[start:start + 20]) + (" " if start + 20 < len(words) else "")
+            await asyncio.sleep(self._generation_time(delta))
+            yield delta
+        record_usage(estimate_tokens(prompt), estimate_tokens(text), cached_prompt_tokens=self._prefix_cache_hit(prompt))
+
+    # ---- simulated provider behaviour ----
+
+    def _maybe_fail(self):
+        with self._lock:
+            call = next(self._calls)
+            failed = self.failure_rate > 0 and self._failure_rng.random() < self.failure_rate
+        if failed:
+            raise LLMError(f"mock/{self.model}: simulated failure on call {call}", retryable=True, status_code=503)
+
+    def _prefix_cache_hit(self, prompt: str) -> int:
+        """Tokens of the longest previously seen prompt prefix, counted in whole blocks like
+        provider prefix caches (DeepSeek caches 64-token units)."""
+        hashes, digest = [], hashlib.sha256()
+        for end in range(_PREFIX_BLOCK_CHARS, len(prompt) + 1, _PREFIX_BLOCK_CHARS):
+            digest.update(prompt[end - _PREFIX_BLOCK_CHARS:end].encode("utf-8"))
+            hashes.append(digest.copy().hexdigest())
+        with self._lock:
+            hit = next((i for i, h in enumerate(hashes) if h not in self._prefix_blocks), len(hashes))
+            if len(self._prefix_blocks) > 100_000:
+                self._prefix_blocks.clear()
+            self._prefix_blocks.update(hashes)
+        return estimate_tokens(prompt[:hit * _PREFIX_BLOCK_CHARS])
+
+    def _first_token_delay(self) -> float:
+        delay = self.latency
+        if self.latency_jitter or self.slow_rate:
+            with self._lock:
+                if self.latency_jitter:
+                    delay = max(0.0, delay + self._failure_rng.uniform(-self.latency_jitter, self.latency_jitter))
+                if self.slow_rate and self._failure_rng.random() < self.slow_rate:
+                    delay += self.slow_delay
+        return delay
+
+    def _generation_time(self, text: str) -> float:
+        return estimate_tokens(text) / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    # ---- responses ----
+
+    def _respond(self, prompt: str) -> str:
+        rng = random.Random(f"{self.seed}:{hashlib.sha256(prompt.encode('utf-8')).hexdigest()}")
+        if "novel outline" in prompt and '"chapters"' in prompt:
+            return self._outline(rng)
+        if "character profiles" in prompt:
+            return self._characters(rng)
+        scene_plan = re.search(r"as (\d+) consecutive scenes", prompt)
+        if scene_plan:
+            return self._scene_plan(rng, int(scene_plan.group(1)))
+        if "Rewrite the opening paragraph" in prompt:
+            return self._paragraph(rng, 40)
+        scene = re.search(r"Write scene \d+ of (\d+)", prompt)
+        if scene:
+            # Each scene gets its share of chapter_words, so chapters stay the same length in scene mode
+            return self._chapter(rng, prompt, words=self.chapter_words // int(scene.group(1)))
+        if "Chapter Title:" in prompt:
+            return self._chapter(rng, prompt)
+        return self._paragraph(rng, 60)
+
+    def _outline(self, rng: random.Random) -> str:
+        names = self._names()
+        chapters = [
+            {"title": f"{rng.choice(_WORDS).title()} {rng.choice(_WORDS).title()} {i}",
+             "summary": f"{rng.choice(names)} follows the {rng.choice(_WORDS)} toward the {rng.choice(_WORDS)}.",
+             "characters": rng.sample(names, min(2, len(names)))}
+            for i in range(1, self.chapters + 1)
+        ]
+        return json.dumps({"title": f"The {rng.choice(_WORDS).title()} of {rng.choice(_WORDS).title()}",
+                           "logline": self._paragraph(rng, 20), "chapters": chapters}, ensure_ascii=False)
+
+    def _characters(self, rng: random.Random) -> str:
+        return json.dumps([
+            {"name": name, "personality": rng.sample(_TRAITS, 3), "background": self._paragraph(rng, 25),
+             "role": rng.choice(["protagonist", "antagonist", "mentor", "rival", "ally"]),
+             "unique_traits": self._paragraph(rng, 8)}
+            for name in self._names()
+        ], ensure_ascii=False)
+
+    def _scene_plan(self, rng: random.Random, scenes: int) -> str:
+        return json.dumps({"scenes": [{"summary": self._paragraph(rng, 15)} for _ in range(scenes)]})
+
+    def _chapter(self, rng: random.Random, prompt: str, words: Optional[int] = None) -> str:
+        """Chapter text of chapter_words words (or `words`, e.g. for one scene of a chapter)."""
+        names = [name for name in self._names() if name in prompt] or self._names()
+        scene = words is not None
+        target = words if scene else self.chapter_words
+        paragraphs, words = [], 0
+        while words < target:
+            # Scenes are short, so their last paragraph is trimmed to the target instead of overshooting
+            size = max(10, min(80, target - words - 1)) if scene else 80
+            paragraph = f"{rng.choice(names)} {self._paragraph(rng, size)}"
+            paragraphs.append(paragraph)
+            words += len(paragraph.split())
+        return "\n\n".join(paragraphs)
+
+    def _names(self) -> List[str]:
+        return _NAMES[:self.characters]
+
+    @staticmethod
+    def _paragraph(rng: random.Random, words: int) -> str:
+        text = " ".join(rng.choice(_WORDS) for _ in range(words))
+        return text[0].upper() + text[1:] + "."
@@ -0,0 +1,334 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Dict, Any, AsyncIterator, Iterator, Optional
+
+from src.llm_client import BaseLLMClient, LLMError, estimate_tokens
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate_per_minute`.
+
+    acquire() blocks until enough capacity is available. The level may go negative when a caller
+    reports more usage than it reserved (see consume()), which delays later callers accordingly.
+    """
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0):
+        while True:
+            wait = self._try_take(amount)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self, amount: float = 1.0):
+        """Like acquire(), but waits without blocking the event loop."""
+        while True:
+            wait = self._try_take(amount)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def _try_take(self, amount: float) -> float:
+        """Takes `amount` if available and returns 0, otherwise returns the seconds to wait."""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self._level >= amount:
+                self._level -= amount
+                return 0.0
+            return (amount - self._level) / self.rate_per_second
+
+    def consume(self, amount: float):
+        """Charges usage without waiting (e.g. completion tokens known only after the call)."""
+        with self._lock:
+            self._refill()
+            self._level -= amount
+
+    def _refill(self):
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits, each enforced by a token bucket."""
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def acquire(self, estimated_tokens: int):
+        if self.requests:
+            self.requests.acquire(1)
+        if self.tokens:
+            self.tokens.acquire(estimated_tokens)
+
+    async def aacquire(self, estimated_tokens: int):
+        if self.requests:
+            await self.requests.aacquire(1)
+        if self.tokens:
+            await self.tokens.aacquire(estimated_tokens)
+
+    def record_usage(self, extra_tokens: int):
+        if self.tokens and extra_tokens > 0:
+            self.tokens.consume(extra_tokens)
+
+class CircuitOpenError(LLMError):
+    """Raised without calling the provider while the circuit breaker is open."""
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and rejects calls for `reset_timeout` seconds.
+
+    After the timeout a single trial call is let through (half-open): success closes the circuit,
+    failure opens it again, and a trial that ends without an outcome (cancelled) lets the next call try.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self) -> bool:
+        """Raises CircuitOpenError if the call must not run; returns True if it is the half-open trial call."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError("Circuit breaker is open; skipping LLM call", retryable=True)
+                self.state = self.HALF_OPEN
+                return True
+            if self.state == self.HALF_OPEN:
+                # Only the one trial call may run while half-open
+                raise CircuitOpenError("Circuit breaker is half-open; trial call in progress", retryable=True)
+            return False
+
+    def abandon_trial(self):
+        """The trial call ended without success or failure (e.g. a cancelled hedged request):
+        back to open with the reset timeout already elapsed, so the next call becomes the trial."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic() - self.reset_timeout
+
+    def is_open(self) -> bool:
+        """True while calls would be rejected without trying: open and the reset timeout has not passed,
+        or half-open with the trial call still in flight."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                return True
+            return self.state == self.OPEN and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.warning(f"[LLM] Circuit breaker opened after {self._failures} consecutive failures")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+class ResilientLLMClient(BaseLLMClient):
+    """Wraps an LLM client with rate limiting, a circuit breaker and retries with jittered exponential backoff.
+
+    Share one instance across all agents (and workflows) so that every call goes through the same
+    rate limiter and breaker. generate_text keeps the "" on failure contract once retries are exhausted.
+    """
+    provider = "resilient"
+
+    def __init__(self, inner: BaseLLMClient, max_retries: int = 4, base_delay: float = 1.0, max_delay: float = 30.0,
+                 rate_limiter: Optional[RateLimiter] = None, circuit_breaker: Optional[CircuitBreaker] = None,
+                 expected_completion_tokens: int = 1500):
+        super().__init__(inner.model, temperature=inner.temperature)
+        self.inner = inner
+        self.provider = inner.provider
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.expected_completion_tokens = expected_completion_tokens
+
+    @classmethod
+    def from_config(cls, inner: BaseLLMClient, config: Dict[str, Any]) -> "ResilientLLMClient":
+        """Builds the wrapper from optional keys of the model config (see README)."""
+        return cls(
+            inner,
+            max_retries=config.get("maxRetries", 4),
+            base_delay=config.get("retryBaseDelay", 1.0),
+            max_delay=config.get("retryMaxDelay", 30.0),
+            rate_limiter=RateLimiter(config.get("requestsPerMinute"), config.get("tokensPerMinute")),
+            circuit_breaker=CircuitBreaker(config.get("circuitBreakerThreshold", 5), config.get("circuitBreakerResetTimeout", 30.0)),
+        )
+
+    def sampling_params(self) -> Dict[str, Any]:
+        return self.inner.sampling_params()
+
+    def generate_text(self, prompt: str) -> str:
+        try:
+            return self.complete(prompt)
+        except LLMError as e:
+            logging.error(f"[LLM] Giving up on {self.inner.provider}/{self.inner.model}: {e}")
+            return ""
+
+    def complete(self, prompt: str) -> str:
+        attempt = 0
+        while True:
+            trial = False
+            try:
+                trial = self.circuit_breaker.before_call()
+                self._reserve(prompt)
+                text = self.inner.complete(prompt)
+            except CircuitOpenError as e:
+                attempt = self._backoff_or_raise(e, attempt)
+                continue
+            except LLMError as e:
+                self._record_error(e, trial)
+                attempt = self._backoff_or_raise(e, attempt)
+                continue
+            except BaseException as e:
+                self._unexpected_exit(e, trial)
+                raise
+            self.circuit_breaker.record_success()
+            self.rate_limiter.record_usage(estimate_tokens(text) - self.expected_completion_tokens)
+            return text
+
+    def stream_text(self, prompt: str) -> Iterator[str]:
+        attempt = 0
+        while True:
+            produced = []
+            trial = False
+            try:
+                trial = self.circuit_breaker.before_call()
+                self._reserve(prompt)
+                for delta in self.inner.stream_text(prompt):
+                    produced.append(delta)
+                    yield delta
+            except CircuitOpenError as e:
+                attempt = self._backoff_or_raise(e, attempt)
+                continue
+            except LLMError as e:
+                self._record_error(e, trial)
+                if produced:
+                    # Deltas were already handed to the caller; retrying would duplicate text
+                    raise
+                attempt = self._backoff_or_raise(e, attempt)
+                continue
+            except BaseException as e:
+                # Includes GeneratorExit when the caller closes the stream early
+                self._unexpected_exit(e, trial)
+                raise
+            self.circuit_breaker.record_success()
+            self.rate_limiter.record_usage(estimate_tokens("".join(produced)) - self.expected_completion_tokens)
+            return
+
+    async def agenerate_text(self, prompt: str) -> str:
+        try:
+            return await self.acomplete(prompt)
+        except LLMError as e:
+            logging.error(f"[LLM] Giving up on {self.inner.provider}/{self.inner.model}: {e}")
+            return ""
+
+    async def acomplete(self, prompt: str) -> str:
+        attempt = 0
+        while True:
+            trial = False
+            try:
+                trial = self.circuit_breaker.before_call()
+                await self._areserve(prompt)
+                text = await self.inner.acomplete(prompt)
+            except CircuitOpenError as e:
+                attempt = await self._abackoff_or_raise(e, attempt)
+                continue
+            except LLMError as e:
+                self._record_error(e, trial)
+                attempt = await self._abackoff_or_raise(e, attempt)
+                continue
+            except BaseException as e:
+                self._unexpected_exit(e, trial)
+                raise
+            self.circuit_breaker.record_success()
+            self.rate_limiter.record_usage(estimate_tokens(text) - self.expected_completion_tokens)
+            return text
+
+    async def astream_text(self, prompt: str) -> AsyncIterator[str]:
+        attempt = 0
+        while True:
+            produced = []
+            trial = False
+            try:
+                trial = self.circuit_breaker.before_call()
+                await self._areserve(prompt)
+                async for delta in self.inner.astream_text(prompt):
+                    produced.append(delta)
+                    yield delta
+            except CircuitOpenError as e:
+                attempt = await self._abackoff_or_raise(e, attempt)
+                continue
+            except LLMError as e:
+                self._record_error(e, trial)
+                if produced:
+                    raise
+                attempt = await self._abackoff_or_raise(e, attempt)
+                continue
+            except BaseException as e:
+                self._unexpected_exit(e, trial)
+                raise
+            self.circuit_breaker.record_success()
+            self.rate_limiter.record_usage(estimate_tokens("".join(produced)) - self.expected_completion_tokens)
+            return
+
+    def _reserve(self, prompt: str):
+        self.rate_limiter.acquire(estimate_tokens(prompt) + self.expected_completion_tokens)
+
+    async def _areserve(self, prompt: str):
+        await self.rate_limiter.aacquire(estimate_tokens(prompt) + self.expected_completion_tokens)
+
+    def _record_error(self, error: LLMError, trial: bool):
+        """Only transient failures (timeouts, connection errors, 429, 5xx) count against the breaker.
+        A non-retryable error such as 400 or 401 is a problem with the request, not an outage, so a batch
+        of bad prompts does not open the circuit; if it ended the half-open trial, the next call tries again."""
+        if error.retryable:
+            self.circuit_breaker.record_failure()
+        elif trial:
+            self.circuit_breaker.abandon_trial()
+
+    def _unexpected_exit(self, error: BaseException, trial: bool):
+        """Settles the breaker when a call ends other than by returning or raising LLMError, so a
+        half-open trial cannot stay in flight forever: other exceptions count as failures, and
+        cancellation (CancelledError, GeneratorExit, KeyboardInterrupt) gives up the trial."""
+        if isinstance(error, Exception):
+            self.circuit_breaker.record_failure()
+        elif trial:
+            self.circuit_breaker.abandon_trial()
+
+    def _backoff_or_raise(self, error: LLMError, attempt: int) -> int:
+        time.sleep(self._backoff_delay(error, attempt))
+        return attempt + 1
+
+    async def _abackoff_or_raise(self, error: LLMError, attempt: int) -> int:
+        await asyncio.sleep(self._backoff_delay(error, attempt))
+        return attempt + 1
+
+    def _backoff_delay(self, error: LLMError, attempt: int) -> float:
+        """Raises `error` if it is not retryable or retries are exhausted, otherwise returns the delay before the next attempt."""
+        if not error.retryable or attempt >= self.max_retries:
+            raise error
+        # Full jitter: spreads out retries from concurrent callers instead of retrying in lockstep
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if error.retry_after is not None:
+            delay = max(delay, error.retry_after)
+        logging.warning(f"[LLM] Retryable error ({error}); retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        return delay
@@ -0,0 +1,350 @@
+import asyncio
+import contextvars
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, AsyncIterator, Callable, Iterator, List, Optional
+
+from src.llm_client import BaseLLMClient, LLMClientFactory, LLMError
+from src.metrics import current_agent, record_route
+
+# Short task-type names accepted in the routing config, mapped to the agent names set by the workflow
+TASK_AGENTS = {"outline": "outline_agent", "characters": "character_agent", "chapters": "chapter_agent"}
+
+class LatencyTracker:
+    """Sliding window of recent latencies for one route, used to pick the hedging delay. Thread-safe."""
+    def __init__(self, window: int = 200):
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float, min_samples: int) -> Optional[float]:
+        """The q-quantile (0-1) of the window, or None with fewer than `min_samples` samples."""
+        with self._lock:
+            if len(self._samples) < max(1, min_samples):
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+class _Attempt:
+    __slots__ = ("backend", "primary", "started", "cancelled", "task")
+
+    def __init__(self, backend: BaseLLMClient, primary: bool):
+        self.backend = backend
+        self.primary = primary
+        self.started = time.monotonic()
+        self.cancelled = False
+        self.task = None
+
+class RoutingLLMClient(BaseLLMClient):
+    """Routes each call to an ordered list of backends chosen by the calling agent, with hedging and failover.
+
+    - Routing: `routes` maps agent names (see metrics.agent_scope) to backends; other agents use `default`.
+      The first backend of a route is its primary.
+    - Hedging: when a call has produced nothing after the route's `hedge_percentile` latency
+      (time to first delta for streams, whole response otherwise), a duplicate request goes to the next
+      backend of the route (or the primary again if it is the only one). The first attempt to respond
+      wins and the others are cancelled: async attempts are cancelled outright, sync streams stop at the
+      next delta, and a sync non-streaming loser finishes in the background with its response discarded.
+      Until `hedge_min_samples` latencies are known, `hedge_delay` is used (None disables hedging then).
+    - Failover: when an attempt fails (after the backend's own retries) or the backend's circuit
+      breaker is open, the next untried backend of the route is called.
+
+    Backends should be shared ResilientLLMClient instances (LLMClientFactory), so retries, rate limits
+    and circuit breakers stay per provider. `model`/`provider` report the current agent's primary, so the
+    response cache keys calls by the model a route is configured for.
+    """
+
+    def __init__(self, routes: Dict[str, List[BaseLLMClient]], default: List[BaseLLMClient],
+                 hedge_percentile: float = 0.95, hedge_min_samples: int = 20, hedge_delay: Optional[float] = None,
+                 max_hedges: int = 1, window: int = 200):
+        if not default:
+            raise ValueError("The default route needs at least one backend")
+        self.routes = {TASK_AGENTS.get(agent, agent): list(backends) for agent, backends in routes.items() if backends}
+        self.default = list(default)
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_delay = hedge_delay
+        self.max_hedges = max_hedges
+        self._trackers: Dict[tuple, LatencyTracker] = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, models: Dict[str, Dict[str, Any]], routing: Dict[str, Any]) -> "RoutingLLMClient":
+        """Builds the router from the `routing` section of the config; routes name entries of `models` (see README)."""
+        def backends(names) -> List[BaseLLMClient]:
+            if isinstance(names, str):
+                names = [names]
+            missing = [name for name in names if name not in models]
+            if missing:
+                raise ValueError(f"Routing refers to unknown models: {', '.join(missing)}")
+            return [LLMClientFactory(models[name]) for name in names]
+
+        return cls(
+            {agent: backends(names) for agent, names in routing.get("agents", {}).items()},
+            backends(routing.get("default", ["main"])),
+            hedge_percentile=routing.get("hedgePercentile", 0.95),
+            hedge_min_samples=routing.get("hedgeMinSamples", 20),
+            hedge_delay=routing.get("hedgeDelay"),
+            max_hedges=routing.get("maxHedges", 1),
+        )
+
+    # Identity of the current agent's primary backend (used by the cache key and the metrics)
+
+    @property
+    def model(self) -> str:
+        return self._backends()[0].model
+
+    @property
+    def provider(self) -> str:
+        return self._backends()[0].provider
+
+    @property
+    def temperature(self) -> Optional[float]:
+        return self._backends()[0].temperature
+
+    def sampling_params(self) -> Dict[str, Any]:
+        return self._backends()[0].sampling_params()
+
+    def generate_text(self, prompt: str) -> str:
+        try:
+            return self.complete(prompt)
+        except LLMError as e:
+            logging.error(f"[LLM] All routes failed for {current_agent()}: {e}")
+            return ""
+
+    def complete(self, prompt: str) -> str:
+        return "".join(self._race(lambda backend: iter((backend.complete(prompt),)), streamed=False))
+
+    def stream_text(self, prompt: str) -> Iterator[str]:
+        return self._race(lambda backend: backend.stream_text(prompt), streamed=True)
+
+    async def agenerate_text(self, prompt: str) -> str:
+        try:
+            return await self.acomplete(prompt)
+        except LLMError as e:
+            logging.error(f"[LLM] All routes failed for {current_agent()}: {e}")
+            return ""
+
+    async def acomplete(self, prompt: str) -> str:
+        async def once(backend: BaseLLMClient) -> AsyncIterator[str]:
+            yield await backend.acomplete(prompt)
+        return "".join([delta async for delta in self._arace(once, streamed=False)])
+
+    def astream_text(self, prompt: str) -> AsyncIterator[str]:
+        return self._arace(lambda backend: backend.astream_text(prompt), streamed=True)
+
+    # ---- racing attempts ----
+
+    def _race(self, open_stream: Callable[[BaseLLMClient], Iterator[str]], streamed: bool) -> Iterator[str]:
+        """Runs attempts in threads and yields the deltas of the first one to respond."""
+        race = _Race(self, streamed)
+        events: "queue.Queue[tuple]" = queue.Queue()
+
+        def launch(backend: BaseLLMClient, primary: bool):
+            attempt = race.add(backend, primary)
+            # Copy the context so the attempt's LLM usage is recorded on this call
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(self._produce, attempt, open_stream, events),
+                             name="llm-route", daemon=True).start()
+
+        launch(*race.first())
+        try:
+            while True:
+                try:
+                    attempt, kind, payload = events.get(timeout=race.hedge_timeout())
+                except queue.Empty:
+                    hedge = race.hedge()
+                    if hedge is not None:
+                        launch(*hedge)
+                    continue
+                action = race.on_event(attempt, kind, payload)
+                if action == "delta":
+                    yield payload
+                elif action == "done":
+                    return
+                elif action == "failover":
+                    launch(*race.failover())
+        finally:
+            race.cancel_all()
+
+    async def _arace(self, open_stream: Callable[[BaseLLMClient], AsyncIterator[str]], streamed: bool) -> AsyncIterator[str]:
+        """Async _race: attempts are tasks on the running loop, and losers are cancelled."""
+        race = _Race(self, streamed)
+        events: "asyncio.Queue[tuple]" = asyncio.Queue()
+
+        def launch(backend: BaseLLMClient, primary: bool):
+            attempt = race.add(backend, primary)
+            attempt.task = asyncio.ensure_future(self._aproduce(attempt, open_stream, events))
+
+        launch(*race.first())
+        try:
+            while True:
+                try:
+                    attempt, kind, payload = await asyncio.wait_for(events.get(), race.hedge_timeout())
+                except asyncio.TimeoutError:
+                    hedge = race.hedge()
+                    if hedge is not None:
+                        launch(*hedge)
+                    continue
+                action = race.on_event(attempt, kind, payload)
+                if action == "delta":
+                    yield payload
+                elif action == "done":
+                    return
+                elif action == "failover":
+                    launch(*race.failover())
+        finally:
+            race.cancel_all()
+
+    @staticmethod
+    def _produce(attempt: _Attempt, open_stream, events: "queue.Queue[tuple]"):
+        try:
+            stream = open_stream(attempt.backend)
+            try:
+                for delta in stream:
+                    if attempt.cancelled:
+                        return
+                    events.put((attempt, "delta", delta))
+            finally:
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    close()
+            events.put((attempt, "done", None))
+        except Exception as e:
+            events.put((attempt, "error", e))
+
+    @staticmethod
+    async def _aproduce(attempt: _Attempt, open_stream, events: "asyncio.Queue[tuple]"):
+        try:
+            async for delta in open_stream(attempt.backend):
+                events.put_nowait((attempt, "delta", delta))
+            events.put_nowait((attempt, "done", None))
+        except Exception as e:
+            events.put_nowait((attempt, "error", e))
+
+    # ---- routes and latency ----
+
+    def _backends(self) -> List[BaseLLMClient]:
+        return self.routes.get(current_agent(), self.default)
+
+    def _tracker(self, streamed: bool) -> LatencyTracker:
+        key = (current_agent() if current_agent() in self.routes else None, streamed)
+        with self._lock:
+            tracker = self._trackers.get(key)
+            if tracker is None:
+                tracker = self._trackers[key] = LatencyTracker(self._window)
+            return tracker
+
+class _Race:
+    """Bookkeeping for one routed call: which backends were tried, hedging and the winner.
+    Shared by the thread and asyncio drivers; only touched from the caller's thread / task."""
+
+    def __init__(self, router: RoutingLLMClient, streamed: bool):
+        self.router = router
+        self.backends = router._backends()
+        self.untried = deque(backend for backend in self.backends if _available(backend)) or deque(self.backends[:1])
+        self.tracker = router._tracker(streamed)
+        self.delay = self.tracker.percentile(router.hedge_percentile, router.hedge_min_samples)
+        if self.delay is None:
+            self.delay = router.hedge_delay
+        self.attempts: List[_Attempt] = []
+        self.hedges = 0
+        self.failovers = 0
+        self.errors: List[Exception] = []
+        self.failed: set = set()   # id() of backends whose attempt failed in this call
+        self.winner: Optional[_Attempt] = None
+
+    def add(self, backend: BaseLLMClient, primary: bool) -> _Attempt:
+        attempt = _Attempt(backend, primary)
+        self.attempts.append(attempt)
+        return attempt
+
+    def first(self) -> tuple:
+        return self.untried.popleft(), True
+
+    def hedge(self) -> Optional[tuple]:
+        """The next healthy backend not tried yet; with none left, a backend that is still running and has not
+        failed in this call (the primary again for single-backend routes). None disables hedging for this call."""
+        backend = next((b for b in self.untried if _available(b)), None)
+        if backend is not None:
+            self.untried.remove(backend)
+        else:
+            backend = next((a.backend for a in self.attempts
+                            if not a.cancelled and id(a.backend) not in self.failed), None)
+            if backend is None:
+                self.delay = None
+                return None
+        self.hedges += 1
+        logging.info(f"[LLM] {current_agent()}: no response after {self.delay:.2f}s, hedging to {backend.provider}/{backend.model}")
+        return backend, False
+
+    def failover(self) -> tuple:
+        self.failovers += 1
+        backend = self.untried.popleft()
+        logging.warning(f"[LLM] {current_agent()}: failing over to {backend.provider}/{backend.model}")
+        return backend, False
+
+    def hedge_timeout(self) -> Optional[float]:
+        """Seconds until the next hedge is due; None when no hedge is pending (wait for the next event)."""
+        if self.winner is not None or self.delay is None or self.hedges >= self.router.max_hedges:
+            return None
+        running = [a for a in self.attempts if not a.cancelled]
+        if not running:
+            return None
+        return max(0.0, running[-1].started + self.delay - time.monotonic())
+
+    def on_event(self, attempt: _Attempt, kind: str, payload) -> Optional[str]:
+        """Returns "delta"/"done" to pass on, "failover" to start the next backend, or None to keep waiting.
+        Raises the error when no attempt is left."""
+        if self.winner is None:
+            if kind == "error":
+                attempt.cancelled = True
+                self.failed.add(id(attempt.backend))
+                self.errors.append(payload)
+                logging.warning(f"[LLM] {current_agent()}: {attempt.backend.provider}/{attempt.backend.model} failed: {payload}")
+                if self.untried:
+                    return "failover"
+                if any(not a.cancelled for a in self.attempts):
+                    return None
+                raise payload
+            self._choose(attempt)
+        if attempt is not self.winner:
+            return None
+        if kind == "error":
+            raise payload
+        return kind
+
+    def _choose(self, winner: _Attempt):
+        self.winner = winner
+        now = time.monotonic()
+        primary = self.attempts[0]
+        if primary.primary and (primary is winner or not primary.cancelled):
+            # A losing primary only tells us its latency is at least this long
+            self.tracker.record(now - primary.started)
+        for attempt in self.attempts:
+            if attempt is not winner:
+                self._cancel(attempt)
+        record_route(winner.backend.provider, winner.backend.model, hedged=self.hedges > 0, failovers=self.failovers)
+
+    def cancel_all(self):
+        for attempt in self.attempts:
+            self._cancel(attempt)
+
+    @staticmethod
+    def _cancel(attempt: _Attempt):
+        attempt.cancelled = True
+        if attempt.task is not None and not attempt.task.done():
+            attempt.task.cancel()
+
+def _available(backend: BaseLLMClient) -> bool:
+    """False while the backend's circuit breaker rejects calls (open, or half-open with a trial in flight),
+    so failover skips it instead of waiting."""
+    breaker = getattr(backend, "circuit_breaker", None)
+    return breaker is None or not breaker.is_open()
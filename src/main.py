@@ -1,52 +1,217 @@
 # main.py
 
 import typer
-from rich.console import Console
-from rich.panel import Panel
-from rich.text import Text
-from rich.table import Table
 
 import json
 import os
 import logging
 
-from src.workflow import CreativeWorkflow
 from src.persistence import FileStorage
+from src.story import StoryStateManager
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Placeholder for LLM. In a real scenario, this would be a proper LLM client.
-from src.llm_client import LLMClientFactory
-
-llm_config = load_llm_config()
-llm = LLMClientFactory(llm_config)
+CONFIG_PATH = os.path.join(".taskmaster", "config.json")
 
 app = typer.Typer()
-console = Console()
 storage = FileStorage(base_path="./data")
 
+def load_config(config_path: str = CONFIG_PATH) -> dict:
+    """读取 .taskmaster/config.json。"""
+    with open(config_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def load_llm_config(config_path: str = CONFIG_PATH) -> dict:
+    """读取 .taskmaster/config.json 中 models.main 的 LLM 配置。"""
+    return load_config(config_path)["models"]["main"]
+
+def build_llm(no_cache: bool = False, refresh_cache: bool = False):
+    """构建 LLM 客户端。只有需要调用 LLM 的命令才会调用，只读命令不会导入 openai 或要求 API Key。
+
+    refresh_cache=True 时不读取缓存（总是重新生成），但仍把新结果写入缓存。
+    配置中有 routing 一节时，按智能体把调用路由到不同的模型，并对慢请求做对冲、对失败的提供商做切换。
+    """
+    from src.llm_client import LLMClientFactory
+    from src.llm_cache import CachingLLMClient
+
+    config = load_config()
+    if config.get("routing"):
+        from src.llm_routing import RoutingLLMClient
+        llm = RoutingLLMClient.from_config(config["models"], config["routing"])
+    else:
+        llm = LLMClientFactory(config["models"]["main"])
+    if no_cache:
+        return llm
+    return CachingLLMClient(llm, db_path=os.path.join(storage.base_path, "llm_cache.sqlite"), refresh=refresh_cache)
+
+def open_job_queue(lease_seconds: float = 120.0):
+    """打开 ./data 下的持久化任务队列（分布式模式中协调进程和所有 worker 共用，多台机器时放在共享存储上）。"""
+    from src.workflow import DurableTaskQueue, TASK_QUEUE_FILENAME
+    return DurableTaskQueue(os.path.join(storage.base_path, TASK_QUEUE_FILENAME), lease_seconds=lease_seconds)
+
+def check_novel_id(novel: str = None):
+    """--novel 选项的校验：只接受字母、数字、下划线和连字符，拒绝 "../x" 这类会写到 ./data 之外的 id。"""
+    from src.persistence import validate_namespace
+    if novel is not None:
+        try:
+            validate_namespace(novel)
+        except ValueError as e:
+            raise typer.BadParameter(str(e))
+    return novel
+
+def novel_storage(novel: str = None) -> FileStorage:
+    """返回某部小说的存储：未指定时为默认的 ./data，否则为批量创作中的 ./data/novels/<id>。"""
+    return storage.namespace(novel) if novel else storage
+
+def get_console():
+    """延迟创建 rich 控制台（导入 rich 较慢，只在需要输出表格或流式文本时才导入）。"""
+    from rich.console import Console
+    return Console()
+
 @app.command()
-def start(prompt: str = typer.Argument(..., help="小说的初始创作提示，例如：'一个关于赛博朋克侦探的故事'")):
+def start(
+    prompt: str = typer.Argument(..., help="小说的初始创作提示，例如：'一个关于赛博朋克侦探的故事'"),
+    concurrency: int = typer.Option(1, "--concurrency", "-c", help="同时生成的章节数上限（1 表示按顺序生成）"),
+    no_cache: bool = typer.Option(False, "--no-cache", help="不使用本地 LLM 响应缓存"),
+    stream: bool = typer.Option(False, "--stream", help="流式生成章节并实时输出到终端（建议配合 --concurrency 1 使用）"),
+    resume: bool = typer.Option(False, "--resume", help="从上次中断处继续：重放检查点日志，跳过已完成的大纲/角色/章节"),
+    context_budget: int = typer.Option(1500, "--context-budget", help="每章提示词中前情摘要的 token 预算（0 表示不提供前情）"),
+    use_async: bool = typer.Option(False, "--async", help="在单个事件循环上运行所有任务，在途请求不占用线程"),
+    pipeline: bool = typer.Option(False, "--pipeline", help="流水线模式：角色逐个产出，每章在它涉及的角色就绪后立即开始"),
+    snapshot_format: str = typer.Option(None, "--snapshot-format", help="状态快照编码：json 或 msgpack（二进制，需要安装 msgpack）；默认沿用已有快照的格式"),
+    distributed: bool = typer.Option(False, "--distributed", help="章节任务提交到持久化队列，由 worker 进程执行（-c 为同时排队的章节数）"),
+    job_timeout: float = typer.Option(1800.0, "--job-timeout", help="分布式模式下等待 worker 完成一个章节的秒数，超时记为失败"),
+    scenes: int = typer.Option(0, "--scenes", help="分场景模式：每章先规划为 N 个场景并行生成，再衔接拼接（0 表示整章一次生成）"),
+):
     """启动多智能体网络小说创作流程。"""
     logging.info("🚀 启动多智能体网络小说创作流程")
     logging.info(f"初始提示: {prompt}")
 
-    workflow = CreativeWorkflow(prompt, storage, llm)
-    workflow.start_workflow()
+    from src.workflow import CreativeWorkflow
+
+    workflow_llm = build_llm(no_cache)
+    console = get_console() if stream else None
+    on_chapter_chunk = (lambda chapter_index, delta: console.out(delta, end="", highlight=False)) if stream else None
+    workflow = CreativeWorkflow(prompt, storage, workflow_llm, max_concurrency=concurrency,
+                                stream_chapters=stream, on_chapter_chunk=on_chapter_chunk, context_token_budget=context_budget,
+                                pipelined=pipeline, snapshot_format=snapshot_format,
+                                job_queue=open_job_queue() if distributed else None, scenes_per_chapter=scenes,
+                                job_timeout=job_timeout)
+    if distributed:
+        logging.info("章节任务将提交到持久化队列，请在其他终端或机器上运行 `python -m src.main worker`")
+    if use_async:
+        import asyncio
+        asyncio.run(workflow.astart_workflow(resume=resume))
+    else:
+        workflow.start_workflow(resume=resume)
+    if not no_cache:
+        logging.info(f"LLM 缓存统计: {workflow_llm.stats()}")
 
     logging.info("✅ 小说创作流程完成！")
 
 @app.command()
-def status():
+def batch(
+    prompts_file: str = typer.Argument(..., help="提示文件：每行一个提示，或每行一个 JSON：{\"id\": \"...\", \"prompt\": \"...\"}"),
+    concurrency: int = typer.Option(8, "--concurrency", "-c", help="全局同时在途的 LLM 任务上限"),
+    per_novel: int = typer.Option(4, "--per-novel", help="单部小说同时在途的章节任务上限"),
+    no_cache: bool = typer.Option(False, "--no-cache", help="不使用本地 LLM 响应缓存"),
+    resume: bool = typer.Option(False, "--resume", help="每部小说都从上次中断处继续"),
+    context_budget: int = typer.Option(1500, "--context-budget", help="每章提示词中前情摘要的 token 预算（0 表示不提供前情）"),
+    use_async: bool = typer.Option(False, "--async", help="在单个事件循环上驱动所有小说，适合很高的 --concurrency"),
+    pipeline: bool = typer.Option(False, "--pipeline", help="流水线模式：每章在它涉及的角色就绪后立即开始"),
+    snapshot_format: str = typer.Option(None, "--snapshot-format", help="每部小说的状态快照编码：json 或 msgpack"),
+    distributed: bool = typer.Option(False, "--distributed", help="所有小说的章节任务提交到持久化队列，由 worker 进程执行"),
+    job_timeout: float = typer.Option(1800.0, "--job-timeout", help="分布式模式下等待 worker 完成一个章节的秒数，超时记为失败"),
+    scenes: int = typer.Option(0, "--scenes", help="分场景模式：每章先规划为 N 个场景并行生成，再衔接拼接（0 表示整章一次生成）"),
+):
+    """在一个进程内批量创作多部小说，每部小说的状态保存在 ./data/novels/<id>/ 下。"""
+    from src.workflow import BatchRunner, load_prompts
+
+    try:
+        prompts = load_prompts(prompts_file)
+    except ValueError as e:
+        logging.error(f"❌ {e}")
+        return
+    logging.info(f"🚀 批量创作 {len(prompts)} 部小说")
+
+    runner = BatchRunner(storage, build_llm(no_cache), max_concurrency=concurrency, per_novel_concurrency=per_novel,
+                         context_token_budget=context_budget, pipelined=pipeline,
+                         snapshot_format=snapshot_format, job_queue=open_job_queue() if distributed else None,
+                         scenes_per_chapter=scenes, job_timeout=job_timeout)
+    if use_async:
+        import asyncio
+        results = asyncio.run(runner.arun(prompts, resume=resume))
+    else:
+        results = runner.run(prompts, resume=resume)
+
+    completed = sum(1 for r in results if r["status"] == "completed")
+    logging.info(f"✅ 批量创作完成：{completed}/{len(results)} 部小说已完成，汇总见 {os.path.join(storage.base_path, 'batch_summary.json')}")
+
+@app.command()
+def worker(
+    concurrency: int = typer.Option(1, "--concurrency", "-c", help="本进程同时执行的任务数"),
+    no_cache: bool = typer.Option(False, "--no-cache", help="不使用本地 LLM 响应缓存"),
+    worker_id: str = typer.Option(None, "--id", help="worker 标识（默认为 主机名-进程号）"),
+    lease: float = typer.Option(120.0, "--lease", help="租约时长（秒）：超过这个时间没有心跳的任务会被重新投递"),
+    idle_exit: float = typer.Option(None, "--idle-exit", help="连续这么多秒没有任务时退出（默认一直运行）"),
+):
+    """从持久化队列领取章节任务并执行（配合 start/batch --distributed；可在多个进程或共享存储的多台机器上运行）。"""
+    from src.workflow import QueueWorker
+
+    runner = QueueWorker(open_job_queue(lease_seconds=lease), build_llm(no_cache), storage=storage, worker_id=worker_id,
+                         concurrency=concurrency, idle_timeout=idle_exit)
+    runner.run()
+
+@app.command()
+def regenerate(
+    chapters: str = typer.Argument(..., help="要重新生成的章节，例如 '17'、'3-10'、'3-10,17'、'40-'"),
+    concurrency: int = typer.Option(1, "--concurrency", "-c", help="同时重新生成的章节数（1 表示按顺序，后一章的前情会用到前一章的新内容）"),
+    no_cache: bool = typer.Option(False, "--no-cache", help="不使用本地 LLM 响应缓存"),
+    stream: bool = typer.Option(False, "--stream", help="流式生成章节并实时输出到终端（建议配合 --concurrency 1 使用）"),
+    context_budget: int = typer.Option(1500, "--context-budget", help="每章提示词中前情摘要的 token 预算（0 表示不提供前情）"),
+    use_async: bool = typer.Option(False, "--async", help="在单个事件循环上运行所有任务"),
+    novel: str = typer.Option(None, "--novel", help="批量创作中的小说 id（对应 ./data/novels/<id>/）", callback=check_novel_id),
+    scenes: int = typer.Option(0, "--scenes", help="分场景模式：每章先规划为 N 个场景并行生成，再衔接拼接（0 表示整章一次生成）"),
+):
+    """只重新生成指定章节：加载已保存的大纲和角色，不重跑整个创作流程，其他章节不变。"""
+    from src.workflow import CreativeWorkflow
+
+    logging.info(f"🔁 重新生成章节: {chapters}")
+    # 不读取缓存（相同的提示词否则会得到原来的章节），新结果仍写入缓存
+    workflow_llm = build_llm(no_cache, refresh_cache=True)
+    console = get_console() if stream else None
+    on_chapter_chunk = (lambda chapter_index, delta: console.out(delta, end="", highlight=False)) if stream else None
+    workflow = CreativeWorkflow("", novel_storage(novel), workflow_llm, max_concurrency=concurrency,
+                                stream_chapters=stream, on_chapter_chunk=on_chapter_chunk, context_token_budget=context_budget,
+                                scenes_per_chapter=scenes)
+    try:
+        if use_async:
+            import asyncio
+            results = asyncio.run(workflow.aregenerate_chapters(chapters))
+        else:
+            results = workflow.regenerate_chapters(chapters)
+    except ValueError as e:
+        logging.error(f"❌ {e}")
+        return
+
+    failed = [index for index, ok in results.items() if not ok]
+    if failed:
+        logging.error(f"❌ 以下章节重新生成失败（保留原有内容）: {failed}")
+    logging.info(f"✅ 已重新生成 {len(results) - len(failed)} 章: {[index for index, ok in results.items() if ok]}")
+
+@app.command()
+def status(novel: str = typer.Option(None, "--novel", help="批量创作中的小说 id（对应 ./data/novels/<id>/）", callback=check_novel_id)):
     """显示当前小说创作的进度和状态。"""
     logging.info("📊 当前小说创作状态")
 
-    # 尝试加载状态以显示最新进度
-    story_state_manager = CreativeWorkflow("", storage, llm).story_state_manager # 临时创建，只为获取状态
+    # 只读命令：直接从存储加载状态，不构建 LLM 客户端和智能体
+    story_state_manager = StoryStateManager(novel_storage(novel))
     story_state_manager.load_state() # 加载最新状态
     current_state = story_state_manager.get_current_state()
 
+    from rich.table import Table
+
     table = Table(title="创作进度概览", style="bold magenta")
     table.add_column("指标", style="cyan", no_wrap=True)
     table.add_column("状态", style="green")
@@ -57,61 +222,135 @@ def status():
     table.add_row("总章节数", str(overall_progress.get("total_chapters", 0)))
     table.add_row("当前状态", overall_progress.get("status", "未知"))
 
-    logging.info(console.export_text(table))
+    get_console().print(table)
 
     # 打印故事元素（简化版）
     story_elements = current_state.get("story_elements", {})
     if story_elements.get("world"):
-        logging.info(f"世界观: {story_elements["world"]["name"]} - {story_elements["world"]["description"]}")
+        logging.info(f"世界观: {story_elements['world']['name']} - {story_elements['world']['description']}")
     if story_elements.get("characters"):
         char_names = ", ".join(story_elements["characters"].keys())
         logging.info(f"主要角色: {char_names}")
 
 @app.command()
-def save():
+def stats(
+    novel: str = typer.Option(None, "--novel", help="批量创作中的小说 id（对应 ./data/novels/<id>/）", callback=check_novel_id),
+    as_json: bool = typer.Option(False, "--json", help="直接输出 JSON 汇总"),
+    all_runs: bool = typer.Option(False, "--all", help="汇总这部小说的全部运行（例如 start 加上之后的 regenerate），而不只是最近一次"),
+):
+    """显示创作运行的 LLM 调用耗时、token 用量和任务排队统计（按智能体/阶段汇总）；默认为最近一次运行。"""
+    from src.metrics import load_runs, merge_runs
+
+    runs = load_runs(novel_storage(novel))
+    if not runs:
+        logging.warning("⚠️ 没有找到运行指标，请先运行 start 或 batch。")
+        return
+    metrics = merge_runs(runs) if all_runs else runs[-1]
+    if as_json:
+        print(json.dumps({key: metrics[key] for key in ("name", "wall_seconds", "totals", "agents")}, ensure_ascii=False, indent=2))
+        return
+
+    from rich.table import Table
+
+    table = Table(title=f"运行指标：{metrics.get('name', 'workflow')}（总耗时 {metrics['wall_seconds']}s，共 {len(runs)} 次运行）", style="bold magenta")
+    columns = [("阶段", None), ("LLM 调用", "llm_calls"), ("缓存命中", "cache_hits"), ("失败", "failed_calls"), ("对冲/切换", "hedged_calls"),
+               ("输入 tokens", "prompt_tokens"), ("前缀缓存 tokens", "cached_prompt_tokens"), ("输出 tokens", "completion_tokens"), ("LLM 耗时 s", "llm_seconds"),
+               ("延迟 p50/p95 s", None), ("首 token p50 s", "ttft_p50"), ("任务", "tasks"), ("排队 s", "queue_wait_seconds")]
+    for title, _ in columns:
+        table.add_column(title, style="cyan" if title == "阶段" else "green", no_wrap=True)
+    rows = list(metrics.get("agents", {}).items()) + [("总计", metrics["totals"])]
+    for name, values in rows:
+        cells = [name]
+        for title, key in columns[1:]:
+            if key == "hedged_calls":
+                cells.append(f"{values.get('hedged_calls', 0)}/{values.get('failovers', 0)}")
+            else:
+                cells.append(f"{values['latency_p50']}/{values['latency_p95']}" if key is None else str(values.get(key, 0)))
+        table.add_row(*cells)
+
+    get_console().print(table)
+
+@app.command()
+def mentions(
+    name: str = typer.Argument(..., help="角色或地点名（也可以是登记过的别名）"),
+    novel: str = typer.Option(None, "--novel", help="批量创作中的小说 id（对应 ./data/novels/<id>/）", callback=check_novel_id),
+    as_json: bool = typer.Option(False, "--json", help="直接输出 JSON"),
+):
+    """查询某个角色/地点出现在哪些章节以及最后一次出现的位置（查提及索引，不调用 LLM）。"""
+    story_state_manager = StoryStateManager(novel_storage(novel))
+    story_state_manager.load_state()
+    index = story_state_manager.mentions
+    chapters = index.chapters_with(name)
+    last = index.last_appearance(name)
+    if as_json:
+        print(json.dumps({"name": name, "chapters": chapters,
+                          "mentions": {i: len(index.mentions(name, i)) for i in chapters},
+                          "last_appearance": {"chapter": last[0], "offset": last[1]} if last else None},
+                         ensure_ascii=False, indent=2))
+        return
+    if not chapters:
+        logging.warning(f"⚠️ 没有找到 {name} 的提及（已登记的实体: {', '.join(index.entities()) or '无'}）")
+        return
+
+    from rich.table import Table
+
+    table = Table(title=f"{name} 的提及", style="bold magenta")
+    table.add_column("章节", style="cyan", no_wrap=True)
+    table.add_column("提及次数", style="green")
+    for chapter_index in chapters:
+        table.add_row(str(chapter_index), str(len(index.mentions(name, chapter_index))))
+    get_console().print(table)
+
+    chapter_index, offset = last
+    snippet = story_state_manager.chapters_content[chapter_index][max(0, offset - 60):offset + 80].replace("\n", " ")
+    logging.info(f"最后一次出现: 第 {chapter_index} 章，偏移 {offset}: …{snippet}…")
+
+@app.command()
+def save(novel: str = typer.Option(None, "--novel", help="批量创作中的小说 id（对应 ./data/novels/<id>/）", callback=check_novel_id)):
     """手动保存当前小说创作状态。"""
     logging.info("💾 正在保存当前创作状态...")
-    # 临时创建 workflow 实例以访问 story_state_manager
-    workflow = CreativeWorkflow("", storage, llm) # prompt 可以为空，因为我们只保存状态
-    workflow.story_state_manager.save_state()
+    # 加载快照并重放检查点日志，再写回为一个完整快照
+    story_state_manager = StoryStateManager(novel_storage(novel))
+    story_state_manager.load_state()
+    story_state_manager.save_state()
     logging.info("✅ 创作状态已保存！")
 
 @app.command()
-def load():
+def load(novel: str = typer.Option(None, "--novel", help="批量创作中的小说 id（对应 ./data/novels/<id>/）", callback=check_novel_id)):
     """加载之前保存的小说创作状态。"""
     logging.info("📂 正在加载之前保存的创作状态...")
-    # 临时创建 workflow 实例以访问 story_state_manager
-    workflow = CreativeWorkflow("", storage, llm) # prompt 可以为空，因为我们只加载状态
-    workflow.story_state_manager.load_state()
+    story_state_manager = StoryStateManager(novel_storage(novel))
+    story_state_manager.load_state()
     logging.info("✅ 创作状态已加载！")
 
 @app.command()
-def export(output_filename: str = typer.Argument("novel_output.txt", help="导出小说的文件名，例如：'my_novel.txt'")):
-    """将已创作的小说章节导出为单个文本文件。"""
-    logging.info("📤 正在导出小说章节...")
+def export(
+    output_filename: str = typer.Argument("novel_output.txt", help="导出小说的文件名，例如：'my_novel.txt'、'my_novel.epub'"),
+    fmt: str = typer.Option(None, "--format", "-f", help="导出格式：txt、md、jsonl、epub（默认根据文件扩展名推断）"),
+    chapters: str = typer.Option(None, "--chapters", help="导出的章节范围，例如 '5'、'3-10'、'3-'"),
+    novel: str = typer.Option(None, "--novel", help="批量创作中的小说 id（对应 ./data/novels/<id>/）", callback=check_novel_id),
+):
+    """将已创作的小说章节逐章流式导出为 txt、Markdown、JSONL 或 EPUB 文件。"""
+    from src.export import export_novel, parse_chapter_range
 
-    # 临时创建 workflow 实例以访问 story_state_manager
-    workflow = CreativeWorkflow("", storage, llm) # prompt 可以为空，因为我们只加载状态
-    workflow.story_state_manager.load_state()
-    current_state = workflow.story_state_manager.get_current_state()
+    logging.info("📤 正在导出小说章节...")
 
-    chapters_content = current_state.get("chapters_content", {})
+    story_state_manager = StoryStateManager(novel_storage(novel))
+    story_state_manager.load_state()
 
-    if not chapters_content:
+    if not story_state_manager.chapters_content:
         logging.warning("⚠️ 没有找到已创作的章节内容，无法导出。")
         return
 
-    # 按章节索引排序
-    sorted_chapters = sorted(chapters_content.items(), key=lambda item: int(item[0]))
-
-    output_path = os.path.join(storage.base_path, output_filename)
-
-    with open(output_path, "w", encoding="utf-8") as f:
-        for chapter_index, content in sorted_chapters:
-            f.write(f"\n\n--- Chapter {chapter_index} ---\n\n")
-            f.write(content)
+    output_path = os.path.join(novel_storage(novel).base_path, output_filename)
+    try:
+        start_chapter, end_chapter = parse_chapter_range(chapters)
+        exported = export_novel(story_state_manager, output_path, fmt=fmt, start=start_chapter, end=end_chapter)
+    except ValueError as e:
+        logging.error(f"❌ {e}")
+        return
 
-    logging.info(f"✅ 小说已成功导出到: {output_path}")
+    logging.info(f"✅ 小说已成功导出到: {output_path}（{exported} 章）")
 
 if __name__ == "__main__":
     app()
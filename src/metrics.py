@@ -0,0 +1,191 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+# Each run is saved as metrics/<run_id>.json; runs from older versions used a single metrics.json
+METRICS_DIR = "metrics"
+METRICS_FILENAME = "metrics.json"
+
+# Agent on whose behalf the current thread is calling the LLM (set by the workflow around each task)
+_current_agent: contextvars.ContextVar[str] = contextvars.ContextVar("metrics_agent", default="workflow")
+# Record of the LLM call in progress, so inner clients can attach API usage or mark cache hits
+_current_call: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("metrics_call", default=None)
+
+@contextmanager
+def agent_scope(agent: str):
+    """Attributes LLM calls made inside the block to `agent`."""
+    token = _current_agent.set(agent)
+    try:
+        yield
+    finally:
+        _current_agent.reset(token)
+
+def current_agent() -> str:
+    return _current_agent.get()
+
+def start_call(record: Dict[str, Any]):
+    """Makes `record` the LLM call in progress; returns a token for end_call()."""
+    return _current_call.set(record)
+
+def end_call(token):
+    try:
+        _current_call.reset(token)
+    except ValueError:
+        pass  # stream generator closed from a different context
+
+def record_usage(prompt_tokens: Optional[int], completion_tokens: Optional[int],
+                 cached_prompt_tokens: Optional[int] = None):
+    """Called by provider clients with the token counts from the API `usage` field.
+
+    cached_prompt_tokens: prompt tokens served from the provider's prefix cache, if reported.
+    """
+    call = _current_call.get()
+    if call is None or prompt_tokens is None or completion_tokens is None:
+        return
+    # Summed, since a retried call may report usage more than once
+    call["prompt_tokens"] = call.get("prompt_tokens", 0) + prompt_tokens
+    call["completion_tokens"] = call.get("completion_tokens", 0) + completion_tokens
+    if cached_prompt_tokens:
+        call["cached_prompt_tokens"] = call.get("cached_prompt_tokens", 0) + cached_prompt_tokens
+    call["usage"] = "api"
+
+def mark_cache_hit():
+    """Called by the response cache when it answers the call in progress."""
+    call = _current_call.get()
+    if call is not None:
+        call["cached"] = True
+
+def record_route(provider: str, model: str, hedged: bool = False, failovers: int = 0):
+    """Called by the routing client with the backend that answered the call in progress."""
+    call = _current_call.get()
+    if call is not None:
+        call["provider"], call["model"] = provider, model
+        call["hedged"] = hedged
+        call["failovers"] = failovers
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+class MetricsRecorder:
+    """Collects per-call LLM metrics and per-task timings for one workflow run. Thread-safe.
+
+    LLM calls: agent, latency, time to first token, prompt/completion tokens (from the API `usage`
+    field when the provider reports it, estimated otherwise), prompt tokens served from the
+    provider's prefix cache, response-cache hit and success; with routing, the backend that answered
+    and whether the call was hedged or failed over.
+    Tasks: agent, key, queue wait (ready -> started) and run time.
+    """
+    def __init__(self, name: str = "workflow"):
+        self.name = name
+        self.started_at = time.time()
+        # Sorts by start time; the suffix keeps runs started in the same second apart
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_at))}-{uuid.uuid4().hex[:6]}"
+        self._started = time.perf_counter()
+        self.finished_at: Optional[float] = None
+        self._wall: Optional[float] = None
+        self.llm_calls: List[Dict[str, Any]] = []
+        self.tasks: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def record_llm_call(self, record: Dict[str, Any]):
+        with self._lock:
+            self.llm_calls.append(record)
+
+    def record_task(self, agent: str, key: str, queue_wait: float, duration: float, status: str):
+        with self._lock:
+            self.tasks.append({"agent": agent, "key": key, "queue_wait": round(queue_wait, 4),
+                               "duration": round(duration, 4), "status": status})
+
+    def finish(self):
+        self.finished_at = time.time()
+        self._wall = time.perf_counter() - self._started
+
+    def summary(self) -> Dict[str, Any]:
+        """Totals for the whole run and per agent (i.e. per stage: outline, characters, chapters)."""
+        with self._lock:
+            calls, tasks = list(self.llm_calls), list(self.tasks)
+        return _summarize(calls, tasks)
+
+    def to_dict(self) -> Dict[str, Any]:
+        wall = self._wall if self._wall is not None else time.perf_counter() - self._started
+        with self._lock:
+            calls, tasks = list(self.llm_calls), list(self.tasks)
+        return {
+            "name": self.name,
+            "run_id": self.run_id,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "wall_seconds": round(wall, 3),
+            **self.summary(),
+            "llm_calls": calls,
+            "tasks": tasks,
+        }
+
+    def save(self, storage, filename: Optional[str] = None):
+        """Saves to `metrics/<run_id>.json` by default, so a later run (e.g. regenerate) does not replace this one."""
+        filename = filename or os.path.join(METRICS_DIR, f"{self.run_id}.json")
+        storage.save_data(filename, self.to_dict())
+        logging.info(f"[Metrics] Saved metrics to {filename}")
+
+def load_runs(storage) -> List[Dict[str, Any]]:
+    """Saved runs of one novel, oldest first (including a metrics.json left by older versions)."""
+    filenames = [METRICS_FILENAME] if storage.exists(METRICS_FILENAME) else []
+    directory = os.path.join(storage.base_path, METRICS_DIR)
+    if os.path.isdir(directory):
+        filenames += [os.path.join(METRICS_DIR, name) for name in os.listdir(directory) if name.endswith(".json")]
+    runs = [run for run in (storage.load_data(filename) for filename in filenames) if run]
+    return sorted(runs, key=lambda run: run.get("started_at") or 0)
+
+def merge_runs(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combines saved runs into one report: calls and tasks are pooled and summarized again
+    (so percentiles are over all calls), wall time is the sum of the runs' wall times."""
+    calls = [call for run in runs for call in run.get("llm_calls", [])]
+    tasks = [task for run in runs for task in run.get("tasks", [])]
+    return {
+        "name": f"{len(runs)} runs",
+        "runs": [run.get("run_id") or run.get("name") for run in runs],
+        "started_at": min((run.get("started_at") for run in runs if run.get("started_at")), default=None),
+        "finished_at": max((run.get("finished_at") for run in runs if run.get("finished_at")), default=None),
+        "wall_seconds": round(sum(run.get("wall_seconds", 0) for run in runs), 3),
+        **_summarize(calls, tasks),
+    }
+
+def _summarize(calls: List[Dict[str, Any]], tasks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    agents = sorted({c["agent"] for c in calls} | {t["agent"] for t in tasks})
+    return {
+        "totals": _aggregate(calls, tasks),
+        "agents": {agent: _aggregate([c for c in calls if c["agent"] == agent],
+                                     [t for t in tasks if t["agent"] == agent]) for agent in agents},
+    }
+
+def _aggregate(calls: List[Dict[str, Any]], tasks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    latencies = [c["latency"] for c in calls if not c.get("cached")]
+    ttfts = [c["ttft"] for c in calls if c.get("ttft") is not None and not c.get("cached")]
+    waits = [t["queue_wait"] for t in tasks]
+    return {
+        "llm_calls": len(calls),
+        "cache_hits": sum(1 for c in calls if c.get("cached")),
+        "hedged_calls": sum(1 for c in calls if c.get("hedged")),
+        "failovers": sum(c.get("failovers", 0) for c in calls),
+        "failed_calls": sum(1 for c in calls if not c.get("ok")),
+        "prompt_tokens": sum(c.get("prompt_tokens", 0) for c in calls if not c.get("cached")),
+        "completion_tokens": sum(c.get("completion_tokens", 0) for c in calls if not c.get("cached")),
+        "cached_prompt_tokens": sum(c.get("cached_prompt_tokens", 0) for c in calls if not c.get("cached")),
+        "llm_seconds": round(sum(latencies), 3),
+        "latency_p50": round(_percentile(latencies, 0.5), 3),
+        "latency_p95": round(_percentile(latencies, 0.95), 3),
+        "ttft_p50": round(_percentile(ttfts, 0.5), 3),
+        "tasks": len(tasks),
+        "failed_tasks": sum(1 for t in tasks if t["status"] != "completed"),
+        "task_seconds": round(sum(t["duration"] for t in tasks), 3),
+        "queue_wait_seconds": round(sum(waits), 3),
+        "queue_wait_p95": round(_percentile(waits, 0.95), 3),
+    }
@@ -1,3 +1,4 @@
 # src/persistence/__init__.py
 
-from .file_storage import FileStorage
+from .file_storage import FileStorage, validate_namespace
+from .chapter_store import ChapterStore
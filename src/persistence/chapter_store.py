@@ -0,0 +1,72 @@
+# src/persistence/chapter_store.py
+
+import os
+import logging
+from collections.abc import MutableMapping
+from typing import Iterable, Iterator, Set
+from .file_storage import FileStorage
+
+class ChapterStore(MutableMapping):
+    """按章节分文件保存正文的映射：章节序号 -> 正文。
+
+    每章保存在 `<directory>/chapter_0001.txt` 中，只在该章节被写入时落盘；
+    读取时才从文件加载正文，内存中只保留已写章节的序号。
+    """
+
+    def __init__(self, storage: FileStorage, directory: str = "chapters"):
+        self.storage = storage
+        self.directory = directory
+        self._indices: Set[int] = set()
+
+    def chapter_filename(self, index: int) -> str:
+        return os.path.join(self.directory, f"chapter_{int(index):04d}.txt")
+
+    def register(self, index: int) -> bool:
+        """登记一个已在磁盘上的章节（用于从清单或日志恢复）。文件不存在时返回 False。"""
+        if os.path.exists(os.path.join(self.storage.base_path, self.chapter_filename(index))):
+            self._indices.add(int(index))
+            return True
+        logging.warning(f"[Persistence] Chapter file missing for chapter {index}, ignoring.")
+        return False
+
+    def load_index(self, indices: Iterable[int]):
+        """用清单中的章节序号重建索引。"""
+        self._indices = set()
+        for index in indices:
+            self.register(index)
+
+    def __getitem__(self, index: int) -> str:
+        index = int(index)
+        if index not in self._indices:
+            raise KeyError(index)
+        with open(os.path.join(self.storage.base_path, self.chapter_filename(index)), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def __setitem__(self, index: int, content: str):
+        index = int(index)
+        self.storage.save_text(self.chapter_filename(index), content)
+        self._indices.add(index)
+
+    def __delitem__(self, index: int):
+        index = int(index)
+        if index not in self._indices:
+            raise KeyError(index)
+        self._indices.discard(index)
+        filepath = os.path.join(self.storage.base_path, self.chapter_filename(index))
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+    def __contains__(self, index) -> bool:
+        try:
+            return int(index) in self._indices
+        except (TypeError, ValueError):
+            return False
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(sorted(self._indices))
+
+    def __len__(self) -> int:
+        return len(self._indices)
+
+    def __repr__(self) -> str:
+        return f"ChapterStore({self.directory!r}, chapters={sorted(self._indices)})"
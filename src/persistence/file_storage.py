@@ -1,9 +1,23 @@
 # src/persistence/file_storage.py
 
 import os
+import re
 import json
 import logging
-from typing import Dict, Any
+import threading
+from typing import Dict, Any, Iterator, Union
+
+# 以此扩展名保存的数据使用 MessagePack 二进制编码
+BINARY_EXTENSION = ".msgpack"
+
+# 小说 id（namespace 目录名）只允许字母、数字、下划线和连字符，防止 "../x" 或绝对路径写到数据目录之外
+NAMESPACE_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+def validate_namespace(name: str) -> str:
+    """检查小说 id 是否可以安全地用作目录名，不合法时抛出 ValueError。"""
+    if not isinstance(name, str) or not NAMESPACE_PATTERN.match(name):
+        raise ValueError(f"Invalid novel id {name!r}: use only letters, digits, '_' and '-'.")
+    return name
 
 class FileStorage:
     def __init__(self, base_path: str = "./data"):
@@ -11,20 +25,97 @@ class FileStorage:
         # 确保数据存储目录存在
         os.makedirs(self.base_path, exist_ok=True)
 
+    def namespace(self, name: str) -> "FileStorage":
+        """返回 `<base_path>/novels/<name>` 下的独立存储，用于隔离不同小说的状态。"""
+        return FileStorage(base_path=os.path.join(self.base_path, "novels", validate_namespace(name)))
+
     def save_data(self, filename: str, data: Dict[str, Any]):
-        """将数据保存为JSON文件。"""
-        filepath = os.path.join(self.base_path, filename)
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        """将数据原子地保存为JSON文件（先写临时文件再重命名，崩溃时不会留下半个文件）。
+
+        文件名以 .msgpack 结尾时改用 MessagePack 二进制编码（需要安装 msgpack）。
+        """
+        filepath = self.get_path(filename)
+        if filename.endswith(BINARY_EXTENSION):
+            self._atomic_write(filepath, _msgpack().packb(data, use_bin_type=True))
+        else:
+            self._atomic_write(filepath, json.dumps(data, ensure_ascii=False, separators=(",", ":")))
         logging.info(f"[Persistence] Data saved to {filepath}")
 
     def load_data(self, filename: str) -> Dict[str, Any] or None:
         """从JSON文件加载数据。"""
         filepath = os.path.join(self.base_path, filename)
         if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            if filename.endswith(BINARY_EXTENSION):
+                with open(filepath, 'rb') as f:
+                    data = _msgpack().unpackb(f.read(), raw=False)
+            else:
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
             logging.info(f"[Persistence] Data loaded from {filepath}")
             return data
         logging.warning(f"[Persistence] File not found: {filepath}")
         return None
+
+    def save_text(self, filename: str, text: str):
+        """将文本原子地保存到文件。"""
+        self._atomic_write(self.get_path(filename), text)
+
+    def get_path(self, filename: str) -> str:
+        """返回存储目录下文件的完整路径，并确保其所在目录存在。"""
+        filepath = os.path.join(self.base_path, filename)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        return filepath
+
+    def append_journal(self, filename: str, record: Dict[str, Any]):
+        """向追加式日志（JSON Lines）写入一条记录并落盘。"""
+        filepath = self.get_path(filename)
+        with open(filepath, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read_journal(self, filename: str) -> Iterator[Dict[str, Any]]:
+        """按顺序读取日志记录。崩溃时写了一半的最后一行会被忽略。"""
+        filepath = os.path.join(self.base_path, filename)
+        if not os.path.exists(filepath):
+            return
+        with open(filepath, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(f"[Persistence] Skipping truncated journal record in {filepath}")
+                    return
+
+    def clear_journal(self, filename: str):
+        """清空日志（通常在完整快照保存之后）。"""
+        filepath = os.path.join(self.base_path, filename)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+    def exists(self, filename: str) -> bool:
+        return os.path.exists(os.path.join(self.base_path, filename))
+
+    def modified_time(self, filename: str) -> float:
+        return os.path.getmtime(os.path.join(self.base_path, filename))
+
+    def _atomic_write(self, filepath: str, text: Union[str, bytes]):
+        tmp_path = os.path.join(os.path.dirname(filepath), f".{os.path.basename(filepath)}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with (open(tmp_path, 'wb') if isinstance(text, bytes) else open(tmp_path, 'w', encoding='utf-8')) as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+def _msgpack():
+    # 可选依赖：只有使用二进制快照时才需要
+    try:
+        import msgpack
+    except ImportError as e:
+        raise RuntimeError("Binary snapshots require the 'msgpack' package (uv add msgpack)") from e
+    return msgpack
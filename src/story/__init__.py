@@ -2,4 +2,6 @@
 
 from .story_elements import StoryElements, World, Character, Plotline
 from .story_state_manager import StoryStateManager
-from .collaboration_protocol import CollaborationProtocol
+from .collaboration_protocol import CollaborationProtocol, ContextEntry, ContextSnapshot
+from .context_manager import StoryContextManager
+from .mention_index import MentionIndex
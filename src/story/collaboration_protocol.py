@@ -1,36 +1,124 @@
 # src/story/collaboration_protocol.py
 
-from typing import Dict, Any
+import logging
+import threading
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, Any, Callable, Iterator, Optional
+
+@dataclass(frozen=True, slots=True)
+class ContextEntry:
+    """共享上下文中的一项：值、发布时的版本号、发布者和发布时间。"""
+    value: Any
+    version: int
+    publisher: str
+    published_at: float
+
+class ContextSnapshot(Mapping):
+    """某一版本的共享上下文的只读视图：键 -> 值。发布新值不会改变已取得的快照。"""
+    __slots__ = ("version", "_entries")
+
+    def __init__(self, version: int, entries: Mapping):
+        self.version = version
+        self._entries = entries
+
+    def entry(self, key: str) -> Optional[ContextEntry]:
+        return self._entries.get(key)
+
+    def __getitem__(self, key: str) -> Any:
+        return self._entries[key].value
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self) -> str:
+        return f"ContextSnapshot(version={self.version}, keys={list(self._entries)})"
 
 class CollaborationProtocol:
+    """智能体之间的共享上下文总线：带版本号、写时复制，线程安全。
+
+    - 读（get_context / snapshot）不加锁：每次发布都生成一个新的不可变快照并整体替换引用，
+      读者拿到的快照在之后的发布中不会变化；
+    - 写（publish / update）在锁内完成，每次发布得到一个递增的全局版本号。
+
+    任务之间的先后关系（例如章节等待大纲和角色）由 TaskQueue 的依赖处理，这里只负责共享数据。
+
+    发布的值会被多个读者共享，应视为只读：需要修改时复制一份再发布（或使用 update）。
+    """
+
     def __init__(self):
-        self.shared_context: Dict[str, Any] = {}
+        self._snapshot = ContextSnapshot(0, MappingProxyType({}))
+        self._write_lock = threading.Lock()
         self.conflict_resolution_log: list = []
 
-    def share_information(self, agent_name: str, info_type: str, data: Any):
-        """智能体共享信息。"""
-        self.shared_context[info_type] = data
-        print(f"[Collaboration] {agent_name} shared {info_type}.")
+    # ---- 读 ----
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    def snapshot(self) -> ContextSnapshot:
+        """当前共享上下文的不可变快照。"""
+        return self._snapshot
 
-    def get_context(self, info_type: str) -> Any:
+    @property
+    def shared_context(self) -> ContextSnapshot:
+        return self._snapshot
+
+    def get_context(self, info_type: str, default: Any = None) -> Any:
         """智能体获取共享上下文。"""
-        return self.shared_context.get(info_type)
+        entry = self._snapshot.entry(info_type)
+        return entry.value if entry is not None else default
+
+    def get_entry(self, info_type: str) -> Optional[ContextEntry]:
+        return self._snapshot.entry(info_type)
+
+    # ---- 写 ----
+
+    def publish(self, agent_name: str, info_type: str, data: Any) -> int:
+        """原子地发布一个值，返回新的版本号。"""
+        return self.update(agent_name, info_type, lambda _: data)
+
+    def share_information(self, agent_name: str, info_type: str, data: Any) -> int:
+        """智能体共享信息（publish 的旧名称）。"""
+        return self.publish(agent_name, info_type, data)
+
+    def update(self, agent_name: str, info_type: str, modify: Callable[[Any], Any]) -> int:
+        """原子的读-改-写：modify(当前值或 None) 返回新值。并发的 update 不会互相覆盖。"""
+        with self._write_lock:
+            current = self._snapshot.entry(info_type)
+            version = self._snapshot.version + 1
+            entry = ContextEntry(modify(current.value if current is not None else None), version, agent_name, time.time())
+            entries = dict(self._snapshot._entries)
+            entries[info_type] = entry
+            self._snapshot = ContextSnapshot(version, MappingProxyType(entries))
+        logging.info(f"[Collaboration] {agent_name} shared {info_type} (version {version}).")
+        return version
+
+    # ---- 协商 ----
 
     def propose_change(self, agent_name: str, change_details: Dict[str, Any]) -> bool:
         """智能体提出修改建议。"""
-        print(f"[Collaboration] {agent_name} proposed change: {change_details}")
+        logging.info(f"[Collaboration] {agent_name} proposed change: {change_details}")
         # 简单的冲突解决机制：先到先得，或者更复杂的投票/协商机制
         # For now, just log and accept
-        self.conflict_resolution_log.append({"agent": agent_name, "change": change_details, "status": "accepted"})
+        with self._write_lock:
+            self.conflict_resolution_log.append({"agent": agent_name, "change": change_details, "status": "accepted"})
         return True
 
     def resolve_conflict(self, conflict_details: Dict[str, Any]) -> Dict[str, Any]:
         """解决智能体之间的创作冲突。"""
-        print(f"[Collaboration] Resolving conflict: {conflict_details}")
+        logging.info(f"[Collaboration] Resolving conflict: {conflict_details}")
         # 复杂的冲突解决逻辑，例如：
         # 1. 优先级：某些智能体（如大纲智能体）的提议优先级更高。
         # 2. 投票：多个智能体对某个提议进行投票。
         # 3. 协商：智能体之间进行多轮沟通，直到达成一致。
         # For now, a simple placeholder
-        self.conflict_resolution_log.append({"conflict": conflict_details, "status": "resolved"})
+        with self._write_lock:
+            self.conflict_resolution_log.append({"conflict": conflict_details, "status": "resolved"})
         return {"resolution": "accepted_one_proposal", "details": conflict_details}
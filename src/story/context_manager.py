@@ -0,0 +1,211 @@
+# src/story/context_manager.py
+
+import logging
+import os
+import re
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+from src.llm_client import estimate_tokens
+from .story_state_manager import StoryStateManager
+from .collaboration_protocol import CollaborationProtocol
+
+_SENTENCE_END_RE = re.compile(r"(?<=[。！？!?.])\s*")
+
+def truncate_to_tokens(text: str, max_tokens: int, from_end: bool = False) -> str:
+    """按估算的 token 数截断文本；from_end=True 时保留结尾部分。"""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    chars = max(1, int(len(text) * max_tokens / estimate_tokens(text)))
+    return ("…" + text[-chars:]) if from_end else (text[:chars] + "…")
+
+class StoryContextManager:
+    """为每章的提示词维护滚动摘要并按 token 预算打包上下文。
+
+    - 每写完一章，生成该章的短摘要（默认抽取式，不额外调用 LLM；传入 summarizer_llm 时使用 LLM 摘要），
+      摘要保存在存储的 summaries/ 目录下；
+    - 每满 arc_size 章，把这些章节摘要合并为一个篇章（arc）摘要；
+    - 为某一章构建上下文时，按优先级在 token_budget 内打包：上一章结尾 -> 本篇章内最近的章节摘要 ->
+      本章涉及的角色出现过的更早章节摘要（由提及索引给出）-> 更早的篇章摘要。尚未写完的前序章节用大纲摘要代替。
+
+    因此每章提示词中的上下文长度大致恒定，不随小说长度增长。
+    """
+
+    def __init__(self, story_state_manager: StoryStateManager, collaboration_protocol: CollaborationProtocol,
+                 token_budget: int = 1500, arc_size: int = 10, summary_tokens: int = 150, tail_tokens: int = 300,
+                 summarizer_llm=None):
+        self.story_state_manager = story_state_manager
+        self.collaboration_protocol = collaboration_protocol
+        self.storage = story_state_manager.storage
+        self.token_budget = token_budget
+        self.arc_size = arc_size
+        self.summary_tokens = summary_tokens
+        self.tail_tokens = tail_tokens
+        self.summarizer_llm = summarizer_llm
+        self._chapter_summaries: Dict[int, str] = {}
+        self._arc_summaries: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    # ---- 增量更新 ----
+
+    def on_chapter_written(self, chapter_index: int, content: str):
+        """章节写完后调用：更新该章摘要，必要时更新所在篇章的摘要。"""
+        summary = self._summarize_chapter(chapter_index, content)
+        with self._lock:
+            self._chapter_summaries[chapter_index] = summary
+        self.storage.save_text(self._chapter_summary_file(chapter_index), summary)
+
+        arc = self._arc_of(chapter_index)
+        arc_chapters = self._arc_chapters(arc)
+        if all(self._chapter_summary(i) for i in arc_chapters):
+            arc_summary = self._summarize_arc(arc, [self._chapter_summary(i) for i in arc_chapters])
+            with self._lock:
+                self._arc_summaries[arc] = arc_summary
+            self.storage.save_text(self._arc_summary_file(arc), arc_summary)
+            self.collaboration_protocol.share_information("ContextManager", "latest_arc_summary", {"arc": arc, "summary": arc_summary})
+
+    # ---- 上下文打包 ----
+
+    def build_context(self, chapter_index: int, chapter_info: Dict[str, Any], characters: List[Any] = None) -> str:
+        """返回第 chapter_index 章可用的前情上下文，估算长度不超过 token_budget。"""
+        if chapter_index <= 1 or self.token_budget <= 0:
+            return ""
+
+        names = [c.name for c in (characters or []) if getattr(c, "name", None)]
+        chapter_text = f"{chapter_info.get('title', '')} {chapter_info.get('summary', '')}"
+        listed = set(chapter_info.get("characters") or [])
+        involved = [n for n in names if n in chapter_text or n in listed]
+        current_arc = self._arc_of(chapter_index)
+        arc_start = self._arc_chapters(current_arc)[0]
+
+        # (优先级, 排序位置, 文本)：优先级越小越先放入预算
+        candidates: List[Tuple[int, int, str]] = []
+
+        previous_tail = self._chapter_tail(chapter_index - 1)
+        if previous_tail:
+            candidates.append((0, chapter_index - 1, f"[End of Chapter {chapter_index - 1}]\n{previous_tail}"))
+
+        for i in range(chapter_index - 1, arc_start - 1, -1):
+            candidates.append((1, i, f"Chapter {i}: {self._chapter_summary(i) or self._outline_summary(i)}"))
+
+        # 本章角色在更早篇章中出现过的章节：查提及索引，不扫描正文或摘要
+        mentions = self.story_state_manager.mentions
+        related = {i for n in involved for i in mentions.chapters_with(n) if i < arc_start}
+        for i in sorted(related, reverse=True):
+            summary = self._chapter_summary(i)
+            if summary:
+                candidates.append((2, i, f"Chapter {i}: {summary}"))
+
+        for arc in range(current_arc - 1, -1, -1):
+            arc_summary = self._arc_summary(arc)
+            if arc_summary:
+                first, last = self._arc_chapters(arc)[0], self._arc_chapters(arc)[-1]
+                candidates.append((3, first, f"Chapters {first}-{last}: {arc_summary}"))
+
+        remaining = self.token_budget
+        selected = []
+        for priority, position, text in sorted(candidates, key=lambda c: (c[0], -c[1])):
+            cost = estimate_tokens(text)
+            if cost > remaining:
+                continue
+            selected.append((position, priority, text))
+            remaining -= cost
+
+        # 按故事顺序输出，上一章结尾放在最后，紧接本章
+        selected.sort(key=lambda s: (s[1] == 0, s[0]))
+        return "\n".join(text for _, _, text in selected)
+
+    # ---- 摘要 ----
+
+    def _summarize_chapter(self, chapter_index: int, content: str) -> str:
+        if self.summarizer_llm:
+            prompt = (
+                f"Summarize the following novel chapter in at most {self.summary_tokens} tokens. "
+                "Keep names, key events and the situation at the end of the chapter.\n\n"
+                f"{content}"
+            )
+            summary = self.summarizer_llm.generate_text(prompt)
+            if summary:
+                return truncate_to_tokens(summary.strip(), self.summary_tokens)
+            logging.warning(f"[Context] LLM summary failed for chapter {chapter_index}, falling back to extractive summary.")
+
+        # 抽取式摘要：大纲中的章节摘要 + 章节结尾的几句话（结尾最能反映后续章节需要衔接的状态）
+        outline_summary = self._outline_summary(chapter_index)
+        sentences = [s for s in _SENTENCE_END_RE.split(content.strip()) if s.strip()]
+        ending = " ".join(sentences[-2:])
+        budget = max(self.summary_tokens - estimate_tokens(outline_summary), self.summary_tokens // 3)
+        return f"{outline_summary} {truncate_to_tokens(ending, budget, from_end=True)}".strip()
+
+    def _summarize_arc(self, arc: int, chapter_summaries: List[str]) -> str:
+        joined = "\n".join(chapter_summaries)
+        if self.summarizer_llm:
+            summary = self.summarizer_llm.generate_text(
+                f"Condense these consecutive chapter summaries into one summary of at most {self.summary_tokens * 2} tokens:\n\n{joined}"
+            )
+            if summary:
+                return truncate_to_tokens(summary.strip(), self.summary_tokens * 2)
+        # 抽取式：每章摘要的第一句
+        first_sentences = [(_SENTENCE_END_RE.split(s.strip()) or [""])[0] for s in chapter_summaries]
+        return truncate_to_tokens(" ".join(first_sentences), self.summary_tokens * 2)
+
+    # ---- 读取（内存缓存 + 存储） ----
+
+    def _chapter_summary(self, chapter_index: int) -> Optional[str]:
+        # 只使用本次状态中已写章节的摘要，避免读到同一目录下旧小说留下的摘要文件
+        if chapter_index not in self.story_state_manager.chapters_content:
+            return None
+        with self._lock:
+            summary = self._chapter_summaries.get(chapter_index)
+        if summary is None:
+            summary = self._read(self._chapter_summary_file(chapter_index))
+            if summary is not None:
+                with self._lock:
+                    self._chapter_summaries[chapter_index] = summary
+        return summary
+
+    def _arc_summary(self, arc: int) -> Optional[str]:
+        if not all(i in self.story_state_manager.chapters_content for i in self._arc_chapters(arc)):
+            return None
+        with self._lock:
+            summary = self._arc_summaries.get(arc)
+        if summary is None:
+            summary = self._read(self._arc_summary_file(arc))
+            if summary is not None:
+                with self._lock:
+                    self._arc_summaries[arc] = summary
+        return summary
+
+    def _chapter_tail(self, chapter_index: int) -> str:
+        chapters_content = self.story_state_manager.chapters_content
+        if chapter_index < 1 or chapter_index not in chapters_content:
+            return ""
+        return truncate_to_tokens(chapters_content[chapter_index].strip(), self.tail_tokens, from_end=True)
+
+    def _outline_summary(self, chapter_index: int) -> str:
+        outline = self.collaboration_protocol.get_context("novel_outline") or self.story_state_manager.outline or {}
+        chapters = outline.get("chapters", [])
+        if 0 < chapter_index <= len(chapters):
+            return chapters[chapter_index - 1].get("summary", "")
+        return ""
+
+    def _read(self, filename: str) -> Optional[str]:
+        filepath = os.path.join(self.storage.base_path, filename)
+        if not os.path.exists(filepath):
+            return None
+        with open(filepath, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def _arc_of(self, chapter_index: int) -> int:
+        return (chapter_index - 1) // self.arc_size
+
+    def _arc_chapters(self, arc: int) -> List[int]:
+        return list(range(arc * self.arc_size + 1, (arc + 1) * self.arc_size + 1))
+
+    @staticmethod
+    def _chapter_summary_file(chapter_index: int) -> str:
+        return os.path.join("summaries", f"chapter_{chapter_index:04d}.txt")
+
+    @staticmethod
+    def _arc_summary_file(arc: int) -> str:
+        return os.path.join("summaries", f"arc_{arc + 1:03d}.txt")
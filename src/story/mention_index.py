@@ -0,0 +1,160 @@
+# src/story/mention_index.py
+
+import logging
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from src.persistence import FileStorage
+
+class MentionIndex:
+    """实体（角色、地点等）提及位置的倒排索引：实体 -> 章节 -> 在正文中的字符偏移。
+
+    - 每写入一章调用 index_chapter，只扫描这一章，结果保存在 `<directory>/chapter_0001.json`
+      （与章节正文文件一一对应，只在该章变化时写入）；
+    - 实体通过 add_entity 登记，可带别名；别名的提及记在实体名下。已有章节之后才登记的实体，
+      需要调用 reindex 补扫已有章节；
+    - 查询（某实体出现在哪些章节、最后一次出现在哪里、某章有哪些实体）只查内存中的索引，
+      不扫描正文、不调用 LLM。索引文件在第一次查询时才加载。
+
+    chapters 为当前小说已写章节的集合（ChapterStore），只统计其中的章节，
+    避免读到同一目录下旧小说留下的索引文件。
+    """
+
+    def __init__(self, storage: FileStorage, chapters, directory: str = "mentions"):
+        self.storage = storage
+        self.chapters = chapters
+        self.directory = directory
+        self._entities: Dict[str, Set[str]] = {}           # 实体名 -> 别名（含实体名本身）
+        self._kinds: Dict[str, str] = {}
+        self._alias_to_entity: Dict[str, str] = {}
+        self._lookup: Dict[str, str] = {}                  # 小写的实体名/别名 -> 实体名，用于查询
+        self._pattern: Optional[re.Pattern] = None
+        self._postings: Dict[str, Dict[int, List[int]]] = {}
+        self._by_chapter: Dict[int, Dict[str, List[int]]] = {}
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    # ---- 登记实体 ----
+
+    def add_entity(self, name: str, aliases: Iterable[str] = (), kind: str = "character") -> bool:
+        """登记实体及其别名。有新的名字加入时返回 True（调用方可据此对已有章节调用 reindex）。"""
+        names = {n.strip() for n in [name, *aliases] if n and n.strip()}
+        with self._lock:
+            new_names = {n for n in names if self._alias_to_entity.get(n) != name}
+            if not new_names:
+                return False
+            self._entities.setdefault(name, set()).update(names)
+            self._kinds[name] = kind
+            for alias in new_names:
+                self._alias_to_entity[alias] = name
+                self._lookup[alias.casefold()] = name
+            self._pattern = None
+            return True
+
+    def entities(self) -> Dict[str, str]:
+        """返回已登记的实体名 -> 类型。"""
+        with self._lock:
+            return dict(self._kinds)
+
+    # ---- 建立索引 ----
+
+    def index_chapter(self, chapter_index: int, content: str):
+        """扫描一章正文并替换该章原有的索引项。"""
+        chapter_mentions = self._scan(content)
+        with self._lock:
+            self._ensure_loaded()
+            self._replace(int(chapter_index), chapter_mentions)
+        self.storage.save_data(self.chapter_filename(chapter_index), chapter_mentions)
+
+    def reindex(self, chapters: Iterable[Tuple[int, str]]):
+        """重新扫描给定的 (章节序号, 正文)，用于已有章节之后才登记的实体。"""
+        for chapter_index, content in chapters:
+            self.index_chapter(chapter_index, content)
+
+    def chapter_filename(self, chapter_index: int) -> str:
+        return os.path.join(self.directory, f"chapter_{int(chapter_index):04d}.json")
+
+    # ---- 查询 ----
+
+    def chapters_with(self, name: str) -> List[int]:
+        """实体（或其别名）出现过的章节，按章节顺序。"""
+        with self._lock:
+            return sorted(self._chapter_postings(name))
+
+    def last_appearance(self, name: str, before_chapter: Optional[int] = None) -> Optional[Tuple[int, int]]:
+        """实体在 before_chapter 之前（不指定时为全书）最后一次出现的 (章节, 偏移)；没有出现过时返回 None。"""
+        with self._lock:
+            postings = self._chapter_postings(name)
+            candidates = [i for i in postings if before_chapter is None or i < before_chapter]
+            if not candidates:
+                return None
+            chapter_index = max(candidates)
+            return chapter_index, postings[chapter_index][-1]
+
+    def mentions(self, name: str, chapter_index: int) -> List[int]:
+        """实体在某一章中每次出现的字符偏移。"""
+        with self._lock:
+            return list(self._chapter_postings(name).get(int(chapter_index), []))
+
+    def entities_in(self, chapter_index: int) -> Dict[str, int]:
+        """某一章中出现的实体及其出现次数。"""
+        with self._lock:
+            self._ensure_loaded()
+            if int(chapter_index) not in self.chapters:
+                return {}
+            return {entity: len(offsets) for entity, offsets in self._by_chapter.get(int(chapter_index), {}).items()}
+
+    # ---- 内部 ----
+
+    def _chapter_postings(self, name: str) -> Dict[int, List[int]]:
+        self._ensure_loaded()
+        entity = self._lookup.get(name.strip().casefold(), name)
+        return {i: offsets for i, offsets in self._postings.get(entity, {}).items() if i in self.chapters}
+
+    def _scan(self, content: str) -> Dict[str, List[int]]:
+        with self._lock:
+            if self._pattern is None and self._alias_to_entity:
+                self._pattern = _compile(self._alias_to_entity)
+            pattern, alias_to_entity = self._pattern, dict(self._alias_to_entity)
+        result: Dict[str, List[int]] = {}
+        if pattern is not None:
+            for match in pattern.finditer(content):
+                result.setdefault(alias_to_entity[match.group(0)], []).append(match.start())
+        return result
+
+    def _replace(self, chapter_index: int, chapter_mentions: Dict[str, List[int]]):
+        for entity in self._by_chapter.pop(chapter_index, {}):
+            self._postings.get(entity, {}).pop(chapter_index, None)
+        self._by_chapter[chapter_index] = chapter_mentions
+        for entity, offsets in chapter_mentions.items():
+            self._postings.setdefault(entity, {})[chapter_index] = offsets
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        directory = os.path.join(self.storage.base_path, self.directory)
+        if not os.path.isdir(directory):
+            return
+        for filename in sorted(os.listdir(directory)):
+            match = re.fullmatch(r"chapter_(\d+)\.json", filename)
+            if not match or int(match.group(1)) in self._by_chapter:
+                continue
+            data = self.storage.load_data(os.path.join(self.directory, filename))
+            if data is not None:
+                self._replace(int(match.group(1)), data)
+        logging.info(f"[Mentions] Loaded mention index for {len(self._by_chapter)} chapters")
+
+def _compile(alias_to_entity: Dict[str, str]) -> re.Pattern:
+    """所有别名合成一个正则（长的优先，避免 "Lin" 抢先匹配 "Lin Feng"），每章只需扫描一遍。
+    以 ASCII 字母数字开头/结尾的别名要求词边界；中文名不加边界（中文词之间没有空格）。"""
+    parts = []
+    for alias in sorted(alias_to_entity, key=len, reverse=True):
+        part = re.escape(alias)
+        if alias[0].isascii() and alias[0].isalnum():
+            part = r"(?<![A-Za-z0-9_])" + part
+        if alias[-1].isascii() and alias[-1].isalnum():
+            part += r"(?![A-Za-z0-9_])"
+        parts.append(part)
+    return re.compile("|".join(parts))
@@ -1,55 +1,66 @@
 # src/story/story_elements.py
 
-from typing import List, Dict, Any
+import dataclasses
+import typing
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Type, TypeVar
 
-class World:
-    def __init__(self, name: str, description: str, rules: List[str]):
-        self.name = name
-        self.description = description
-        self.rules = rules
+T = TypeVar("T", bound="_Element")
 
-    def to_dict(self) -> Dict[str, Any]:
-        return {
-            "name": self.name,
-            "description": self.description,
-            "rules": self.rules
-        }
-
-class Character:
-    def __init__(self, name: str, personality: List[str], background: str, role: str, unique_traits: str):
-        self.name = name
-        self.personality = personality
-        self.background = background
-        self.role = role
-        self.unique_traits = unique_traits
+class _Element:
+    """故事元素的公共基类：提供通用、完整的字典往返编解码。
 
-    def to_dict(self) -> Dict[str, Any]:
-        return {
-            "name": self.name,
-            "personality": self.personality,
-            "background": self.background,
-            "role": self.role,
-            "unique_traits": self.unique_traits
-        }
-
-class Plotline:
-    def __init__(self, name: str, summary: str, key_events: List[str]):
-        self.name = name
-        self.summary = summary
-        self.key_events = key_events
+    所有元素都是 slots 数据类（不带实例 __dict__，数千个角色常驻内存时占用更小）。
+    编解码按字段的类型注解处理嵌套元素、List[...]、Dict[str, ...] 和 Optional[...]，
+    每个类的字段及其转换函数在第一次使用时解析一次并缓存，
+    新增字段或元素类型时不需要再手写 to_dict / 加载逻辑。
+    """
+    __slots__ = ()
 
     def to_dict(self) -> Dict[str, Any]:
-        return {
-            "name": self.name,
-            "summary": self.summary,
-            "key_events": self.key_events
-        }
-
-class StoryElements:
-    def __init__(self):
-        self.world: World = None
-        self.characters: Dict[str, Character] = {}
-        self.plotlines: Dict[str, Plotline] = {}
+        data = {}
+        for name, encoder, _ in _fields(type(self)):
+            value = getattr(self, name)
+            data[name] = value if encoder is None or value is None else encoder(value)
+        return data
+
+    @classmethod
+    def from_dict(cls: Type[T], data: Dict[str, Any]) -> T:
+        """从 to_dict 的结果重建元素。忽略未知字段；缺少的字段使用默认值（没有默认值时抛出 TypeError）。"""
+        kwargs = {}
+        for name, _, decoder in _fields(cls):
+            if name in data:
+                value = data[name]
+                kwargs[name] = value if decoder is None or value is None else decoder(value)
+        return cls(**kwargs)
+
+@dataclass(slots=True)
+class World(_Element):
+    name: str
+    description: str
+    rules: List[str] = field(default_factory=list)
+
+@dataclass(slots=True)
+class Character(_Element):
+    name: str
+    personality: List[str]
+    background: str
+    role: str
+    unique_traits: str
+    # 正文中对该角色的其他称呼（昵称、头衔、简称），用于提及索引
+    aliases: List[str] = field(default_factory=list)
+
+@dataclass(slots=True)
+class Plotline(_Element):
+    name: str
+    summary: str
+    key_events: List[str] = field(default_factory=list)
+
+@dataclass(slots=True)
+class StoryElements(_Element):
+    world: Optional[World] = None
+    characters: Dict[str, Character] = field(default_factory=dict)
+    plotlines: Dict[str, Plotline] = field(default_factory=dict)
 
     def add_world(self, world: World):
         self.world = world
@@ -60,9 +71,35 @@ class StoryElements:
     def add_plotline(self, plotline: Plotline):
         self.plotlines[plotline.name] = plotline
 
-    def to_dict(self) -> Dict[str, Any]:
-        return {
-            "world": self.world.to_dict() if self.world else None,
-            "characters": {name: char.to_dict() for name, char in self.characters.items()},
-            "plotlines": {name: plot.to_dict() for name, plot in self.plotlines.items()}
-        }
+_FIELDS: Dict[type, tuple] = {}
+
+def _fields(cls: type) -> tuple:
+    """返回 cls 的 ((字段名, 编码, 解码), ...)，第一次调用时根据类型注解生成；无需转换的字段编解码为 None。"""
+    fields = _FIELDS.get(cls)
+    if fields is None:
+        hints = typing.get_type_hints(cls)
+        fields = _FIELDS[cls] = tuple((f.name, *_converters(hints[f.name])) for f in dataclasses.fields(cls))
+    return fields
+
+def _converters(hint: Any) -> tuple:
+    """返回某个类型注解的 (编码, 解码) 函数；基本类型及其容器无需转换，返回 None。"""
+    origin = typing.get_origin(hint)
+    if origin is typing.Union:  # Optional[X]；None 值由调用方处理
+        hint = next(arg for arg in typing.get_args(hint) if arg is not type(None))
+        origin = typing.get_origin(hint)
+    if isinstance(hint, type) and issubclass(hint, _Element):
+        return (lambda value: value.to_dict(),
+                lambda value: value if isinstance(value, hint) else hint.from_dict(value))
+    if origin is list:
+        encoder, decoder = _converters(typing.get_args(hint)[0])
+        if encoder is None:
+            return None, None
+        return (lambda value: [encoder(item) for item in value],
+                lambda value: [decoder(item) for item in value])
+    if origin is dict:
+        encoder, decoder = _converters(typing.get_args(hint)[1])
+        if encoder is None:
+            return None, None
+        return (lambda value: {key: encoder(item) for key, item in value.items()},
+                lambda value: {key: decoder(item) for key, item in value.items()})
+    return None, None
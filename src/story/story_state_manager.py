@@ -1,14 +1,27 @@
 # src/story/story_state_manager.py
 
-from typing import Dict, Any
-from .story_elements import StoryElements, World, Character
-from src.persistence import FileStorage
+from typing import Dict, Any, Optional
+from .story_elements import StoryElements, World, Character, Plotline
+from .mention_index import MentionIndex
+from src.persistence import FileStorage, ChapterStore
 import logging
+import os
+
+SNAPSHOT_FORMATS = {"json": "story_state.json", "msgpack": "story_state.msgpack"}
 
 class StoryStateManager:
-    def __init__(self, storage: FileStorage):
+    def __init__(self, storage: FileStorage, snapshot_format: Optional[str] = None):
+        """snapshot_format: 快照编码，"json"（默认）或 "msgpack"（二进制，更小更快，需要安装 msgpack）。
+        为 None 时加载已有的（较新的）快照，并在保存时沿用它的格式。"""
+        if snapshot_format is not None and snapshot_format not in SNAPSHOT_FORMATS:
+            raise ValueError(f"Unsupported snapshot format: {snapshot_format}")
+        self.snapshot_format = snapshot_format
         self.current_story_elements = StoryElements()
-        self.chapters_content: Dict[int, str] = {}
+        self.outline: Dict[str, Any] = None
+        # 章节正文按章分文件保存，访问时才加载
+        self.chapters_content: ChapterStore = ChapterStore(storage)
+        # 角色/地点 -> 章节和偏移的倒排索引，随每章写入增量更新，用于连续性检查和前情选择
+        self.mentions = MentionIndex(storage, self.chapters_content)
         self.current_chapter_index = 0
         self.overall_progress: Dict[str, Any] = {
             "outline_generated": False,
@@ -19,23 +32,35 @@ class StoryStateManager:
         self.storage = storage
 
     def update_elements(self, new_elements: Dict[str, Any]):
-        # This method would parse and update story elements based on agent output
-        # For now, a simple placeholder
-        if "world" in new_elements:
-            # Assuming new_elements['world'] is a dict that can be used to create a World object
-            pass # Implement actual parsing and updating
+        """合并智能体产出的故事元素（元素对象或其 to_dict() 结果）。"""
+        if new_elements.get("world"):
+            world_data = new_elements["world"]
+            try:
+                self.current_story_elements.add_world(world_data if isinstance(world_data, World) else World.from_dict(world_data))
+            except TypeError as e:
+                logging.error(f"Error creating World object from data: {world_data} - {e}")
         if "characters" in new_elements:
             for char_data in new_elements["characters"]:
                 try:
-                    character = Character(**char_data)
+                    character = char_data if isinstance(char_data, Character) else Character.from_dict(char_data)
                     self.current_story_elements.add_character(character)
                 except TypeError as e:
                     logging.error(f"Error creating Character object from data: {char_data} - {e}")
         if "plotlines" in new_elements:
-            pass # Implement actual parsing and updating
+            for plot_data in new_elements["plotlines"]:
+                try:
+                    plotline = plot_data if isinstance(plot_data, Plotline) else Plotline.from_dict(plot_data)
+                    self.current_story_elements.add_plotline(plotline)
+                except TypeError as e:
+                    logging.error(f"Error creating Plotline object from data: {plot_data} - {e}")
+        new_entities = self._register_entities()
+        if new_entities and self.chapters_content:
+            # 已有章节之后才出现的角色（例如流水线模式下）：补扫已有章节
+            self.mentions.reindex(self.chapters_content.items())
 
     def add_chapter_content(self, chapter_index: int, content: str):
         self.chapters_content[chapter_index] = content
+        self.mentions.index_chapter(chapter_index, content)
         self.overall_progress["chapters_written"] = len(self.chapters_content)
 
     def set_total_chapters(self, count: int):
@@ -44,39 +69,112 @@ class StoryStateManager:
     def update_progress(self, key: str, value: Any):
         self.overall_progress[key] = value
 
+    def checkpoint(self, record: Dict[str, Any], filename: Optional[str] = None):
+        """应用一个已完成步骤的结果，并将其追加到日志中（只写入增量）。
+
+        record 的形式：
+        - {"step": "outline", "outline": {...}}
+        - {"step": "characters", "characters": [{...}, ...]}
+        - {"step": "chapter", "index": 1, "content": "..."}
+        """
+        self._apply_record(record)
+        filename = filename or self.snapshot_filename()
+        if record.get("step") == "chapter":
+            # 章节正文已写入独立的章节文件，日志中只记录章节序号
+            record = {"step": "chapter", "index": record["index"]}
+        self.storage.append_journal(self._journal_filename(filename), record)
+
+    def _apply_record(self, record: Dict[str, Any]):
+        step = record.get("step")
+        if step == "outline":
+            self.outline = record["outline"]
+            self.update_progress("outline_generated", True)
+            self.set_total_chapters(len(self.outline.get("chapters", [])))
+        elif step == "characters":
+            self.update_elements({"characters": record["characters"]})
+        elif step == "chapter":
+            if "content" in record:
+                self.add_chapter_content(int(record["index"]), record["content"])
+            elif self.chapters_content.register(record["index"]):
+                self.overall_progress["chapters_written"] = len(self.chapters_content)
+        else:
+            logging.warning(f"[Persistence] Unknown journal record step: {step}")
+
+    def _register_entities(self) -> bool:
+        """把角色（含别名）和世界名登记到提及索引，有新名字时返回 True。"""
+        elements = self.current_story_elements
+        added = False
+        for character in elements.characters.values():
+            added = self.mentions.add_entity(character.name, character.aliases, kind="character") or added
+        if elements.world and elements.world.name:
+            added = self.mentions.add_entity(elements.world.name, kind="world") or added
+        return added
+
+    def snapshot_filename(self) -> str:
+        return SNAPSHOT_FORMATS[self.snapshot_format or "json"]
+
+    def _existing_snapshot(self) -> str:
+        """要加载的快照文件：指定格式的快照；未指定或不存在时取已有快照中较新的一个。"""
+        preferred = self.snapshot_filename()
+        if self.snapshot_format and self.storage.exists(preferred):
+            return preferred
+        existing = [name for name in SNAPSHOT_FORMATS.values() if self.storage.exists(name)]
+        if not existing:
+            return preferred
+        latest = max(existing, key=self.storage.modified_time)
+        if self.snapshot_format is None:
+            # 保存时沿用已有快照的格式
+            self.snapshot_format = next(fmt for fmt, name in SNAPSHOT_FORMATS.items() if name == latest)
+        return latest
+
+    @staticmethod
+    def _journal_filename(filename: str) -> str:
+        return f"{os.path.splitext(filename)[0]}.journal.jsonl"
+
     def get_current_state(self) -> Dict[str, Any]:
+        """返回状态清单。章节正文不在其中，只列出已写章节的序号（正文通过 chapters_content 按需读取）。"""
         return {
+            "outline": self.outline,
             "story_elements": self.current_story_elements.to_dict(),
-            "chapters_content": self.chapters_content,
+            "chapters": list(self.chapters_content),
             "current_chapter_index": self.current_chapter_index,
             "overall_progress": self.overall_progress
         }
 
-    def save_state(self, filename: str = "story_state.json"):
+    def save_state(self, filename: Optional[str] = None):
+        filename = filename or self.snapshot_filename()
         state_to_save = self.get_current_state()
         self.storage.save_data(filename, state_to_save)
+        # 快照已包含日志中的所有步骤，可以截断日志；若在两步之间崩溃，重放日志是幂等的
+        self.storage.clear_journal(self._journal_filename(filename))
 
-    def load_state(self, filename: str = "story_state.json"):
+    def load_state(self, filename: Optional[str] = None):
+        filename = filename or self._existing_snapshot()
         loaded_state = self.storage.load_data(filename)
         if loaded_state:
-            # Reconstruct state from loaded data
-            self.current_story_elements = StoryElements() # Needs proper reconstruction from dict
-            # For simplicity, directly assign for now
-            if loaded_state.get("story_elements") and loaded_state["story_elements"].get("world"):
-                world_data = loaded_state["story_elements"]["world"]
-                self.current_story_elements.add_world(World(world_data["name"], world_data["description"], world_data["rules"]))
-            if loaded_state.get("story_elements") and loaded_state["story_elements"].get("characters"):
-                for char_name, char_data in loaded_state["story_elements"]["characters"].items():
-                    try:
-                        character = Character(**char_data)
-                        self.current_story_elements.add_character(character)
-                    except TypeError as e:
-                        logging.error(f"Error reconstructing Character object from loaded data: {char_data} - {e}")
-            # ... similarly for plotlines
-
-            self.chapters_content = loaded_state.get("chapters_content", {})
+            try:
+                self.current_story_elements = StoryElements.from_dict(loaded_state.get("story_elements") or {})
+            except TypeError as e:
+                logging.error(f"Error reconstructing story elements from loaded data: {e}")
+                self.current_story_elements = StoryElements()
+            # 索引文件随章节写入时已保存，这里只需登记实体
+            self._register_entities()
+
+            self.outline = loaded_state.get("outline")
+            self.chapters_content.load_index(loaded_state.get("chapters", []))
+            # 兼容旧格式：正文内嵌在状态文件中时迁移为按章文件
+            for index, content in loaded_state.get("chapters_content", {}).items():
+                self.chapters_content[int(index)] = content
             self.current_chapter_index = loaded_state.get("current_chapter_index", 0)
             self.overall_progress = loaded_state.get("overall_progress", {})
             logging.info("[Persistence] Story state loaded.")
         else:
-            logging.warning("[Persistence] No saved state found to load.")
\ No newline at end of file
+            logging.warning("[Persistence] No saved state found to load.")
+
+        # 重放快照之后完成的步骤
+        replayed = 0
+        for record in self.storage.read_journal(self._journal_filename(filename)):
+            self._apply_record(record)
+            replayed += 1
+        if replayed:
+            logging.info(f"[Persistence] Replayed {replayed} journal records.")
\ No newline at end of file
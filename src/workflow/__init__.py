@@ -1,4 +1,7 @@
 # src/workflow/__init__.py
 
 from .task_queue import TaskQueue
+from .durable_queue import DurableTaskQueue, TASK_QUEUE_FILENAME
+from .worker import QueueWorker
 from .creative_workflow import CreativeWorkflow
+from .batch_runner import BatchRunner, load_prompts
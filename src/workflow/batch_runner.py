@@ -0,0 +1,152 @@
+# src/workflow/batch_runner.py
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, List
+from src.persistence import FileStorage, validate_namespace
+from src.workflow.creative_workflow import CreativeWorkflow
+
+def load_prompts(path: str) -> List[Dict[str, str]]:
+    """读取批量提示文件。
+
+    每行一个提示；以 '{' 开头的行按 JSON 解析，可指定 {"id": "...", "prompt": "..."}。
+    空行和以 '#' 开头的行会被忽略。未指定 id 时用提示内容的哈希作为 id，重复运行时保持不变。
+    id 只能包含字母、数字、下划线和连字符，否则抛出 ValueError。
+    """
+    prompts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                entry = json.loads(line)
+                prompt = entry["prompt"]
+                novel_id = entry.get("id")
+            else:
+                prompt, novel_id = line, None
+            if novel_id is not None:
+                try:
+                    validate_namespace(novel_id)
+                except ValueError as e:
+                    raise ValueError(f"{path}:{line_number}: {e}") from None
+            prompts.append({"id": novel_id or hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:12], "prompt": prompt})
+    return prompts
+
+class BatchRunner:
+    """在一个进程内批量创作多部小说。
+
+    - 每部小说使用 `storage.namespace(id)` 下的独立状态，互不覆盖；
+    - 所有小说共用同一个 LLM 客户端（因此共用缓存、限流和熔断）和同一个章节线程池；
+    - max_concurrency 是全局同时在途的 LLM 任务上限，per_novel_concurrency 是单部小说的上限，
+      max_active_novels 是同时推进的小说数。
+    """
+
+    def __init__(self, storage: FileStorage, llm, max_concurrency: int = 8, per_novel_concurrency: int = 4,
+                 max_active_novels: int = None, context_token_budget: int = 1500, pipelined: bool = False,
+                 snapshot_format: str = None, job_queue=None, scenes_per_chapter: int = 0,
+                 job_timeout: float = None):
+        self.storage = storage
+        self.llm = llm
+        self.max_concurrency = max(1, max_concurrency)
+        self.per_novel_concurrency = max(1, per_novel_concurrency)
+        self.max_active_novels = max_active_novels or self.max_concurrency
+        self.context_token_budget = context_token_budget
+        self.pipelined = pipelined
+        self.snapshot_format = snapshot_format
+        # 所有小说的章节任务共用一个持久化队列（任务键带小说 id），由 worker 进程执行
+        self.job_queue = job_queue
+        self.job_timeout = job_timeout
+        self.scenes_per_chapter = scenes_per_chapter
+
+    def run(self, prompts: List[Dict[str, str]], resume: bool = False) -> List[Dict[str, Any]]:
+        self._validate(prompts)
+        logging.info(f"[Batch] Starting batch of {len(prompts)} novels "
+                     f"(global concurrency {self.max_concurrency}, per novel {self.per_novel_concurrency})")
+        results = []
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="batch-task") as task_executor, \
+             ThreadPoolExecutor(max_workers=self.max_active_novels, thread_name_prefix="batch-novel") as novel_executor:
+            futures = {
+                novel_executor.submit(self._run_novel, entry, task_executor, resume): entry
+                for entry in prompts
+            }
+            for future in as_completed(futures):
+                entry = futures[future]
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append(self._failed(entry, e))
+        return self._finish(results)
+
+    async def arun(self, prompts: List[Dict[str, str]], resume: bool = False) -> List[Dict[str, Any]]:
+        """run 的异步版本：所有小说的所有任务都在同一个事件循环上运行，不为每个在途请求占用线程，
+        因此 max_concurrency 可以设得很大（受服务商限流约束）。"""
+        self._validate(prompts)
+        logging.info(f"[Batch] Starting async batch of {len(prompts)} novels "
+                     f"(global concurrency {self.max_concurrency}, per novel {self.per_novel_concurrency})")
+        task_limiter = asyncio.Semaphore(self.max_concurrency)
+        novel_slots = asyncio.Semaphore(self.max_active_novels)
+
+        async def run_novel(entry: Dict[str, str]) -> Dict[str, Any]:
+            async with novel_slots:
+                try:
+                    started = time.monotonic()
+                    workflow = self._create_workflow(entry)
+                    await workflow.astart_workflow(resume=resume, task_limiter=task_limiter)
+                    return self._novel_result(entry, workflow, started)
+                except Exception as e:
+                    return self._failed(entry, e)
+
+        results = await asyncio.gather(*(run_novel(entry) for entry in prompts))
+        return self._finish(list(results))
+
+    @staticmethod
+    def _validate(prompts: List[Dict[str, str]]):
+        """在开始任何一部小说之前检查全部 id，不合法的 id（可能指向数据目录之外）直接拒绝整个批次。"""
+        for entry in prompts:
+            validate_namespace(entry["id"])
+
+    def _run_novel(self, entry: Dict[str, str], task_executor, resume: bool) -> Dict[str, Any]:
+        started = time.monotonic()
+        workflow = self._create_workflow(entry, task_executor)
+        workflow.start_workflow(resume=resume)
+        return self._novel_result(entry, workflow, started)
+
+    def _create_workflow(self, entry: Dict[str, str], task_executor=None) -> CreativeWorkflow:
+        return CreativeWorkflow(entry["prompt"], self.storage.namespace(entry["id"]), self.llm,
+                                max_concurrency=self.per_novel_concurrency, executor=task_executor,
+                                context_token_budget=self.context_token_budget, pipelined=self.pipelined,
+                                snapshot_format=self.snapshot_format, job_queue=self.job_queue,
+                                scenes_per_chapter=self.scenes_per_chapter, job_timeout=self.job_timeout)
+
+    def _novel_result(self, entry: Dict[str, str], workflow: CreativeWorkflow, started: float) -> Dict[str, Any]:
+        progress = workflow.story_state_manager.overall_progress
+        totals = workflow.metrics.summary()["totals"]
+        return {
+            "id": entry["id"],
+            "prompt": entry["prompt"],
+            "status": progress.get("status"),
+            "chapters_written": progress.get("chapters_written", 0),
+            "total_chapters": progress.get("total_chapters", 0),
+            "path": workflow.storage.base_path,
+            "seconds": round(time.monotonic() - started, 2),
+            "llm_calls": totals["llm_calls"],
+            "prompt_tokens": totals["prompt_tokens"],
+            "completion_tokens": totals["completion_tokens"],
+        }
+
+    @staticmethod
+    def _failed(entry: Dict[str, str], error: Exception) -> Dict[str, Any]:
+        logging.error(f"[Batch] Novel {entry['id']} failed: {error}")
+        return {"id": entry["id"], "prompt": entry["prompt"], "status": "failed", "error": str(error)}
+
+    def _finish(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        results.sort(key=lambda r: r["id"])
+        self.storage.save_data("batch_summary.json", {"novels": results})
+        completed = sum(1 for r in results if r["status"] == "completed")
+        logging.info(f"[Batch] Finished: {completed}/{len(results)} novels completed")
+        return results
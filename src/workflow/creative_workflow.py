@@ -1,87 +1,423 @@
 # src/workflow/creative_workflow.py
 
+import asyncio
 import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from src.agent_manager import AgentManager
-from src.story import StoryStateManager, CollaborationProtocol
+from src.metrics import MetricsRecorder, agent_scope
+from src.llm_metrics import InstrumentedLLMClient
+from src.story import StoryStateManager, CollaborationProtocol, StoryContextManager
 from src.workflow.task_queue import TaskQueue
+from src.workflow.durable_queue import DurableTaskQueue
+from src.workflow.worker import RemoteAgent
+from src.export import parse_chapter_selection
 from src.persistence import FileStorage
-from typing import Dict, Any
+from typing import Dict, Any, Callable, Iterable, List, Set, Union
 
 class CreativeWorkflow:
-    def __init__(self, initial_prompt: str, storage: FileStorage, llm):
-        self.agent_manager = AgentManager(llm)
-        self.story_state_manager = StoryStateManager(storage)
+    def __init__(self, initial_prompt: str, storage: FileStorage, llm, max_concurrency: int = 1,
+                 stream_chapters: bool = False, on_chapter_chunk: Callable[[int, str], None] = None,
+                 executor: Executor = None, context_token_budget: int = 1500, pipelined: bool = False,
+                 snapshot_format: str = None, job_queue: DurableTaskQueue = None, scenes_per_chapter: int = 0,
+                 job_timeout: float = None):
+        # 记录本次运行每次 LLM 调用和每个任务的耗时与 token 用量，结束时写入 metrics/<run_id>.json（每次运行一个文件）
+        self.metrics = MetricsRecorder()
+        self.agent_manager = AgentManager(InstrumentedLLMClient(llm, self.metrics))
+        # 快照编码："json" 或 "msgpack"；为空时沿用已有快照的格式（默认 JSON）
+        self.story_state_manager = StoryStateManager(storage, snapshot_format=snapshot_format)
         self.collaboration_protocol = CollaborationProtocol()
         self.task_queue = TaskQueue()
         self.initial_prompt = initial_prompt
         self.storage = storage
+        # 同时在途的章节任务上限；1 表示按顺序执行
+        self.max_concurrency = max(1, max_concurrency)
+        # 流式生成章节：增量写入 drafts/ 下的章节草稿文件，并通过 on_chapter_chunk(章节序号, 增量文本) 回调
+        self.stream_chapters = stream_chapters
+        self.on_chapter_chunk = on_chapter_chunk
+        # 共享线程池（批量创作时多部小说共用）；为空时每次运行创建自己的线程池
+        self.executor = executor
+        # 前情上下文：每章提示词中滚动摘要的 token 预算（0 表示不提供前情）
+        self.context_manager = StoryContextManager(self.story_state_manager, self.collaboration_protocol,
+                                                   token_budget=context_token_budget)
+        # 流水线模式：大纲流式输出时逐章登记章节任务，角色逐个产出，每章在它涉及的角色就绪后立即开始，
+        # 而不必等待全部角色生成完毕
+        self.pipelined = pipelined
+        # 智能体在工作线程中回调产生的事件，由主循环统一处理（任务队列和状态只在主循环中修改）
+        self._events: List[tuple] = []
+        self._events_lock = threading.Lock()
+        self._wakeup = None
+        self._wake: Callable[[], None] = lambda: None
+        # 提前登记的章节所依赖、尚未产出的角色键（character:<name>）
+        self._character_keys: Set[str] = set()
+        # 分场景模式：每章先拆成这么多个场景并行生成再拼接（0 或 1 表示整章一次生成）
+        self.scenes_per_chapter = scenes_per_chapter
+        # 分布式模式：章节任务提交到持久化队列，由 worker 进程（可在其他机器上）执行；
+        # 本进程仍负责任务调度、前情上下文和全部状态写入；job_timeout 秒内没有 worker 完成的章节记为失败
+        self.job_queue = job_queue
+        if job_queue is not None:
+            self.agent_manager.agents["chapter_agent"] = RemoteAgent(job_queue, "chapter_agent",
+                                                                     namespace=os.path.normpath(storage.base_path),
+                                                                     timeout=job_timeout)
+            if stream_chapters:
+                logging.warning("[Workflow] Chapters run on queue workers; --stream output is not available.")
 
-    def start_workflow(self):
+    def start_workflow(self, resume: bool = False):
+        """运行创作流程。resume=True 时先加载快照并重放日志，跳过已完成的大纲/角色/章节步骤。"""
+        self._begin_run(resume)
+        self._run_tasks()
+        self._finish_run()
+
+    async def astart_workflow(self, resume: bool = False, task_limiter: asyncio.Semaphore = None):
+        """start_workflow 的异步版本：每个任务是事件循环上的一个协程，在途的 LLM 调用不占用线程。
+
+        task_limiter 为多个工作流共享的信号量（批量创作时限制全局在途任务数）。
+        状态写入仍在事件循环中同步完成（每次只是一个小文件的追加/替换）。
+        """
+        self._begin_run(resume)
+        await self._arun_tasks(task_limiter)
+        self._finish_run()
+
+    def regenerate_chapters(self, chapters: Union[str, Iterable[int]]) -> Dict[int, bool]:
+        """只重新生成指定章节（例如 [17] 或 "3-10,17"），不重跑大纲和角色。
+
+        从已保存的状态加载大纲和角色，只改写所选章节的正文文件和摘要，其他章节不变。
+        max_concurrency > 1 时所选章节并行生成（各章的前情使用生成前已有的相邻章节）；
+        为 1 时按顺序生成，后一章的前情会用到前一章的新内容。
+        返回 {章节序号: 是否成功}；失败的章节保留原有内容。
+        """
+        indices = self._begin_regeneration(chapters)
+        self._run_tasks()
+        self._finish_run()
+        return {index: self.task_queue.is_completed(f"chapter:{index}") for index in indices}
+
+    async def aregenerate_chapters(self, chapters: Union[str, Iterable[int]],
+                                   task_limiter: asyncio.Semaphore = None) -> Dict[int, bool]:
+        """regenerate_chapters 的异步版本。"""
+        indices = self._begin_regeneration(chapters)
+        await self._arun_tasks(task_limiter)
+        self._finish_run()
+        return {index: self.task_queue.is_completed(f"chapter:{index}") for index in indices}
+
+    def _run_tasks(self):
+        """在线程池中执行任务队列，直到没有就绪或在途的任务。"""
+        executor_scope = nullcontext(self.executor) if self.executor else ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="workflow")
+        with executor_scope as executor:
+            self._wakeup = Future()
+            self._wake = lambda: self._wakeup.done() or self._wakeup.set_result(None)
+            in_flight = {}
+            while self.task_queue.has_ready() or in_flight:
+                # 依赖已满足的任务一就绪就提交到线程池（受 max_concurrency 限制）
+                while self.task_queue.has_ready() and len(in_flight) < self.max_concurrency:
+                    job = self._next_job()
+                    if not job: continue
+                    key, agent_name, agent, task_details, ready_at = job
+                    future = executor.submit(self._run_task, agent, agent_name, key, task_details, ready_at)
+                    in_flight[future] = (key, agent_name, task_details)
+
+                if not in_flight:
+                    continue
+
+                # 等待任意一个在途任务完成（或有智能体事件到达），结果统一在主线程写入状态
+                done, _ = wait([*in_flight, self._wakeup], return_when=FIRST_COMPLETED)
+                self._handle_events(Future)
+                for future in done:
+                    if future in in_flight:
+                        self._complete_job(*in_flight.pop(future), future)
+
+    async def _arun_tasks(self, task_limiter: asyncio.Semaphore = None):
+        """_run_tasks 的异步版本：每个任务是事件循环上的一个协程。"""
+        loop = asyncio.get_running_loop()
+        self._wakeup = loop.create_future()
+        self._wake = lambda: loop.call_soon_threadsafe(lambda: self._wakeup.done() or self._wakeup.set_result(None))
+        in_flight = {}
+        while self.task_queue.has_ready() or in_flight:
+            while self.task_queue.has_ready() and len(in_flight) < self.max_concurrency:
+                job = self._next_job()
+                if not job: continue
+                key, agent_name, agent, task_details, ready_at = job
+                future = asyncio.ensure_future(self._arun_task(agent, agent_name, key, task_details, ready_at, task_limiter))
+                in_flight[future] = (key, agent_name, task_details)
+
+            if not in_flight:
+                continue
+
+            done, _ = await asyncio.wait([*in_flight, self._wakeup], return_when=asyncio.FIRST_COMPLETED)
+            self._handle_events(loop.create_future)
+            for future in done:
+                if future in in_flight:
+                    self._complete_job(*in_flight.pop(future), future)
+
+    def _begin_run(self, resume: bool):
         logging.info(f"--- Starting Creative Workflow with prompt: '{self.initial_prompt}' ---")
 
+        if resume:
+            self.story_state_manager.load_state()
+        else:
+            # 全新创作：用空状态覆盖旧快照并清空旧日志
+            self.story_state_manager.save_state()
+            if self.job_queue is not None:
+                # 队列中上一次创作遗留的章节任务和未取回的结果属于旧小说，不能复用
+                purged = self.agent_manager.get_agent("chapter_agent").purge()
+                if purged:
+                    logging.info(f"[Workflow] Discarded {purged} queued jobs left over from a previous run.")
+
         # Step 1: Outline Generation
-        logging.info("[Workflow] Step 1: Outline Generation")
-        outline_task = {"name": "Generate Novel Outline", "description": f"根据提示 '{self.initial_prompt}' 生成小说大纲"}
-        self.task_queue.add_task({"agent": "outline_agent", "task": outline_task})
+        if self.story_state_manager.outline:
+            logging.info("[Workflow] Step 1: Outline already generated, skipping.")
+            self.task_queue.mark_completed("outline")
+            self._schedule_after_outline(self.story_state_manager.outline)
+        else:
+            logging.info("[Workflow] Step 1: Outline Generation")
+            outline_task = {"name": "Generate Novel Outline", "description": f"根据提示 '{self.initial_prompt}' 生成小说大纲"}
+            self.task_queue.add_task({"key": "outline", "agent": "outline_agent", "task": outline_task})
 
-        while not self.task_queue.is_empty():
-            current_job = self.task_queue.get_next_task()
-            if not current_job: continue
+    def _begin_regeneration(self, chapters: Union[str, Iterable[int]]) -> List[int]:
+        """加载已保存的状态，并只为所选章节安排任务。返回要重新生成的章节序号。"""
+        self.metrics.name = "regenerate"
+        self.story_state_manager.load_state()
+        outline = self.story_state_manager.outline
+        if not outline or not outline.get("chapters"):
+            raise ValueError("No saved outline found; run `start` first.")
+        total = len(outline["chapters"])
+        indices = parse_chapter_selection(chapters, total) if isinstance(chapters, str) else sorted(set(chapters))
+        invalid = [index for index in indices if not 1 <= index <= total]
+        if invalid or not indices:
+            raise ValueError(f"Invalid chapter selection {chapters!r}: the outline has chapters 1-{total}.")
 
-            agent_name = current_job["agent"]
-            task_details = current_job["task"]
+        logging.info(f"--- Regenerating chapters {indices} of '{outline.get('title', 'N/A')}' ---")
+        self.collaboration_protocol.share_information("OutlineAgent", "novel_outline", outline)
+        characters = list(self.story_state_manager.current_story_elements.characters.values())
+        if not characters:
+            logging.warning("[Workflow] No saved characters; chapters will be written without character profiles.")
+        self.collaboration_protocol.share_information("CharacterAgent", "novel_characters", characters)
+        self.task_queue.mark_completed("outline")
+        self.task_queue.mark_completed("characters")
+        for index in indices:
+            self.task_queue.add_task(self._chapter_task(index, outline["chapters"][index - 1], []))
+        return indices
 
-            agent = self.agent_manager.get_agent(agent_name)
-            if agent:
-                result = agent.execute_task(task_details)
-                if result["status"] == "completed":
-                    if agent_name == "outline_agent":
-                        outline = result["result"]
-                        self.story_state_manager.update_progress("outline_generated", True)
-                        self.story_state_manager.set_total_chapters(len(outline["chapters"]))
-                        self.collaboration_protocol.share_information("OutlineAgent", "novel_outline", outline)
-                        logging.info("[Workflow] Outline generated.")
-
-                        # Step 2: Character Generation
-                        logging.info("[Workflow] Step 2: Character Generation")
-                        character_task = {"name": "Generate Novel Characters", "prompt": self.initial_prompt, "outline": outline}
-                        self.task_queue.add_task({"agent": "character_agent", "task": character_task})
-
-                        logging.info("[Workflow] Proceeding to Character Generation.")
-
-                        # Step 3: Chapter Generation (add tasks to queue)
-                        logging.info("[Workflow] Step 3: Chapter Generation")
-                        for i, chapter_info in enumerate(outline["chapters"]):
-                            chapter_task = {"name": f"Write Chapter {i+1}", "description": f"创作章节: {chapter_info['title']}", "chapter_info": chapter_info}
-                            self.task_queue.add_task({"agent": "chapter_agent", "task": chapter_task})
-
-                    elif agent_name == "character_agent":
-                        characters = result["result"]
-                        self.story_state_manager.update_elements({"characters": characters})
-                        logging.info(f"[Workflow] Generated {len(characters)} characters. Proceeding to Chapter Generation.")
-
-                        # Now, re-add chapter generation tasks, potentially with character context
-                        outline = self.collaboration_protocol.get_information("novel_outline")
-                        if outline:
-                            logging.info("[Workflow] Resuming Chapter Generation with Character Context")
-                            for i, chapter_info in enumerate(outline["chapters"]):
-                                chapter_task = {"name": f"Write Chapter {i+1}", "description": f"创作章节: {chapter_info['title']}", "chapter_info": chapter_info, "characters": characters}
-                                self.task_queue.add_task({"agent": "chapter_agent", "task": chapter_task})
-                        else:
-                            logging.error("[Workflow] Error: Outline not found for chapter generation after character generation.")
-
-                    elif agent_name == "chapter_agent":
-                        chapter_content = result["result"]
-                        chapter_info = task_details["chapter_info"]
-                        chapter_index = self.story_state_manager.overall_progress["chapters_written"] + 1 # Simple increment
-                        self.story_state_manager.add_chapter_content(chapter_index, chapter_content)
-                        logging.info(f"[Workflow] Chapter '{chapter_info['title']}' written.")
-
-                else:
-                    logging.error(f"[Workflow] Task failed for {agent_name}: {result['message']}")
-            else:
-                logging.warning(f"[Workflow] Agent {agent_name} not found.")
+    def _next_job(self):
+        """取出下一个就绪任务并准备好上下文，返回 (key, agent_name, agent, task_details, ready_at)；没有可执行的任务时返回 None。"""
+        current_job = self.task_queue.get_next_task()
+        if not current_job:
+            return None
+
+        key = current_job["key"]
+        agent_name = current_job["agent"]
+        agent = self.agent_manager.get_agent(agent_name)
+        if not agent:
+            logging.warning(f"[Workflow] Agent {agent_name} not found.")
+            self.task_queue.mark_failed(key)
+            return None
+        task_details = self._prepare_task(agent_name, current_job["task"])
+        return key, agent_name, agent, task_details, current_job.get("ready_at", time.monotonic())
 
+    def _complete_job(self, key: str, agent_name: str, task_details: Dict[str, Any], future):
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {"status": "failed", "message": str(e)}
+        if self._handle_result(agent_name, task_details, result):
+            self.task_queue.mark_completed(key)
+        else:
+            self.task_queue.mark_failed(key)
+
+    def _finish_run(self):
+        if not self.task_queue.is_empty():
+            logging.error(f"[Workflow] Tasks left unscheduled (unresolved dependencies): {self.task_queue.blocked_tasks()}")
+
+        # 只有大纲已生成且全部章节都已写完才算完成；大纲失败时两个计数都是 0，不能据此判断
+        progress = self.story_state_manager.overall_progress
+        if not progress.get("outline_generated"):
+            status = "failed"
+        elif progress.get("total_chapters", 0) > 0 and progress.get("chapters_written") == progress.get("total_chapters"):
+            status = "completed"
+        else:
+            status = "incomplete"
+        self.story_state_manager.update_progress("status", status)
+        if status != "completed":
+            logging.warning(f"[Workflow] Run ended with status '{status}': "
+                            f"{progress.get('chapters_written', 0)}/{progress.get('total_chapters', 0)} chapters written.")
         logging.info("--- Creative Workflow Completed ---")
         logging.info(f"Final Story State: {self.story_state_manager.get_current_state()}")
-        self.story_state_manager.save_state() # Save state at the end of workflow
\ No newline at end of file
+        self.story_state_manager.save_state() # Save state at the end of workflow
+        self.metrics.finish()
+        self.metrics.save(self.storage)
+        totals = self.metrics.summary()["totals"]
+        logging.info(f"[Workflow] LLM calls: {totals['llm_calls']} ({totals['cache_hits']} cached), "
+                     f"tokens: {totals['prompt_tokens']} prompt / {totals['completion_tokens']} completion")
+
+    def _run_task(self, agent, agent_name: str, key: str, task_details: Dict[str, Any], ready_at: float) -> Dict[str, Any]:
+        """在工作线程中执行任务，并记录排队等待和执行耗时；任务内的 LLM 调用记在该智能体名下。"""
+        started = time.monotonic()
+        try:
+            with agent_scope(agent_name):
+                result = agent.execute_task(task_details)
+        except Exception as e:
+            result = {"status": "failed", "message": str(e)}
+        self.metrics.record_task(agent_name, key, started - ready_at, time.monotonic() - started, result.get("status", "failed"))
+        return result
+
+    async def _arun_task(self, agent, agent_name: str, key: str, task_details: Dict[str, Any], ready_at: float,
+                         task_limiter: asyncio.Semaphore = None) -> Dict[str, Any]:
+        async with task_limiter or nullcontext():
+            started = time.monotonic()
+            try:
+                with agent_scope(agent_name):
+                    result = await agent.aexecute_task(task_details)
+            except Exception as e:
+                result = {"status": "failed", "message": str(e)}
+        self.metrics.record_task(agent_name, key, started - ready_at, time.monotonic() - started, result.get("status", "failed"))
+        return result
+
+    def _prepare_task(self, agent_name: str, task_details: Dict[str, Any]) -> Dict[str, Any]:
+        """在任务派发前注入其依赖产出的上下文。"""
+        if self.pipelined and agent_name == "outline_agent":
+            task_details = {**task_details, "on_chapter": lambda i, info: self._post_event(("outline_chapter", i, info))}
+        elif self.pipelined and agent_name == "character_agent":
+            task_details = {**task_details, "on_character": lambda character: self._post_event(("character", character))}
+        elif agent_name == "chapter_agent":
+            if self.pipelined:
+                # 流式阶段登记的章节以最终（可能经过修复的）大纲为准
+                chapters = (self.story_state_manager.outline or {}).get("chapters", [])
+                if task_details["chapter_index"] <= len(chapters):
+                    task_details = {**task_details, "chapter_info": chapters[task_details["chapter_index"] - 1]}
+            characters = self.collaboration_protocol.get_context("novel_characters") or []
+            task_details = {**task_details, "characters": characters,
+                            "story_context": self.context_manager.build_context(task_details["chapter_index"], task_details["chapter_info"], characters)}
+            if self.scenes_per_chapter > 1:
+                task_details["scenes"] = self.scenes_per_chapter
+            if self.stream_chapters:
+                chapter_index = task_details["chapter_index"]
+                task_details["stream_path"] = self.storage.get_path(f"drafts/chapter_{chapter_index:04d}.txt")
+                if self.on_chapter_chunk:
+                    task_details["on_chunk"] = lambda delta: self.on_chapter_chunk(chapter_index, delta)
+        return task_details
+
+    def _handle_result(self, agent_name: str, task_details: Dict[str, Any], result: Dict[str, Any]) -> bool:
+        if result["status"] != "completed":
+            logging.error(f"[Workflow] Task failed for {agent_name}: {result['message']}")
+            if agent_name == "character_agent":
+                # 与非流水线模式一致：角色生成失败时，仍在等待角色的章节一并取消
+                for key in self._character_keys:
+                    if not self.task_queue.is_completed(key):
+                        self.task_queue.mark_failed(key)
+                self._character_keys.clear()
+            return False
+
+        if agent_name == "outline_agent":
+            outline = result["result"]
+            self.story_state_manager.checkpoint({"step": "outline", "outline": outline})
+            logging.info("[Workflow] Outline generated.")
+            self._cancel_extra_chapters(outline)
+            self._schedule_after_outline(outline)
+
+        elif agent_name == "character_agent":
+            characters = result["result"]
+            self.story_state_manager.checkpoint({"step": "characters", "characters": [c.to_dict() for c in characters]})
+            self.collaboration_protocol.share_information("CharacterAgent", "novel_characters", characters)
+            logging.info(f"[Workflow] Generated {len(characters)} characters. Proceeding to Chapter Generation.")
+            self._release_character_dependencies()
+
+        elif agent_name == "chapter_agent":
+            chapter_content = result["result"]
+            chapter_info = task_details["chapter_info"]
+            # 按大纲中的位置写入，而不是按完成顺序计数（并发时完成顺序不确定）
+            chapter_index = task_details["chapter_index"]
+            self.story_state_manager.checkpoint({"step": "chapter", "index": chapter_index, "content": chapter_content})
+            if self.job_queue is not None:
+                self.agent_manager.get_agent("chapter_agent").acknowledge(task_details)
+            self.context_manager.on_chapter_written(chapter_index, chapter_content)
+            logging.info(f"[Workflow] Chapter {chapter_index} '{chapter_info['title']}' written.")
+
+        return True
+
+    def _schedule_after_outline(self, outline: Dict[str, Any]):
+        """大纲就绪后安排角色和章节任务，已完成的步骤（恢复模式下）直接跳过。"""
+        self.collaboration_protocol.share_information("OutlineAgent", "novel_outline", outline)
+
+        # Step 2: Character Generation (depends on outline)
+        existing_characters = list(self.story_state_manager.current_story_elements.characters.values())
+        if existing_characters:
+            logging.info("[Workflow] Step 2: Characters already generated, skipping.")
+            self.collaboration_protocol.share_information("CharacterAgent", "novel_characters", existing_characters)
+            self.task_queue.mark_completed("characters")
+        else:
+            logging.info("[Workflow] Step 2: Character Generation")
+            character_task = {"name": "Generate Novel Characters", "prompt": self.initial_prompt, "outline": outline}
+            self.task_queue.add_task({"key": "characters", "agent": "character_agent", "task": character_task, "depends_on": ["outline"]})
+
+        # Step 3: Chapter Generation (depends on characters), earlier chapters first
+        logging.info("[Workflow] Step 3: Chapter Generation (scheduled after characters)")
+        for i, chapter_info in enumerate(outline["chapters"]):
+            if i + 1 in self.story_state_manager.chapters_content:
+                continue
+            self.task_queue.add_task(self._chapter_task(i + 1, chapter_info, ["characters"]))
+
+    @staticmethod
+    def _chapter_task(chapter_index: int, chapter_info: Dict[str, Any], depends_on: List[str]) -> Dict[str, Any]:
+        """章节任务，按章节顺序排优先级（前面的章节先写）。"""
+        chapter_task = {"name": f"Write Chapter {chapter_index}", "description": f"创作章节: {chapter_info['title']}",
+                        "chapter_info": chapter_info, "chapter_index": chapter_index}
+        return {"key": f"chapter:{chapter_index}", "agent": "chapter_agent", "task": chapter_task,
+                "depends_on": depends_on, "priority": chapter_index}
+
+    # ---- 流水线模式 ----
+
+    def _post_event(self, event: tuple):
+        """智能体回调（在工作线程或任务协程中）：事件排队并唤醒主循环。"""
+        with self._events_lock:
+            self._events.append(event)
+            self._wake()
+
+    def _handle_events(self, new_wakeup: Callable[[], Any]):
+        """在主循环中处理已到达的事件。必须在处理已完成任务之前调用，
+        这样一个任务的所有事件总是先于它的结果被处理。"""
+        with self._events_lock:
+            events, self._events = self._events, []
+            if self._wakeup.done():
+                self._wakeup = new_wakeup()
+        for event in events:
+            if event[0] == "outline_chapter":
+                self._schedule_chapter_early(event[1], event[2])
+            elif event[0] == "character":
+                self._on_character(event[1])
+
+    def _schedule_chapter_early(self, i: int, chapter_info: Dict[str, Any]):
+        """大纲流式输出中解析出一章：立即登记章节任务，依赖大纲完成以及该章列出的角色。"""
+        if i + 1 in self.story_state_manager.chapters_content:
+            return
+        names = [name for name in chapter_info.get("characters", []) if isinstance(name, str) and name.strip()]
+        character_keys = [self._character_key(name) for name in names]
+        self._character_keys.update(character_keys)
+        self.task_queue.add_task(self._chapter_task(i + 1, chapter_info, ["outline"] + (character_keys or ["characters"])))
+
+    def _on_character(self, character):
+        """角色流式输出中解析出一个角色：加入共享角色列表，释放只等待该角色的章节。"""
+        # 读-改-写在总线内原子完成；已取得旧列表的章节任务不受影响（写时复制）
+        self.collaboration_protocol.update("CharacterAgent", "novel_characters",
+                                           lambda characters: [*(characters or []), character])
+        self.task_queue.mark_completed(self._character_key(character.name))
+
+    def _release_character_dependencies(self):
+        """角色生成完成：大纲中提到但没有生成的角色不再等待。"""
+        for key in self._character_keys:
+            if not self.task_queue.is_completed(key):
+                self.task_queue.mark_completed(key)
+        self._character_keys.clear()
+
+    def _cancel_extra_chapters(self, outline: Dict[str, Any]):
+        """经过修复的最终大纲章节数可能少于流式阶段登记的章节，取消多出的章节任务。"""
+        total = len(outline["chapters"])
+        for key in self.task_queue.pending_keys():
+            if key.startswith("chapter:") and int(key.split(":", 1)[1]) > total:
+                logging.warning(f"[Workflow] Cancelled {key}: not in the final outline")
+                self.task_queue.mark_failed(key)
+
+    @staticmethod
+    def _character_key(name: str) -> str:
+        return f"character:{name.strip().lower()}"
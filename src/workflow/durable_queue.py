@@ -0,0 +1,208 @@
+# src/workflow/durable_queue.py
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Any, Optional, Sequence
+
+TASK_QUEUE_FILENAME = "task_queue.sqlite"
+
+PENDING, LEASED, COMPLETED, FAILED = "pending", "leased", "completed", "failed"
+
+class DurableTaskQueue:
+    """保存在 SQLite 文件中的持久化任务队列，多个进程（或共享存储上的多台机器）可以同时从中领取任务。
+
+    - 协调进程（CreativeWorkflow）用 enqueue 提交已就绪的任务，依赖关系仍由内存中的 TaskQueue 处理；
+    - worker 用 lease 领取任务，得到一个租约令牌，执行期间用 heartbeat 续租；
+    - 租约过期（worker 崩溃或失联）的任务会重新投递给其他 worker，超过 max_attempts 次后标记失败；
+    - complete / fail 只接受当前租约的令牌，被重新投递后旧 worker 迟到的结果会被丢弃；
+    - 结果保存在队列中直到协调进程 collect，协调进程崩溃后重新提交同一任务会直接拿到已完成的结果。
+
+    每次操作都在一个短事务（BEGIN IMMEDIATE）中完成。使用默认的回滚日志而不是 WAL，
+    以便放在支持文件锁的网络共享存储上。
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 120.0, max_attempts: int = 3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # 自动提交模式，事务由 _transaction 显式开始；timeout 为等待其他进程释放写锁的秒数
+        self._conn = sqlite3.connect(path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " key TEXT PRIMARY KEY, agent TEXT NOT NULL, payload TEXT NOT NULL, priority INTEGER NOT NULL DEFAULT 0,"
+            " status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+            " lease_owner TEXT, lease_token TEXT, lease_expires REAL,"
+            " result TEXT, error TEXT, collected INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, priority, created_at)")
+
+    # ---- 协调进程 ----
+
+    def enqueue(self, key: str, agent: str, payload: Dict[str, Any], priority: int = 0) -> bool:
+        """提交任务。同一个键、相同内容的任务已在排队、执行中或已完成但未 collect 时保持原状并返回 False；
+        已 collect、已失败或内容不同（例如另一部小说遗留的任务）的旧任务会被新任务替换。"""
+        now = time.time()
+        encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        with self._transaction() as conn:
+            row = conn.execute("SELECT status, collected, payload FROM jobs WHERE key = ?", (key,)).fetchone()
+            if row is not None and (row[0] in (PENDING, LEASED) or (row[0] == COMPLETED and not row[1])):
+                if row[2] == encoded:
+                    return False
+                # 旧任务的租约令牌随之作废，执行它的 worker 迟到的结果会被丢弃
+                logging.warning(f"[DurableQueue] Replacing stale job {key} ({row[0]}) with a different payload")
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (key, agent, payload, priority, status, attempts, collected, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, 0, 0, ?, ?)",
+                (key, agent, encoded, priority, PENDING, now, now),
+            )
+            return True
+
+    def purge(self, prefix: str) -> int:
+        """删除键以 prefix 开头的全部任务（重新开始创作一部小说时丢弃它的旧任务），返回删除的任务数。"""
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM jobs WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+            return cursor.rowcount
+
+    def outcome(self, key: str) -> Optional[Dict[str, Any]]:
+        """任务已结束时返回 {"status": "completed"/"failed", "result": ..., "error": ...}，否则返回 None。"""
+        with self._lock:
+            row = self._conn.execute("SELECT status, result, error FROM jobs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown job: {key}")
+        if row[0] not in (COMPLETED, FAILED):
+            return None
+        return {"status": row[0], "result": json.loads(row[1]) if row[1] is not None else None, "error": row[2]}
+
+    def wait(self, key: str, timeout: Optional[float] = None, poll_interval: float = 0.2) -> Optional[Dict[str, Any]]:
+        """阻塞直到任务结束并返回 outcome；超时返回 None。跨进程没有通知机制，按 poll_interval 查询。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            outcome = self.outcome(key)
+            if outcome is not None:
+                return outcome
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+
+    def collect(self, key: str):
+        """协调进程已保存结果：之后再提交同一个键会重新执行。"""
+        with self._transaction() as conn:
+            conn.execute("UPDATE jobs SET collected = 1, updated_at = ? WHERE key = ?", (time.time(), key))
+
+    # ---- worker ----
+
+    def lease(self, owner: str, agents: Optional[Sequence[str]] = None) -> Optional[Dict[str, Any]]:
+        """领取优先级最高的待执行任务（包括租约已过期的任务）。
+        返回 {"key", "agent", "payload", "token", "attempts"}；没有任务时返回 None。"""
+        agent_filter, params = "", []
+        if agents:
+            agent_filter = f" AND agent IN ({', '.join('?' * len(agents))})"
+            params = list(agents)
+        while True:
+            now = time.time()
+            with self._transaction() as conn:
+                row = conn.execute(
+                    "SELECT key, agent, payload, status, attempts FROM jobs"
+                    f" WHERE (status = ? OR (status = ? AND lease_expires < ?)){agent_filter}"
+                    " ORDER BY priority, created_at LIMIT 1",
+                    [PENDING, LEASED, now, *params],
+                ).fetchone()
+                if row is None:
+                    return None
+                key, agent, payload, status, attempts = row
+                if status == LEASED:
+                    logging.warning(f"[DurableQueue] Lease on {key} expired; re-delivering (attempt {attempts + 1})")
+                if attempts >= self.max_attempts:
+                    conn.execute("UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, lease_token = NULL,"
+                                 " lease_expires = NULL, updated_at = ? WHERE key = ?",
+                                 (FAILED, f"Abandoned after {attempts} attempts", now, key))
+                    continue
+                token = uuid.uuid4().hex
+                conn.execute("UPDATE jobs SET status = ?, attempts = attempts + 1, lease_owner = ?, lease_token = ?,"
+                             " lease_expires = ?, updated_at = ? WHERE key = ?",
+                             (LEASED, owner, token, now + self.lease_seconds, now, key))
+                return {"key": key, "agent": agent, "payload": json.loads(payload), "token": token, "attempts": attempts + 1}
+
+    def heartbeat(self, key: str, token: str) -> bool:
+        """续租。租约已失效（过期后被其他 worker 领取）时返回 False。"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE key = ? AND lease_token = ? AND status = ?",
+                                  (now + self.lease_seconds, now, key, token, LEASED))
+            return cursor.rowcount == 1
+
+    def complete(self, key: str, token: str, result: Any) -> bool:
+        """保存结果。租约已失效时不写入并返回 False。"""
+        return self._finish(key, token, COMPLETED, json.dumps(result, ensure_ascii=False), None)
+
+    def fail(self, key: str, token: str, error: str, retry: bool = False) -> bool:
+        """报告失败。retry=True 且未超过 max_attempts 时重新排队，否则标记失败。"""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT attempts FROM jobs WHERE key = ? AND lease_token = ? AND status = ?",
+                               (key, token, LEASED)).fetchone()
+            if row is None:
+                return False
+            status = PENDING if retry and row[0] < self.max_attempts else FAILED
+            conn.execute("UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, lease_token = NULL,"
+                         " lease_expires = NULL, updated_at = ? WHERE key = ?", (status, error, time.time(), key))
+            return True
+
+    def release(self, key: str, token: str) -> bool:
+        """worker 正常退出时归还未完成的任务，不计入尝试次数。"""
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE jobs SET status = ?, attempts = MAX(attempts - 1, 0), lease_owner = NULL,"
+                                  " lease_token = NULL, lease_expires = NULL, updated_at = ? WHERE key = ? AND lease_token = ? AND status = ?",
+                                  (PENDING, time.time(), key, token, LEASED))
+            return cursor.rowcount == 1
+
+    def counts(self) -> Dict[str, int]:
+        """各状态的任务数（已 collect 的不计）。"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs WHERE collected = 0 GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _finish(self, key: str, token: str, status: str, result: Optional[str], error: Optional[str]) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, lease_owner = NULL, lease_token = NULL,"
+                                  " lease_expires = NULL, updated_at = ? WHERE key = ? AND lease_token = ? AND status = ?",
+                                  (status, result, error, time.time(), key, token, LEASED))
+            return cursor.rowcount == 1
+
+    def _transaction(self):
+        return _Transaction(self._conn, self._lock)
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT（异常时 ROLLBACK）；同一个连接在进程内由锁串行化。"""
+    __slots__ = ("conn", "lock")
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock):
+        self.conn = conn
+        self.lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.lock.acquire()
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.lock.release()
+            raise
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.lock.release()
+        return False
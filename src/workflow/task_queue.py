@@ -1,29 +1,120 @@
 # src/workflow/task_queue.py
 
-from collections import deque
-from typing import Dict, Any
+import heapq
+import itertools
+import logging
+import time
+from typing import Dict, Any, List, Set
 
 class TaskQueue:
+    """带依赖关系的任务调度队列。
+
+    每个任务可以携带以下可选字段：
+    - key: 任务唯一键，用于去重（默认使用 name）
+    - depends_on: 依赖的任务键列表，所有依赖完成后任务才会就绪
+    - priority: 优先级，数值越小越先执行（默认 0），同优先级按加入顺序
+    """
+
     def __init__(self):
-        self.queue = deque()
+        self._ready: List = []                         # 就绪任务堆：(priority, seq, key)
+        self._blocked: Dict[str, Dict[str, Any]] = {}  # 等待依赖完成的任务
+        self._tasks: Dict[str, Dict[str, Any]] = {}    # 所有待执行（就绪或阻塞）的任务
+        self._dependents: Dict[str, Set[str]] = {}     # 依赖键 -> 依赖它的任务键
+        self._running: Set[str] = set()
+        self._completed: Set[str] = set()
+        self._failed: Set[str] = set()
+        self._seq = itertools.count()
+
+    @staticmethod
+    def task_key(task: Dict[str, Any]) -> str:
+        return task.get("key") or task.get("name") or task.get("task", {}).get("name", "Unnamed Task")
+
+    def add_task(self, task: Dict[str, Any]) -> bool:
+        """添加一个任务到队列。键已存在（待执行、执行中或已完成）时忽略并返回 False。"""
+        key = self.task_key(task)
+        if key in self._tasks or key in self._running or key in self._completed or key in self._failed:
+            logging.debug(f"[TaskQueue] Skipped duplicate task: {key}")
+            return False
 
-    def add_task(self, task: Dict[str, Any]):
-        """添加一个任务到队列。"""
-        self.queue.append(task)
-        print(f"[TaskQueue] Added task: {task.get('name', 'Unnamed Task')}")
+        self._tasks[key] = task
+        if any(dep in self._failed for dep in task.get("depends_on", [])):
+            self._fail(key)
+            return False
+
+        pending = {dep for dep in task.get("depends_on", []) if dep not in self._completed}
+        if pending:
+            self._blocked[key] = {"task": task, "pending": pending}
+            for dep in pending:
+                self._dependents.setdefault(dep, set()).add(key)
+        else:
+            self._push_ready(key)
+        logging.debug(f"[TaskQueue] Added task: {key}")
+        return True
 
     def get_next_task(self) -> Dict[str, Any] or None:
-        """获取并移除队列中的下一个任务。"""
-        if self.queue:
-            task = self.queue.popleft()
-            print(f"[TaskQueue] Retrieved task: {task.get('name', 'Unnamed Task')}")
+        """获取并移除优先级最高的就绪任务。没有就绪任务时返回 None。"""
+        while self._ready:
+            _, _, key = heapq.heappop(self._ready)
+            task = self._tasks.pop(key, None)
+            if task is None:
+                continue  # 已被取消
+            self._running.add(key)
+            logging.debug(f"[TaskQueue] Retrieved task: {key}")
             return task
         return None
 
+    def mark_completed(self, key: str):
+        """标记任务完成，并释放所有依赖已满足的任务。"""
+        self._running.discard(key)
+        self._completed.add(key)
+        for dependent in self._dependents.pop(key, set()):
+            entry = self._blocked.get(dependent)
+            if entry is None:
+                continue
+            entry["pending"].discard(key)
+            if not entry["pending"]:
+                del self._blocked[dependent]
+                self._push_ready(dependent)
+
+    def mark_failed(self, key: str):
+        """标记任务失败，依赖它的任务（递归地）一并取消。"""
+        self._running.discard(key)
+        self._fail(key)
+
+    def is_completed(self, key: str) -> bool:
+        return key in self._completed
+
+    def has_ready(self) -> bool:
+        """是否有可以立即执行的任务。"""
+        return bool(self._ready)
+
     def is_empty(self) -> bool:
-        """检查任务队列是否为空。"""
-        return len(self.queue) == 0
+        """检查任务队列是否为空（不含执行中的任务）。"""
+        return len(self._tasks) == 0
 
     def size(self) -> int:
-        """返回任务队列中的任务数量。"""
-        return len(self.queue)
+        """返回任务队列中的任务数量（就绪和阻塞）。"""
+        return len(self._tasks)
+
+    def pending_keys(self) -> List[str]:
+        """返回所有待执行（就绪或阻塞）的任务键。"""
+        return list(self._tasks)
+
+    def blocked_tasks(self) -> List[str]:
+        """返回仍在等待依赖的任务键。"""
+        return list(self._blocked)
+
+    def _push_ready(self, key: str):
+        priority = self._tasks[key].get("priority", 0)
+        # 就绪时间，用于统计排队等待时长
+        self._tasks[key]["ready_at"] = time.monotonic()
+        heapq.heappush(self._ready, (priority, next(self._seq), key))
+
+    def _fail(self, key: str):
+        self._failed.add(key)
+        self._tasks.pop(key, None)
+        self._blocked.pop(key, None)
+        for dependent in self._dependents.pop(key, set()):
+            if dependent in self._tasks:
+                logging.warning(f"[TaskQueue] Cancelled task {dependent}: dependency {key} failed")
+                self._fail(dependent)
@@ -0,0 +1,196 @@
+# src/workflow/worker.py
+
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Dict, Any, Optional, Sequence
+
+from src.agent_manager import AgentManager
+from src.agents import BaseAgent
+from src.metrics import MetricsRecorder, agent_scope
+from src.llm_metrics import InstrumentedLLMClient
+from src.story import Character
+from src.workflow.durable_queue import DurableTaskQueue
+
+# 只在本进程内有意义、不随任务发送给 worker 的字段（回调和本机路径）
+_LOCAL_FIELDS = ("on_chunk", "on_chapter", "on_character", "stream_path")
+
+def encode_task(task: Dict[str, Any]) -> Dict[str, Any]:
+    """把章节任务转换为可以 JSON 序列化的形式（角色对象转为字典）。"""
+    payload = {key: value for key, value in task.items() if key not in _LOCAL_FIELDS}
+    if "characters" in payload:
+        payload["characters"] = [character.to_dict() for character in payload["characters"]]
+    return payload
+
+def decode_task(payload: Dict[str, Any]) -> Dict[str, Any]:
+    task = dict(payload)
+    if "characters" in task:
+        task["characters"] = [Character.from_dict(character) for character in task["characters"]]
+    return task
+
+class RemoteAgent(BaseAgent):
+    """协调进程中代替本地智能体的代理：把任务提交到持久化队列，等待某个 worker 执行后返回结果。
+
+    namespace 区分不同小说（批量创作时多部小说共用一个队列），任务键为 `<namespace>:<任务名>`。
+    timeout 为等待单个任务结果的秒数，超时（例如没有运行中的 worker）时任务失败；为空时一直等待。
+    """
+
+    def __init__(self, job_queue: DurableTaskQueue, agent_name: str, namespace: str, poll_interval: float = 0.2,
+                 timeout: Optional[float] = None):
+        super().__init__(f"Remote[{agent_name}]", llm=None)
+        self.job_queue = job_queue
+        self.agent_name = agent_name
+        self.namespace = namespace
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def job_key(self, task: Dict[str, Any]) -> str:
+        return f"{self.namespace}:{task['name']}"
+
+    def execute_task(self, task: dict) -> dict:
+        key = self._submit(task)
+        return self._result(key, self.job_queue.wait(key, timeout=self.timeout, poll_interval=self.poll_interval))
+
+    async def aexecute_task(self, task: dict) -> dict:
+        key = self._submit(task)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            outcome = self.job_queue.outcome(key)
+            if outcome is not None or (deadline is not None and time.monotonic() >= deadline):
+                return self._result(key, outcome)
+            await asyncio.sleep(self.poll_interval)
+
+    def acknowledge(self, task: Dict[str, Any]):
+        """结果已写入检查点：队列中的结果可以丢弃，之后再提交同一任务会重新执行。"""
+        self.job_queue.collect(self.job_key(task))
+
+    def purge(self) -> int:
+        """丢弃本小说在队列中的全部旧任务（不带 --resume 重新开始创作时调用）。"""
+        return self.job_queue.purge(f"{self.namespace}:")
+
+    def communicate(self, message: dict) -> dict:
+        return {"status": "error", "message": f"{self.name} does not accept messages."}
+
+    def _submit(self, task: Dict[str, Any]) -> str:
+        key = self.job_key(task)
+        if not self.job_queue.enqueue(key, self.agent_name, encode_task(task), priority=task.get("chapter_index", 0)):
+            logging.info(f"[Worker] {key} is already queued or finished; waiting for its result")
+        return key
+
+    def _result(self, key: str, outcome: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        if outcome is None:
+            # 任务留在队列中：之后 --resume 重新提交同一任务时，可以直接取回 worker 届时完成的结果
+            return {"status": "failed", "message": f"No worker finished {key} within {self.timeout}s; is a worker running?"}
+        if outcome["status"] == "completed":
+            return outcome["result"]
+        return {"status": "failed", "message": outcome["error"] or "Remote task failed."}
+
+class QueueWorker:
+    """从持久化队列领取任务并用本地智能体执行（`python -m src.main worker`）。
+
+    每个 worker 进程运行 concurrency 个执行线程和一个心跳线程；心跳每 lease_seconds/3 秒为在途任务续租，
+    进程崩溃后租约过期，任务由其他 worker 重新执行。idle_timeout 秒内没有任务时退出（为空时一直运行）。
+    LLM 调用指标保存到 `workers/<worker_id>.metrics.json`。
+    """
+
+    def __init__(self, job_queue: DurableTaskQueue, llm, storage=None, worker_id: Optional[str] = None,
+                 concurrency: int = 1, agents: Optional[Sequence[str]] = None, poll_interval: float = 1.0,
+                 idle_timeout: Optional[float] = None):
+        self.job_queue = job_queue
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.metrics = MetricsRecorder(name=self.worker_id)
+        self.agent_manager = AgentManager(InstrumentedLLMClient(llm, self.metrics))
+        self.storage = storage
+        self.concurrency = max(1, concurrency)
+        self.agents = list(agents) if agents else None
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.completed = 0
+        self.failed = 0
+        self._in_flight: Dict[str, str] = {}   # 任务键 -> 租约令牌
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._last_activity = time.monotonic()
+
+    def run(self):
+        logging.info(f"[Worker] {self.worker_id} started with {self.concurrency} slots; queue: {self.job_queue.path}")
+        threads = [threading.Thread(target=self._work, name=f"worker-{i}", daemon=True) for i in range(self.concurrency)]
+        heartbeat = threading.Thread(target=self._heartbeat, name="worker-heartbeat", daemon=True)
+        for thread in threads + [heartbeat]:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            logging.info("[Worker] Interrupted; returning unfinished jobs to the queue")
+        finally:
+            self.stop()
+            self._release_in_flight()
+            self.metrics.finish()
+            if self.storage is not None:
+                self.metrics.save(self.storage, os.path.join("workers", f"{self.worker_id}.metrics.json"))
+        logging.info(f"[Worker] {self.worker_id} stopped: {self.completed} completed, {self.failed} failed")
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self) -> bool:
+        """领取并执行一个任务；没有任务时返回 False。"""
+        job = self.job_queue.lease(self.worker_id, self.agents)
+        if job is None:
+            return False
+        key, token = job["key"], job["token"]
+        with self._lock:
+            self._in_flight[key] = token
+            self._last_activity = time.monotonic()
+        logging.info(f"[Worker] {self.worker_id} running {key} (attempt {job['attempts']})")
+        try:
+            with agent_scope(job["agent"]):
+                result = self.agent_manager.dispatch_task(job["agent"], decode_task(job["payload"]))
+        except Exception as e:
+            result = {"status": "failed", "message": str(e)}
+        with self._lock:
+            self._in_flight.pop(key, None)
+            self._last_activity = time.monotonic()
+
+        if result.get("status") == "completed":
+            accepted = self.job_queue.complete(key, token, result)
+            self.completed += accepted
+        else:
+            # LLM 客户端已经做过重试；这里重新排队，交给其他 worker（可能路由到其他服务商）再试
+            accepted = self.job_queue.fail(key, token, result.get("message", "failed"), retry=True)
+            self.failed += accepted
+        if not accepted:
+            logging.warning(f"[Worker] Lease on {key} was lost (re-delivered to another worker or replaced); result discarded")
+        return True
+
+    def _work(self):
+        while not self._stop.is_set():
+            if self.run_once():
+                continue
+            with self._lock:
+                idle = not self._in_flight and time.monotonic() - self._last_activity
+            if self.idle_timeout is not None and idle and idle >= self.idle_timeout:
+                logging.info(f"[Worker] No jobs for {self.idle_timeout}s; exiting")
+                self._stop.set()
+                return
+            self._stop.wait(self.poll_interval)
+
+    def _heartbeat(self):
+        interval = max(0.1, self.job_queue.lease_seconds / 3)
+        while not self._stop.wait(interval):
+            with self._lock:
+                leases = list(self._in_flight.items())
+            for key, token in leases:
+                if not self.job_queue.heartbeat(key, token):
+                    logging.warning(f"[Worker] Lost the lease on {key}")
+
+    def _release_in_flight(self):
+        with self._lock:
+            leases, self._in_flight = list(self._in_flight.items()), {}
+        for key, token in leases:
+            self.job_queue.release(key, token)
@@ -0,0 +1,35 @@
+from src.agents.json_output import JSONArrayItemStream
+
+
+def feed_in_chunks(stream, text, size=3):
+    items = []
+    for start in range(0, len(text), size):
+        items += stream.feed(text[start:start + size])
+    return items
+
+
+def test_top_level_array_items_are_emitted_as_they_close():
+    stream = JSONArrayItemStream()
+    assert stream.feed('[{"name": "A"}, {"na') == [{"name": "A"}]
+    assert stream.feed('me": "B"}]') == [{"name": "B"}]
+    assert stream.done
+
+
+def test_prose_preamble_with_brackets_is_skipped():
+    stream = JSONArrayItemStream()
+    text = 'Here is the list [of characters]: [{"name":"A"}, {"name":"B"}]'
+    assert feed_in_chunks(stream, text) == [{"name": "A"}, {"name": "B"}]
+    assert stream.done
+
+
+def test_array_start_split_across_chunks():
+    stream = JSONArrayItemStream()
+    assert stream.feed("Sure [note] [") == []
+    assert not stream.done
+    assert stream.feed(' {"name": "A"}]') == [{"name": "A"}]
+
+
+def test_keyed_array():
+    stream = JSONArrayItemStream("chapters")
+    text = '{"title": "T [draft]", "chapters": [{"title": "One"}, {"title": "Two"}]}'
+    assert feed_in_chunks(stream, text) == [{"title": "One"}, {"title": "Two"}]